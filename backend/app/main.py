@@ -1,13 +1,16 @@
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from .routers import upload, detect, report, user
+from .routers import upload, detect, report, user, admin, batch
 import matplotlib
 import os
 import subprocess
 import sys
-from .utils.database import engine, get_db
+import threading
+from .utils.database import get_db
+from .utils.async_database import async_engine
 from .utils.init_db import init_db
 from .utils.font_utils import init_fonts
+from .services.watchdog import task_watchdog
 
 # 确保可以导入字体工具模块
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -30,14 +33,6 @@ except Exception as e:
     matplotlib.use('Agg')
     print("使用默认字体设置")
 
-# 创建/更新数据库表
-from .schemas.database_models import Base
-try:
-    Base.metadata.create_all(bind=engine)
-    print("数据库表创建/更新成功")
-except Exception as e:
-    print(f"数据库表创建/更新失败: {str(e)}")
-
 app = FastAPI(
     title="AI论文检测工具",
     description="检测论文中AI生成内容的比例",
@@ -56,8 +51,10 @@ app.add_middleware(
 # 包含路由
 app.include_router(upload.router, prefix="/api", tags=["上传"])
 app.include_router(detect.router, prefix="/api", tags=["检测"])
+app.include_router(batch.router, prefix="/api", tags=["批量检测"])
 app.include_router(report.router, prefix="/api", tags=["报告"])
 app.include_router(user.router, prefix="/api", tags=["用户"])
+app.include_router(admin.router, prefix="/api", tags=["管理"])
 
 # 更新报告路由API文档
 for route in report.router.routes:
@@ -78,6 +75,14 @@ for route in report.router.routes:
         - includeHeaderFooter (bool): 是否包含页眉和页脚
         """
 
+def _warm_up_models():
+    try:
+        from .services.ai_detection_service import warm_up_models
+        warm_up_models()
+        print("本地模型预加载完成")
+    except Exception as e:
+        print(f"预加载本地模型时出错: {str(e)}")
+
 @app.on_event("startup")
 async def startup_event():
     """应用启动时执行的初始化操作"""
@@ -90,10 +95,30 @@ async def startup_event():
     except Exception as e:
         print(f"初始化字体时出错: {str(e)}")
         
+    # 在后台线程中预先加载本地模型，文本检测接口不必等待模型加载
+    if os.environ.get("PRELOAD_MODELS", "true").lower() == "true":
+        threading.Thread(target=_warm_up_models, name="warm-up-models", daemon=True).start()
+        
+    # 恢复上次运行中断的检测任务
+    if detect.RESUME_ON_STARTUP:
+        try:
+            detect.resume_interrupted_tasks()
+        except Exception as e:
+            print(f"恢复中断的检测任务时出错: {str(e)}")
+    
+    # 定期回收停滞、超时或没有作业的检测任务
+    task_watchdog.start()
+        
     # 显示离线模式状态
     if os.environ.get("OFFLINE_MODE", "false").lower() == "true":
         print("\n-----\n\n运行在离线模式，将只使用本地模型\n\n-----\n")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """关闭异步数据库连接池，aiosqlite 的连接线程不会阻止进程退出"""
+    task_watchdog.stop()
+    await async_engine.dispose()
+
 @app.get("/")
 async def root():
     return {"message": "欢迎使用AI论文检测工具API"}
@@ -0,0 +1,73 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+from typing import Optional
+from ..utils.database import get_db
+from ..services.auth import require_admin
+from ..services.llm_client import llm_client
+from ..services.ai_detection_service import get_coalescing_stats
+from ..services.job_queue import job_queue
+from ..services.worker_stats import load_worker_stats, merged_journal_entries
+from ..services.watchdog import task_watchdog
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+@router.get("/admin/llm/journal")
+async def get_llm_journal(limit: int = 200, task_id: Optional[str] = None, db: Session = Depends(get_db)):
+    """
+    导出最近的LLM调用日志和延迟百分位数
+    
+    文档检测在工作进程中执行，其调用记录来自各工作进程定期保存的快照（每个进程保存最近的部分记录），
+    API进程中只有文本检测接口的调用。summary 和 latency_ms 按进程分别统计。
+    
+    参数：
+    - limit: 返回的最大记录数
+    - task_id: 只返回指定检测任务的调用记录
+    """
+    workers = load_worker_stats(db)
+    summary = {"api": llm_client.journal.summary()}
+    latency = {"api": llm_client.journal.latency_percentiles()}
+    for worker_id, stats in workers.items():
+        summary[worker_id] = stats.get("journal", {}).get("summary")
+        latency[worker_id] = stats.get("journal", {}).get("latency_ms")
+    return {
+        "summary": summary,
+        "latency_ms": latency,
+        "entries": merged_journal_entries(llm_client.journal.entries(), workers, limit=limit, task_id=task_id),
+    }
+
+@router.get("/admin/llm/stats")
+async def get_llm_stats(db: Session = Depends(get_db)):
+    """
+    获取LLM客户端和本地模型计算的运行统计
+    
+    api 为API进程（文本检测接口）的统计，workers 为各工作进程最近一次保存的统计
+    """
+    workers = load_worker_stats(db)
+    return {
+        "api": {
+            "llm": llm_client.get_stats(),
+            "local_models": get_coalescing_stats(),
+        },
+        "workers": {
+            worker_id: {
+                "updated_at": stats.get("updated_at"),
+                "llm": stats.get("llm"),
+                "local_models": stats.get("local_models"),
+            }
+            for worker_id, stats in workers.items()
+        },
+    }
+
+
+@router.get("/admin/queue")
+async def get_queue_report(db: Session = Depends(get_db)):
+    """
+    获取检测作业队列的情况：各通道当前排队的作业数和最长等待时间、
+    统计窗口内领取的作业的等待时间，以及各用户执行中的作业数
+    """
+    return job_queue.wait_report(db)
+
+@router.get("/admin/watchdog")
+async def get_watchdog_stats():
+    """获取任务看门狗的检查次数和按原因统计的回收任务数"""
+    return task_watchdog.snapshot()
@@ -0,0 +1,252 @@
+from fastapi import APIRouter, File, Form, UploadFile, HTTPException, Depends
+from sqlalchemy.orm import Session
+from ..schemas.models import BatchUploadResponse, BatchStatus, UploadResponse, TaskStatus, JobLane
+from ..schemas.database_models import DetectionBatch, DetectionTask, User
+from ..utils.database import get_db
+from ..services.file_service import is_supported_filename, save_file_content, get_file_extension, clean_up_task_files
+from ..services.auth import get_current_user
+from ..services.job_queue import job_queue
+from ..services.task_state import transition
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import os
+import uuid
+import zipfile
+
+router = APIRouter()
+
+# 单个文件的大小限制，与单文件上传一致
+MAX_FILE_SIZE = 50 * 1024 * 1024
+# 一个批次最多包含的文件数
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "100"))
+
+def _zip_entry_name(info: zipfile.ZipInfo) -> str:
+    """压缩包中文件的文件名（不含目录）"""
+    name = info.filename
+    if not info.flag_bits & 0x800:
+        # 未标记UTF-8的文件名按CP437解码，中文系统创建的压缩包实际多为GBK编码
+        try:
+            name = name.encode("cp437").decode("gbk")
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return os.path.basename(name.replace("\\", "/"))
+
+def _read_upload(file: UploadFile) -> bytes:
+    file.file.seek(0)
+    return file.file.read()
+
+def _iter_upload_files(files: List[UploadFile]) -> Iterator[Tuple[str, Optional[Callable[[], bytes]]]]:
+    """
+    展开上传的文件和压缩包，逐个产出 (文件名, 读取内容的函数)
+
+    格式不支持或超过大小限制的文件读取函数为 None。内容在调用读取函数时才读取
+    （必须在迭代到下一个文件之前调用），只统计文件数时不需要解压
+    """
+    for file in files:
+        if get_file_extension(file.filename) == ".zip":
+            try:
+                archive = zipfile.ZipFile(file.file)
+            except zipfile.BadZipFile:
+                yield file.filename, None
+                continue
+            with archive:
+                for info in archive.infolist():
+                    name = _zip_entry_name(info)
+                    # 跳过目录和系统生成的隐藏文件
+                    if info.is_dir() or not name or name.startswith(".") or "__MACOSX" in info.filename:
+                        continue
+                    if not is_supported_filename(name) or info.file_size > MAX_FILE_SIZE:
+                        yield name, None
+                        continue
+                    yield name, lambda info=info: archive.read(info)
+            continue
+
+        file.file.seek(0, os.SEEK_END)
+        file_size = file.file.tell()
+        file.file.seek(0)
+        if not is_supported_filename(file.filename) or file_size > MAX_FILE_SIZE:
+            yield file.filename, None
+            continue
+        yield file.filename, lambda file=file: _read_upload(file)
+
+def _start_batch_tasks(db: Session, batch_id: str) -> int:
+    """
+    开始批次中所有尚未开始的任务
+
+    任务加入批量通道的作业队列，工作进程同时执行的同批次作业数受批次并发限制，
+    在同一工作进程中执行的同批次文档共享片段结果和LLM预算
+
+    Returns:
+        int: 开始的任务数
+    """
+    tasks = db.query(DetectionTask).filter(
+        DetectionTask.batch_id == batch_id,
+        DetectionTask.status == TaskStatus.UPLOADED.value
+    ).all()
+    # 同时开始同一批次时，每个任务只由成功修改状态的请求添加作业
+    started = [
+        task for task in tasks
+        if transition(db, task.id, TaskStatus.UPLOADED, TaskStatus.PROCESSING, commit=False)
+    ]
+    db.commit()
+
+    for task in started:
+        job_queue.enqueue(db, task, JobLane.BULK)
+    return len(started)
+
+def _get_batch_or_404(db: Session, batch_id: str, current_user: User) -> DetectionBatch:
+    batch = db.query(DetectionBatch).filter(
+        DetectionBatch.id == batch_id,
+        DetectionBatch.owner_id == current_user.id
+    ).first()
+    if not batch:
+        raise HTTPException(status_code=404, detail="批次不存在")
+    return batch
+
+@router.post("/batch/upload", response_model=BatchUploadResponse)
+async def upload_batch(
+    files: List[UploadFile] = File(...),
+    name: Optional[str] = Form(None),
+    start: bool = Form(True),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    批量上传多个论文文件（或包含这些文件的ZIP压缩包），在同一个批次中检测
+
+    参数：
+    - files: PDF、DOCX、TXT文件或ZIP压缩包，可以混合上传
+    - name: 批次名称，例如班级或作业名称
+    - start: 是否上传后立即开始检测，默认开始
+    """
+    # 先统计可检测的文件数（包括压缩包中的文件），超过限制时不保存任何文件
+    accepted = sum(1 for _, read in _iter_upload_files(files) if read is not None)
+    if accepted > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"一个批次最多包含{BATCH_MAX_FILES}个文件")
+    if not accepted:
+        raise HTTPException(status_code=400, detail="没有可检测的文件，请上传PDF、DOCX、TXT文件或包含这些文件的ZIP压缩包")
+
+    batch = DetectionBatch(name=name, owner_id=current_user.id)
+    db.add(batch)
+    db.flush()
+
+    loop = asyncio.get_event_loop()
+    uploaded = []
+    skipped = []
+    saved_task_ids = []
+    try:
+        for filename, read in _iter_upload_files(files):
+            if read is None:
+                skipped.append(filename)
+                continue
+            content = read()
+            task_id = str(uuid.uuid4())
+            saved_task_ids.append(task_id)
+            saved_name = await loop.run_in_executor(None, save_file_content, task_id, filename, content)
+            task = DetectionTask(
+                id=task_id,
+                filename=saved_name,
+                file_size=len(content),
+                status=TaskStatus.UPLOADED.value,
+                owner_id=current_user.id,
+                batch_id=batch.id
+            )
+            db.add(task)
+            uploaded.append(UploadResponse(
+                task_id=task_id,
+                status=TaskStatus.UPLOADED,
+                filename=saved_name,
+                file_size=len(content)
+            ))
+        db.commit()
+    except BaseException:
+        # 保存文件或写入数据库出错时撤销批次，并删除已保存的文件
+        db.rollback()
+        for task_id in saved_task_ids:
+            clean_up_task_files(task_id)
+        raise
+
+    if start:
+        _start_batch_tasks(db, batch.id)
+
+    return BatchUploadResponse(
+        batch_id=batch.id,
+        name=batch.name,
+        tasks=uploaded,
+        skipped=skipped,
+        started=start
+    )
+
+@router.post("/batch/{batch_id}/start")
+async def start_batch(
+    batch_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """开始批次中所有尚未开始的检测任务"""
+    _get_batch_or_404(db, batch_id, current_user)
+    started = _start_batch_tasks(db, batch_id)
+    if not started:
+        raise HTTPException(status_code=400, detail="批次中没有待开始的任务")
+    return {"message": f"已开始 {started} 个检测任务"}
+
+def _batch_status(status_counts: Dict[str, int], task_count: int) -> TaskStatus:
+    """根据各任务的状态得出批次的状态"""
+    uploaded = status_counts.get(TaskStatus.UPLOADED.value, 0)
+    failed = status_counts.get(TaskStatus.FAILED.value, 0)
+    if uploaded == task_count:
+        return TaskStatus.UPLOADED
+    if status_counts.get(TaskStatus.PROCESSING.value, 0) or uploaded:
+        return TaskStatus.PROCESSING
+    if failed == task_count:
+        return TaskStatus.FAILED
+    return TaskStatus.COMPLETED
+
+@router.get("/batch/{batch_id}", response_model=BatchStatus)
+async def get_batch_status(
+    batch_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    获取批次的汇总状态：各状态的任务数、整体进度、已完成任务的AI内容比例，
+    以及每个任务的状态和进度
+    """
+    batch = _get_batch_or_404(db, batch_id, current_user)
+    tasks = db.query(DetectionTask).filter(
+        DetectionTask.batch_id == batch_id
+    ).order_by(DetectionTask.created_at).all()
+
+    status_counts: Dict[str, int] = {}
+    task_statuses = []
+    completed_percentages = []
+    for task in tasks:
+        status_counts[task.status] = status_counts.get(task.status, 0) + 1
+        if task.status == TaskStatus.COMPLETED.value and task.ai_generated_percentage is not None:
+            completed_percentages.append(task.ai_generated_percentage)
+
+        snapshot = job_queue.progress(db, task.id) if task.status == TaskStatus.PROCESSING.value else None
+        task_statuses.append({
+            "task_id": task.id,
+            "filename": task.filename,
+            "status": task.status,
+            "detection_phase": task.detection_phase,
+            "ai_generated_percentage": task.ai_generated_percentage if task.status == TaskStatus.COMPLETED.value else None,
+            "segments_total": snapshot["segments_total"] if snapshot else None,
+            "segments_done": snapshot["segments_done"] if snapshot else None,
+        })
+
+    finished = status_counts.get(TaskStatus.COMPLETED.value, 0) + status_counts.get(TaskStatus.FAILED.value, 0)
+    return {
+        "batch_id": batch.id,
+        "name": batch.name,
+        "status": _batch_status(status_counts, len(tasks)),
+        "task_count": len(tasks),
+        "status_counts": status_counts,
+        "percent": round(finished / len(tasks) * 100, 1) if tasks else 0.0,
+        "ai_percentage_avg": round(sum(completed_percentages) / len(completed_percentages), 2) if completed_percentages else None,
+        "ai_percentage_max": max(completed_percentages) if completed_percentages else None,
+        "tasks": task_statuses,
+        "runtime": job_queue.batch_snapshot(db, batch_id),
+        "created_at": batch.created_at
+    }
@@ -1,61 +1,113 @@
-from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from ..schemas.models import DetectionResult, TaskStatus, ParagraphAnalysis, DetailedAnalysisResult
-from ..schemas.database_models import DetectionTask, ParagraphResult, User
-from ..utils.database import get_db, SessionLocal
-from ..services.file_service import extract_text, clean_up_task_files, UPLOAD_DIR
-from ..services.ai_detection_service import detect_ai_content, detect_ai_content_comprehensive
+from ..schemas.models import (
+    DetectionResult, TaskStatus, DetectionPhase, JobLane, ParagraphAnalysis, DetailedAnalysisResult,
+    TextDetectionRequest, TextDetectionResult
+)
+from ..schemas.database_models import DetectionTask, User
+from ..utils.database import SessionLocal
+from ..utils.async_database import get_async_db
+from ..services.file_service import iter_text_blocks, clean_up_task_files, UPLOAD_DIR
+from ..services.ai_detection_service import detect_ai_content_comprehensive, EmptyTextError
 from ..services.auth import get_current_user
-from typing import List, Dict, Any
+from ..services.llm_budget import TaskBudget
+from ..services.llm_journal import current_task_id
+from ..services.result_writer import ResultWriter, insert_paragraph_results
+from ..services.result_store import (
+    RESULT_STORAGE, StoredParagraph, compact_task_results, load_paragraph_results, store_result_blob
+)
+from ..services.checkpoint import (
+    load_checkpoint, save_source_text, save_segmentation, delete_checkpoint,
+    checkpointing_blocks, restore_completed_results
+)
+from ..services.detection_pipeline import split_segments, SegmentsHasher
+from ..services.cancellation import cancellation_registry, current_cancel_token, DetectionCancelled
+from ..services.batch import BatchContext
+from ..services.job_queue import job_queue
+from ..services.task_state import transition, current_status
+from ..services.text_detection import detect_text, TEXT_DETECTION_MAX_CHARS
+from ..services.progress import progress_registry, PHASE_ANALYZING, PHASE_COMPLETED, PHASE_FAILED, TERMINAL_PHASES
+from typing import List, Dict, Any, Optional
 import json
 import asyncio
 import os
+import time
+import threading
 
 router = APIRouter()
 
+# SSE连接在没有进度变化时发送心跳的间隔（秒）
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
+# 服务启动时是否为上次中断且没有排队作业的检测任务重新添加恢复作业
+RESUME_ON_STARTUP = os.getenv("RESUME_ON_STARTUP", "true").lower() == "true"
+
+# 进度由工作进程保存到数据库，SSE连接查询进度的间隔（秒）
+SSE_POLL_SECONDS = float(os.getenv("SSE_POLL_SECONDS", "2"))
+
+# 渐进式检测：先保存只基于本地指标的初步结果，再在后台进行LLM分析并更新结果。
+# 需要等全部片段的本地指标计算完才开始LLM分析，流水线各阶段不再重叠，默认关闭
+PROGRESSIVE_DETECTION = os.getenv("PROGRESSIVE_DETECTION", "false").lower() == "true"
+
+# 文本检测结果保存为任务时使用的文件名
+TEXT_TASK_FILENAME = "粘贴文本.txt"
+
+# 当前进程中正在执行的检测任务
+_running_tasks = set()
+_running_lock = threading.Lock()
+
+def _load_paragraph_details(db: Session, task_id: str) -> List[ParagraphAnalysis]:
+    """按片段顺序读取任务已写入的段落分析结果"""
+    paragraph_results = load_paragraph_results(db, task_id)
+    
+    # 构建详细结果
+    details = []
+    for p in paragraph_results:
+        # 创建包含详细指标的段落分析对象
+        additional_metrics = {}
+        if p.metrics_data:
+            try:
+                additional_metrics = json.loads(p.metrics_data)
+            except:
+                pass
+                
+        details.append(ParagraphAnalysis(
+            paragraph=p.paragraph,
+            ai_generated=p.ai_generated,
+            reason=p.reason,
+            confidence=p.confidence if p.confidence else None,
+            perplexity=p.perplexity if p.perplexity else None,
+            ai_likelihood=p.ai_likelihood if p.ai_likelihood else None,
+            additional_metrics=additional_metrics
+        ))
+    return details
+
 @router.get("/detect/{task_id}", response_model=DetectionResult)
 async def get_detection_status(
     task_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
-    """获取AI检测任务状态和结果"""
+    """
+    获取AI检测任务状态和结果
+    
+    前端在检测期间持续轮询此接口，使用异步会话查询，并发的轮询请求不会因数据库读取阻塞事件循环
+    """
     # 查询任务
-    task = db.query(DetectionTask).filter(
+    task = (await db.execute(select(DetectionTask).where(
         DetectionTask.id == task_id,
         DetectionTask.owner_id == current_user.id
-    ).first()
+    ))).scalars().first()
     
     if not task:
         raise HTTPException(status_code=404, detail="检测任务不存在")
     
     # 如果任务已完成，返回结果
     if task.status == TaskStatus.COMPLETED.value:
-        # 获取段落分析结果
-        paragraph_results = db.query(ParagraphResult).filter(
-            ParagraphResult.task_id == task_id
-        ).all()
-        
-        # 构建详细结果
-        details = []
-        for p in paragraph_results:
-            # 创建包含详细指标的段落分析对象
-            additional_metrics = {}
-            if p.metrics_data:
-                try:
-                    additional_metrics = json.loads(p.metrics_data)
-                except:
-                    pass
-                    
-            details.append(ParagraphAnalysis(
-                paragraph=p.paragraph,
-                ai_generated=p.ai_generated,
-                reason=p.reason,
-                confidence=p.confidence if p.confidence else None,
-                perplexity=p.perplexity if p.perplexity else None,
-                ai_likelihood=p.ai_likelihood if p.ai_likelihood else None,
-                additional_metrics=additional_metrics
-            ))
+        details = await db.run_sync(_load_paragraph_details, task_id)
         
         # 解析整体分析数据
         overall_analysis = None
@@ -105,100 +157,448 @@ async def get_detection_status(
             "ai_generated_percentage": task.ai_generated_percentage,
             "details": details,
             "overall_analysis": overall_analysis,
+            "detection_phase": task.detection_phase,
             "created_at": task.created_at,
             "updated_at": task.updated_at
         }
     
-    # 如果任务仍在处理中
+    # 如果任务仍在处理中，返回已经写入的片段结果，并附带工作进程最近一次心跳时保存的进度
+    if task.status == TaskStatus.PROCESSING.value:
+        progress_snapshot = await db.run_sync(job_queue.progress, task_id)
+    else:
+        progress_snapshot = None
+    details = await db.run_sync(_load_paragraph_details, task_id) if task.status == TaskStatus.PROCESSING.value else []
+    
+    # 渐进式检测已保存初步结果时一并返回，片段结果中已完成LLM分析的部分替换了初步结果
+    ai_generated_percentage = None
+    overall_analysis = None
+    if task.status == TaskStatus.PROCESSING.value and task.detection_phase == DetectionPhase.REFINING.value:
+        ai_generated_percentage = task.ai_generated_percentage
+        if task.overall_analysis_result:
+            try:
+                overall_analysis = json.loads(task.overall_analysis_result)
+            except ValueError as e:
+                print(f"解析初步分析数据时出错: {str(e)}")
     return {
         "task_id": task.id,
         "status": task.status,
         "filename": task.filename,
-        "ai_generated_percentage": None,
-        "details": [],
-        "overall_analysis": None,
+        "ai_generated_percentage": ai_generated_percentage,
+        "details": details,
+        "overall_analysis": overall_analysis,
+        "progress": progress_snapshot,
+        "detection_phase": task.detection_phase,
         "created_at": task.created_at,
         "updated_at": task.updated_at
     }
 
+def _stored_progress_snapshot(db: Session, task: DetectionTask) -> Dict[str, Any]:
+    """
+    任务的进度快照
+    
+    检测在工作进程中执行，实时进度只在工作进程的内存中；任务处理中时使用工作进程心跳时保存的进度，
+    没有保存的进度（尚未被领取）或任务已结束时根据数据库中的任务状态生成
+    """
+    if task.status == TaskStatus.PROCESSING.value:
+        snapshot = job_queue.progress(db, task.id)
+        if snapshot is not None:
+            return snapshot
+    return {
+        "task_id": task.id,
+        "phase": task.status,
+        "segments_total": None,
+        "segments_total_final": task.status in TERMINAL_PHASES,
+        "segments_done": None,
+        "percent": 100.0 if task.status == TaskStatus.COMPLETED.value else None,
+        "llm_in_flight": 0,
+        "eta_seconds": None,
+        "elapsed_seconds": None,
+        "message": None,
+        "version": 0,
+    }
+
+def _load_stored_progress(task_id: str) -> Dict[str, Any]:
+    db = SessionLocal()
+    try:
+        task = db.query(DetectionTask).filter(DetectionTask.id == task_id).first()
+        if not task:
+            return {"task_id": task_id, "phase": PHASE_FAILED, "message": "检测任务不存在", "version": 0}
+        return _stored_progress_snapshot(db, task)
+    finally:
+        db.close()
+
+async def _task_progress_or_404(task_id: str, db: AsyncSession, current_user: User) -> Dict[str, Any]:
+    """获取当前用户的任务的进度快照"""
+    task = (await db.execute(select(DetectionTask).where(
+        DetectionTask.id == task_id,
+        DetectionTask.owner_id == current_user.id
+    ))).scalars().first()
+    if not task:
+        raise HTTPException(status_code=404, detail="检测任务不存在")
+    return await db.run_sync(_stored_progress_snapshot, task)
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.get("/detect/{task_id}/progress")
+async def get_detection_progress(
+    task_id: str,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    获取检测任务的实时进度：片段总数、已完成数、进行中的LLM调用数和预计剩余时间
+    
+    进度为工作进程最近一次心跳时保存的进度，轮询此接口不会查询结果表；
+    使用异步会话查询，频繁的轮询不会阻塞事件循环
+    """
+    return await _task_progress_or_404(task_id, db, current_user)
+
+@router.get("/detect/{task_id}/events")
+async def stream_detection_events(
+    task_id: str,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    以 Server-Sent Events 推送检测任务的进度
+    
+    进度变化时发送 progress 事件，任务结束时发送 done 事件并关闭连接，
+    客户端收到 done 后再调用 GET /detect/{task_id} 获取完整结果
+    """
+    snapshot = await _task_progress_or_404(task_id, db, current_user)
+    # 连接保持期间不占用数据库连接，之后的进度在线程池中使用独立的会话查询
+    await db.close()
+    
+    async def event_stream():
+        # 检测在工作进程中执行，定期查询工作进程保存的进度
+        loop = asyncio.get_event_loop()
+        current = snapshot
+        last_version = None
+        last_sent = time.monotonic()
+        while True:
+            if current["phase"] in TERMINAL_PHASES:
+                yield _sse_event("done", current)
+                return
+            if current["version"] != last_version:
+                last_version = current["version"]
+                last_sent = time.monotonic()
+                yield _sse_event("progress", current)
+            elif time.monotonic() - last_sent >= SSE_HEARTBEAT_SECONDS:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(SSE_POLL_SECONDS)
+            current = await loop.run_in_executor(None, _load_stored_progress, task_id)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _persist_text_result(db: Session,
+                         owner_id: str,
+                         text: str,
+                         details: List[ParagraphAnalysis],
+                         overall_analysis: Dict[str, Any]) -> str:
+    """把文本检测结果保存为已完成的检测任务，返回任务ID"""
+    task = DetectionTask(
+        filename=TEXT_TASK_FILENAME,
+        file_size=len(text.encode("utf-8")),
+        status=TaskStatus.COMPLETED.value,
+        detection_phase=DetectionPhase.FINAL.value,
+        ai_generated_percentage=overall_analysis["ai_percentage"],
+        overall_perplexity=overall_analysis["perplexity"],
+        overall_analysis_result=json.dumps(overall_analysis),
+        owner_id=owner_id
+    )
+    db.add(task)
+    db.flush()
+    rows = [
+        {
+            "task_id": task.id,
+            "segment_index": index,
+            "paragraph": analysis.paragraph,
+            "ai_generated": analysis.ai_generated,
+            "reason": analysis.reason,
+            "perplexity": analysis.perplexity,
+            "ai_likelihood": analysis.ai_likelihood
+        }
+        for index, analysis in enumerate(details)
+    ]
+    if RESULT_STORAGE == "blob":
+        store_result_blob(db, task.id, [StoredParagraph(**row) for row in rows])
+    else:
+        insert_paragraph_results(db, rows)
+    db.commit()
+    return task.id
+
+@router.post("/detect/text", response_model=TextDetectionResult)
+async def detect_text_snippet(
+    payload: TextDetectionRequest,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    直接检测一段文本，在本次请求中完成检测并返回完整结果
+    
+    不写文件、不启动后台任务，适合检测单个段落。默认不创建任务，
+    persist 为 True 时把结果保存为已完成的任务，可以查询结果和生成报告
+    """
+    started = time.monotonic()
+    text = payload.text.strip()
+    if not text:
+        raise HTTPException(status_code=400, detail="文本不能为空")
+    if len(text) > TEXT_DETECTION_MAX_CHARS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"文本过长（{len(text)}字符），最多{TEXT_DETECTION_MAX_CHARS}字符，更长的文本请上传文件检测"
+        )
+    
+    detection_result, cached = await detect_text(text, skip_llm=payload.skip_llm)
+    overall_analysis = _build_overall_analysis(detection_result)
+    details = detection_result.get("detailed_analysis", [])
+    
+    task_id = None
+    if payload.persist:
+        task_id = await db.run_sync(_persist_text_result, current_user.id, text, details, overall_analysis)
+    
+    return {
+        "ai_generated_percentage": overall_analysis["ai_percentage"],
+        "details": details,
+        "overall_analysis": overall_analysis,
+        "task_id": task_id,
+        "cached": cached,
+        "elapsed_ms": round((time.monotonic() - started) * 1000, 1)
+    }
+
+def _task_lane(task: DetectionTask) -> JobLane:
+    """用户开始的检测进入交互通道，批量提交的任务进入批量通道"""
+    return JobLane.BULK if task.batch_id else JobLane.INTERACTIVE
+
 @router.post("/detect/{task_id}/start")
 async def start_detection(
     task_id: str,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """
     开始AI内容检测任务
+    
+    只把任务加入作业队列，检测由独立的工作进程执行
     """
     # 查询任务
-    task = db.query(DetectionTask).filter(DetectionTask.id == task_id).first()
+    task = (await db.execute(select(DetectionTask).where(DetectionTask.id == task_id))).scalars().first()
     
     if not task:
         raise HTTPException(status_code=404, detail="任务未找到")
     
-    # 检查任务状态
-    if task.status != TaskStatus.UPLOADED.value:
+    # 只有成功把任务从已上传改为处理中的请求添加作业；重复点击或客户端重试时直接返回
+    if not await db.run_sync(transition, task_id, TaskStatus.UPLOADED, TaskStatus.PROCESSING):
+        if await db.run_sync(current_status, task_id) in (TaskStatus.PROCESSING, TaskStatus.COMPLETED):
+            return {"message": "检测任务已启动"}
         raise HTTPException(status_code=400, detail="任务状态不正确，无法开始检测")
     
-    # 更新任务状态
-    task.status = TaskStatus.PROCESSING.value
-    db.commit()
-    
-    # 添加后台任务执行检测
-    background_tasks.add_task(
-        perform_detection_wrapper,
-        task_id=task_id,
-        filename=task.filename
-    )
+    # 添加检测作业，由工作进程领取执行
+    await db.run_sync(job_queue.enqueue, task, _task_lane(task))
     
     return {"message": "检测任务已启动"}
 
+@router.post("/detect/{task_id}/resume")
+async def resume_detection(
+    task_id: str,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    从断点恢复中断或失败的检测任务，已完成的片段不再重新检测
+    """
+    task = (await db.execute(select(DetectionTask).where(
+        DetectionTask.id == task_id,
+        DetectionTask.owner_id == current_user.id
+    ))).scalars().first()
+    
+    if not task:
+        raise HTTPException(status_code=404, detail="任务未找到")
+    
+    if task.status not in (TaskStatus.PROCESSING.value, TaskStatus.FAILED.value):
+        raise HTTPException(status_code=400, detail="只能恢复处理中断或失败的任务")
+    
+    if await db.run_sync(job_queue.active_job, task_id) is not None:
+        raise HTTPException(status_code=409, detail="任务已在队列中或正在运行，无需恢复")
+    
+    if not await db.run_sync(transition, task_id, (TaskStatus.PROCESSING, TaskStatus.FAILED), TaskStatus.PROCESSING):
+        raise HTTPException(status_code=400, detail="只能恢复处理中断或失败的任务")
+    
+    await db.run_sync(job_queue.enqueue, task, _task_lane(task), True)
+    
+    return {"message": "检测任务已恢复"}
+
 @router.delete("/detect/{task_id}/cancel")
 async def cancel_detection(
     task_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """
     取消正在进行的检测任务
     """
     # 查询任务
-    task = db.query(DetectionTask).filter(DetectionTask.id == task_id).first()
+    task = (await db.execute(select(DetectionTask).where(DetectionTask.id == task_id))).scalars().first()
     
     if not task:
         raise HTTPException(status_code=404, detail="任务未找到")
     
-    # 检查任务状态
-    if task.status != TaskStatus.PROCESSING.value:
+    # 更新任务状态，检测同时完成时不再取消
+    if not await db.run_sync(transition, task_id, TaskStatus.PROCESSING, TaskStatus.FAILED):
         raise HTTPException(status_code=400, detail="任务不在处理中，无法取消")
     
-    # 更新任务状态
-    task.status = TaskStatus.FAILED.value
-    db.commit()
+    # 排队中的作业不再执行；工作进程中正在执行的检测在下次心跳时发现任务已取消，
+    # 通过工作进程内的取消令牌停止：不再发起新的LLM调用，进行中的流式响应在下一个数据块处关闭
+    await db.run_sync(job_queue.cancel, task_id)
     
-    # 清理任务文件
-    clean_up_task_files(task_id)
+    # 清理任务文件（删除文件在线程池中进行）
+    await asyncio.get_event_loop().run_in_executor(None, clean_up_task_files, task_id)
     
     return {"message": "检测任务已取消"}
 
-def perform_detection_wrapper(task_id: str, filename: str):
+def perform_detection_wrapper(task_id: str,
+                              filename: str,
+                              resume: bool = False,
+                              batch: Optional[BatchContext] = None,
+                              retry: bool = False):
     """
-    后台任务包装器，调用异步检测函数
+    工作进程执行检测作业的入口，在新的事件循环中调用异步检测函数
     """
+    with _running_lock:
+        if task_id in _running_tasks:
+            print(f"任务 {task_id} 已在运行，忽略重复启动")
+            return
+        _running_tasks.add(task_id)
+    
     # 创建事件循环
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     
     # 执行异步任务
     try:
-        loop.run_until_complete(perform_detection(task_id, filename))
+        loop.run_until_complete(perform_detection(task_id, filename, resume=resume, batch=batch, retry=retry))
     finally:
         loop.close()
+        with _running_lock:
+            _running_tasks.discard(task_id)
 
-async def perform_detection(task_id: str, filename: str):
-    """执行AI内容检测的后台任务"""
+def resume_interrupted_tasks() -> int:
+    """
+    服务启动时为上次运行中断的检测任务（状态仍为处理中且没有排队或执行中的作业）添加恢复作业
+    
+    由工作进程执行的任务中断后，作业租约到期即被重新领取，不需要在这里恢复
+    
+    Returns:
+        int: 恢复的任务数
+    """
     db = SessionLocal()
+    try:
+        interrupted = [
+            task for task in db.query(DetectionTask).filter(DetectionTask.status == TaskStatus.PROCESSING.value).all()
+            if job_queue.active_job(db, task.id) is None
+        ]
+        for task in interrupted:
+            # 后台恢复的任务在优先级最低的通道中排队，不影响用户新开始的检测
+            job_queue.enqueue(db, task, JobLane.RESCORE, resume=True)
+    finally:
+        db.close()
+    
+    if interrupted:
+        print(f"恢复 {len(interrupted)} 个中断的检测任务")
+    return len(interrupted)
+
+async def _load_resume_source(task_id: str, filename: str, checkpoint: Optional[Dict[str, Any]]) -> str:
+    """恢复检测时的文本：优先使用断点中保存的文本，没有时重新从上传文件中提取"""
+    if checkpoint is not None and checkpoint.get("source_text"):
+        return checkpoint["source_text"]
+    if not (UPLOAD_DIR / task_id / filename).exists():
+        raise Exception("上传文件已被清理且没有保存的文本，无法恢复检测")
+    loop = asyncio.get_event_loop()
+    text = await loop.run_in_executor(None, lambda: "".join(iter_text_blocks(task_id, filename)))
+    await loop.run_in_executor(None, save_source_text, task_id, text)
+    return text
+
+def _build_overall_analysis(detection_result: Dict[str, Any]) -> Dict[str, Any]:
+    """根据检测结果构建保存到任务中的整体分析结果"""
+    # 确保ai_percentage有值且在0-100之间
+    ai_percentage = detection_result.get("ai_percentage", 0)
+    if ai_percentage is None:
+        print("警告: AI百分比为None，设置为0")
+        ai_percentage = 0
+    # 确保ai_percentage在有效范围内
+    ai_percentage = max(0, min(100, ai_percentage))
+    
+    # 确保avg_perplexity有值
+    avg_perplexity = detection_result.get("avg_perplexity", 0)
+    if avg_perplexity is None:
+        print("警告: 平均困惑度为None，设置为0")
+        avg_perplexity = 0
+    
+    # 构建整体分析结果
+    overall_analysis = {
+        "ai_percentage": ai_percentage,
+        "perplexity": avg_perplexity,
+        "style_consistency": detection_result.get("style_consistency", 0) or 0,
+        "ai_likelihood": detection_result.get("ai_likelihood", "未知") or "未知",
+        "segment_count": detection_result.get("segment_count", len(detection_result.get("detailed_analysis", []))),
+        "degraded": detection_result.get("degraded", False),
+        "degraded_segments": detection_result.get("degraded_segments", 0),
+        "llm_budget": detection_result.get("llm_budget"),
+        "pipeline": detection_result.get("pipeline"),
+        "sampling": detection_result.get("sampling"),
+        "preliminary": detection_result.get("preliminary", False)
+    }
+    return overall_analysis
+
+def _store_task_result(db: Session,
+                       task_id: str,
+                       overall_analysis: Dict[str, Any],
+                       phase: DetectionPhase,
+                       status: TaskStatus = TaskStatus.PROCESSING) -> bool:
+    """
+    保存任务的整体结果，仅当任务仍在处理中时写入，避免覆盖检测期间到达的取消
+    
+    Returns:
+        bool: 是否写入；为 False 时任务已被取消
+    """
+    return transition(db, task_id, TaskStatus.PROCESSING, status, {
+        DetectionTask.detection_phase: phase.value,
+        DetectionTask.ai_generated_percentage: overall_analysis["ai_percentage"],
+        DetectionTask.overall_perplexity: overall_analysis["perplexity"],
+        DetectionTask.overall_analysis_result: json.dumps(overall_analysis)
+    })
+
+async def perform_detection(task_id: str,
+                            filename: str,
+                            resume: bool = False,
+                            batch: Optional[BatchContext] = None,
+                            retry: bool = False):
+    """
+    执行AI内容检测的后台任务
+    
+    Args:
+        task_id: 任务ID
+        filename: 上传的文件名
+        resume: 是否从断点恢复，恢复时跳过已经写入结果的片段
+        batch: 批量提交时任务所属的批次，批次内的任务共享片段结果和LLM预算
+        retry: 出错后是否由作业队列重试；为 True 时出错不把任务置为失败，保留文件并重新抛出异常
+    """
+    db = SessionLocal()
+    # 让本任务发出的LLM调用在调用日志中带上任务ID
+    current_task_id.set(task_id)
+    # 先登记取消令牌再检查任务状态，之后到达的取消请求都能通知到本次检测
+    token = cancellation_registry.register(task_id)
+    current_cancel_token.set(token)
+    progress = progress_registry.get(task_id)
     
     try:
         # 获取任务
@@ -207,89 +607,109 @@ async def perform_detection(task_id: str, filename: str):
             print(f"任务 {task_id} 不存在")
             return
         
-        # 更新任务状态为处理中
-        task.status = TaskStatus.PROCESSING.value
+        # 启动检测的接口已将任务置为处理中，状态已变化说明任务在开始前被取消
+        if task.status != TaskStatus.PROCESSING.value:
+            print(f"任务 {task_id} 状态为 {task.status}，不再执行检测")
+            return
+        task.detection_phase = DetectionPhase.LOCAL_SCAN.value if PROGRESSIVE_DETECTION else None
         db.commit()
+        if progress is None:
+            progress = progress_registry.start(task_id, task.owner_id)
+        progress.set_phase(PHASE_ANALYZING)
         
-        # 使用extract_text函数读取文件内容，而不是直接打开
-        content = extract_text(task_id, filename)
-        if not content:
-            raise Exception("无法读取文件内容或文件为空")
-        
-        # 调用AI检测服务进行综合分析
-        detection_result = await detect_ai_content_comprehensive(content)
+        loop = asyncio.get_event_loop()
+        # 片段结果边分析边分批写入数据库，不在内存中保留全部结果
+        writer = ResultWriter(task_id)
+        completed = {}
         
-        # 确保ai_percentage有值且在0-100之间
-        ai_percentage = detection_result.get("ai_percentage", 0)
-        if ai_percentage is None:
-            print("警告: AI百分比为None，设置为0")
-            ai_percentage = 0
-        # 确保ai_percentage在有效范围内
-        ai_percentage = max(0, min(100, ai_percentage))
-        
-        # 更新任务状态和结果
-        task.status = TaskStatus.COMPLETED.value
-        task.ai_generated_percentage = ai_percentage
+        if resume:
+            # 重新切分文本，已写入且与当前切分一致的片段结果直接复用
+            checkpoint = await loop.run_in_executor(None, load_checkpoint, task_id)
+            source_text = await _load_resume_source(task_id, filename, checkpoint)
+            segments = await loop.run_in_executor(None, split_segments, source_text)
+            completed = await loop.run_in_executor(
+                None, restore_completed_results, task_id, segments, SegmentsHasher.of(segments), checkpoint
+            )
+            print(f"任务 {task_id} 从断点恢复，{len(completed)}/{len(segments)} 个片段已完成")
+            blocks = [source_text]
+        else:
+            await writer.reset()
+            await loop.run_in_executor(None, delete_checkpoint, task_id)
+            # 提取完成后保存完整文本，上传文件被清理后仍可恢复
+            blocks = checkpointing_blocks(task_id, iter_text_blocks(task_id, filename))
         
-        # 确保avg_perplexity有值
-        avg_perplexity = detection_result.get("avg_perplexity", 0)
-        if avg_perplexity is None:
-            print("警告: 平均困惑度为None，设置为0")
-            avg_perplexity = 0
-        task.overall_perplexity = avg_perplexity
+        async def _save_segmentation(segment_count: int, segments_hash: str):
+            await loop.run_in_executor(None, save_segmentation, task_id, segment_count, segments_hash)
         
-        # 构建整体分析结果
-        overall_analysis = {
-            "ai_percentage": ai_percentage,
-            "perplexity": avg_perplexity,
-            "style_consistency": detection_result.get("style_consistency", 0) or 0,
-            "ai_likelihood": detection_result.get("ai_likelihood", "未知") or "未知",
-            "segment_count": detection_result.get("segment_count", len(detection_result.get("detailed_analysis", [])))
-        }
+        async def _save_preliminary(preliminary: Dict[str, Any]):
+            # 初步的片段结果先全部写入，再保存初步整体结果，状态接口读取到的两者一致
+            await writer.flush(raise_errors=True)
+            if not _store_task_result(db, task_id, _build_overall_analysis(preliminary), DetectionPhase.REFINING):
+                raise DetectionCancelled(token.reason or "任务已取消")
+            progress.set_phase(PHASE_ANALYZING, "初步结果已生成，正在进行LLM分析")
+            print(f"任务 {task_id} 初步结果已保存，AI生成内容百分比: {preliminary.get('ai_percentage')}%")
         
-        # 将整体分析保存到数据库
-        task.overall_analysis_result = json.dumps(overall_analysis)
+        # 调用AI检测服务进行综合分析，文件内容逐块提取，提取的同时开始分析已提取的部分
+        # 文件为空时抛出 EmptyTextError
+        detection_result = await detect_ai_content_comprehensive(
+            blocks,
+            # 流式LLM调用中判断结论先于原因到达时记入进度，进度接口和SSE随即可见
+            on_segment_verdict=progress.segment_verdict,
+            budget=batch.budget if batch is not None and batch.budget is not None else TaskBudget.from_env(task_id),
+            segment_cache=batch.segment_cache if batch is not None else None,
+            progress=progress,
+            on_result=writer.add,
+            completed=completed,
+            on_segmented=_save_segmentation,
+            on_preliminary=_save_preliminary if PROGRESSIVE_DETECTION else None
+        )
+        await writer.close()
         
-        # 保存段落分析结果
-        for result in detection_result.get("detailed_analysis", []):
-            # 准备额外的指标数据
-            metrics_data = {}
-            if hasattr(result, 'additional_metrics') and result.additional_metrics:
-                metrics_data = result.additional_metrics
-            
-            # 创建段落结果
-            paragraph = ParagraphResult(
-                task_id=task_id,
-                paragraph=result.paragraph,
-                ai_generated=result.ai_generated,
-                reason=result.reason,
-                confidence=result.confidence if hasattr(result, 'confidence') else None,
-                perplexity=result.perplexity if hasattr(result, 'perplexity') else None,
-                ai_likelihood=result.ai_likelihood if hasattr(result, 'ai_likelihood') else None,
-                metrics_data=json.dumps(metrics_data) if metrics_data else None
-            )
-            db.add(paragraph)
+        overall_analysis = _build_overall_analysis(detection_result)
+        if overall_analysis["degraded"]:
+            print(f"任务 {task_id} 以降级模式运行，{overall_analysis['degraded_segments']} 个片段未经LLM分析")
         
-        db.commit()
-        print(f"任务 {task_id} 检测完成，AI生成内容百分比: {ai_percentage}%")
+        # 段落分析结果已由 ResultWriter 写入
+        if not _store_task_result(db, task_id, overall_analysis, DetectionPhase.FINAL, TaskStatus.COMPLETED):
+            raise DetectionCancelled(token.reason or "任务已取消")
+        progress.set_phase(PHASE_COMPLETED)
+        print(f"任务 {task_id} 检测完成，AI生成内容百分比: {overall_analysis['ai_percentage']}%")
         
-        # 检测完成后清理文件
+        # 检测完成后清理文件和断点
         clean_up_task_files(task_id)
+        await loop.run_in_executor(None, delete_checkpoint, task_id)
+        # 片段结果合并为压缩块；合并失败时结果仍保留在原有的行中
+        try:
+            await loop.run_in_executor(None, compact_task_results, task_id)
+        except Exception as e:
+            print(f"合并任务 {task_id} 的片段结果时出错: {str(e)}")
         
+    except DetectionCancelled as e:
+        # 取消接口已更新任务状态并清理文件，这里只停止检测，不再改写状态
+        print(f"任务 {task_id} 已取消，停止检测: {str(e)}")
+        if progress is not None:
+            progress.set_phase(PHASE_FAILED, "任务已取消")
     except Exception as e:
         print(f"检测过程中出错: {str(e)}")
         
-        # 更新任务状态为失败
+        # 文件为空时重试也不会成功
+        if retry and not isinstance(e, EmptyTextError):
+            if progress is not None:
+                progress.set_phase(PHASE_ANALYZING, f"检测出错，等待重试: {str(e)}")
+            raise
+        
+        # 更新任务状态为失败，任务已被取消时不再改写
         try:
-            task = db.query(DetectionTask).filter(DetectionTask.id == task_id).first()
-            if task:
-                task.status = TaskStatus.FAILED.value
-                db.commit()
+            db.rollback()
+            transition(db, task_id, TaskStatus.PROCESSING, TaskStatus.FAILED)
         except Exception as inner_e:
             print(f"更新任务状态时出错: {str(inner_e)}")
+        if progress is not None:
+            progress.set_phase(PHASE_FAILED, str(e))
             
         # 清理文件
         clean_up_task_files(task_id)
     finally:
+        cancellation_registry.unregister(task_id, token)
         # 确保关闭数据库会话
         db.close() 
\ No newline at end of file
@@ -1,13 +1,15 @@
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import io
 import json
 import os
 from datetime import datetime
-from ..schemas.database_models import DetectionTask, ParagraphResult, User
-from ..utils.database import get_db
+from ..schemas.database_models import DetectionTask, User
+from ..utils.async_database import get_async_db
 from ..services.auth import get_current_user
+from ..services.result_store import load_paragraph_results
 from ..schemas.models import TaskStatus
 import matplotlib
 import matplotlib.pyplot as plt
@@ -30,7 +32,7 @@ async def get_report(
     includeOriginalText: bool = False,
     includeMetadata: bool = True,
     includeHeaderFooter: bool = True,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """
@@ -46,7 +48,7 @@ async def get_report(
     - includeHeaderFooter: 是否包含页眉页脚
     """
     # 查询任务
-    task = db.query(DetectionTask).filter(DetectionTask.id == task_id).first()
+    task = (await db.execute(select(DetectionTask).where(DetectionTask.id == task_id))).scalars().first()
     
     if not task:
         raise HTTPException(status_code=404, detail="任务未找到")
@@ -58,9 +60,7 @@ async def get_report(
         raise HTTPException(status_code=400, detail="任务尚未完成，无法生成报告")
     
     # 获取段落分析结果
-    paragraph_results = db.query(ParagraphResult).filter(
-        ParagraphResult.task_id == task_id
-    ).all()
+    paragraph_results = await db.run_sync(load_paragraph_results, task_id)
     
     # 创建选项对象
     options = {
@@ -836,14 +836,14 @@ async def get_html_report(
     includeOriginalText: bool = False,
     includeMetadata: bool = True,
     includeHeaderFooter: bool = True,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """
     直接获取HTML格式的检测报告
     """
     # 查询任务
-    task = db.query(DetectionTask).filter(DetectionTask.id == task_id).first()
+    task = (await db.execute(select(DetectionTask).where(DetectionTask.id == task_id))).scalars().first()
     
     if not task:
         raise HTTPException(status_code=404, detail="任务未找到")
@@ -853,9 +853,7 @@ async def get_html_report(
         raise HTTPException(status_code=400, detail="任务尚未完成，无法生成报告")
     
     # 获取段落分析结果
-    paragraph_results = db.query(ParagraphResult).filter(
-        ParagraphResult.task_id == task_id
-    ).all()
+    paragraph_results = await db.run_sync(load_paragraph_results, task_id)
     
     # 创建选项对象
     options = {
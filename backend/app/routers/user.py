@@ -1,9 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from ..schemas.models import UserCreate, UserResponse, Token
-from ..schemas.database_models import User
+from ..schemas.database_models import DetectionTask, User
 from ..utils.database import get_db
+from ..utils.async_database import get_async_db
 from ..services.auth import (
     get_user, 
     authenticate_user, 
@@ -81,21 +84,33 @@ async def read_users_me(current_user: User = Depends(get_current_user)):
 
 @router.get("/user/tasks")
 async def get_user_tasks(
-    db: Session = Depends(get_db), 
+    db: AsyncSession = Depends(get_async_db), 
     current_user: User = Depends(get_current_user)
 ):
     """
     获取用户的所有检测任务
+    
+    只查询列表需要的列，不通过 current_user.detection_tasks 延迟加载整个任务对象（包括整体分析结果等大字段）
     """
-    tasks = []
-    for task in current_user.detection_tasks:
-        tasks.append({
-            "id": task.id,
-            "filename": task.filename,
-            "status": task.status,
-            "ai_generated_percentage": task.ai_generated_percentage,
-            "created_at": task.created_at,
-            "updated_at": task.updated_at
-        })
+    rows = (await db.execute(
+        select(
+            DetectionTask.id,
+            DetectionTask.filename,
+            DetectionTask.status,
+            DetectionTask.ai_generated_percentage,
+            DetectionTask.created_at,
+            DetectionTask.updated_at
+        ).where(DetectionTask.owner_id == current_user.id).order_by(DetectionTask.created_at)
+    )).all()
     
-    return tasks 
\ No newline at end of file
+    return [
+        {
+            "id": row.id,
+            "filename": row.filename,
+            "status": row.status,
+            "ai_generated_percentage": row.ai_generated_percentage,
+            "created_at": row.created_at,
+            "updated_at": row.updated_at
+        }
+        for row in rows
+    ] 
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, DateTime, Text
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, LargeBinary, String, Float, DateTime, Text, text
 from sqlalchemy.orm import relationship
 import uuid
 from datetime import datetime
@@ -20,11 +20,17 @@ class User(Base):
 
 class DetectionTask(Base):
     __tablename__ = "detection_tasks"
+    __table_args__ = (
+        # 批次状态按创建时间列出批次中的任务
+        Index("ix_detection_tasks_batch_id_created_at", "batch_id", "created_at"),
+        # 任务列表按创建时间列出用户的任务
+        Index("ix_detection_tasks_owner_id_created_at", "owner_id", "created_at"),
+    )
 
     id = Column(String, primary_key=True, default=generate_uuid)
     filename = Column(String)
     file_size = Column(Integer)
-    status = Column(String)
+    status = Column(String, index=True)
     ai_generated_percentage = Column(Float, nullable=True)
     
     # 添加整体分析结果
@@ -34,16 +40,26 @@ class DetectionTask(Base):
     overall_coherence_analysis = Column(String, nullable=True)  # JSON存储
     overall_style_analysis = Column(String, nullable=True)  # JSON存储
     overall_analysis_result = Column(String, nullable=True)  # 新的JSON格式存储所有分析结果
+    detection_phase = Column(String, nullable=True)  # 渐进式检测的阶段
+    heartbeat_at = Column(DateTime, nullable=True)  # 检测进度最近一次变化的时间
+    deadline_at = Column(DateTime, nullable=True)  # 本次执行的截止时间，按文档大小计算
     
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
-    owner_id = Column(String, ForeignKey("users.id"))
+    owner_id = Column(String, ForeignKey("users.id"), index=True)
+    # 批量提交时所属的批次
+    batch_id = Column(String, ForeignKey("detection_batches.id"), nullable=True, index=True)
     
     owner = relationship("User", back_populates="detection_tasks")
     paragraphs = relationship("ParagraphResult", back_populates="task")
+    batch = relationship("DetectionBatch", back_populates="tasks")
 
 class ParagraphResult(Base):
     __tablename__ = "paragraph_results"
+    __table_args__ = (
+        # 按任务读取片段结果并按序号排序
+        Index("ix_paragraph_results_task_id_segment_index", "task_id", "segment_index"),
+    )
 
     id = Column(String, primary_key=True, default=generate_uuid)
     paragraph = Column(Text)
@@ -58,5 +74,125 @@ class ParagraphResult(Base):
     metrics_data = Column(String, nullable=True)  # JSON存储所有其他指标
     
     task_id = Column(String, ForeignKey("detection_tasks.id"))
+    # 片段在文档中的序号，结果边分析边写入，按此排序还原文档顺序
+    segment_index = Column(Integer, nullable=True, index=True)
+    
+    task = relationship("DetectionTask", back_populates="paragraphs")
+
+class DetectionCheckpoint(Base):
+    """检测任务的断点信息，服务重启或任务中断后据此从已完成的片段继续检测"""
+    __tablename__ = "detection_checkpoints"
+
+    task_id = Column(String, ForeignKey("detection_tasks.id"), primary_key=True)
+    source_text = Column(Text, nullable=True)  # 提取出的完整文本，上传文件被清理后仍可恢复
+    segments_hash = Column(String, nullable=True)  # 切分结果的哈希，用于确认已写入的片段结果仍然有效
+    segment_count = Column(Integer, nullable=True)
+    
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+class TaskResultBlob(Base):
+    """
+    已完成任务的全部片段结果，压缩后存为一个二进制块（格式见 services/result_store.py）
+
+    检测期间片段结果逐批写入 paragraph_results，任务完成后合并到此表并删除原有的行
+    """
+    __tablename__ = "task_result_blobs"
+
+    task_id = Column(String, ForeignKey("detection_tasks.id"), primary_key=True)
+    format_version = Column(Integer)
+    segment_count = Column(Integer)
+    ai_segment_count = Column(Integer)
+    raw_size = Column(Integer)  # 压缩前的字节数
+    data = Column(LargeBinary)
+    
+    created_at = Column(DateTime, default=datetime.now)
+
+class DetectionBatch(Base):
+    """一次批量提交的多个检测任务"""
+    __tablename__ = "detection_batches"
+
+    id = Column(String, primary_key=True, default=generate_uuid)
+    name = Column(String, nullable=True)
+    owner_id = Column(String, ForeignKey("users.id"))
+    # 批次内任务共享的LLM预算的用量，由各工作进程原子累加（见 services/batch.py 中的 BatchBudget）
+    llm_calls = Column(Integer, default=0)
+    llm_rejected_calls = Column(Integer, default=0)
+    llm_prompt_tokens = Column(Integer, default=0)
+    llm_completion_tokens = Column(Integer, default=0)
+    llm_estimated_calls = Column(Integer, default=0)
+    llm_started_at = Column(DateTime, nullable=True)  # 批次第一次LLM调用的时间，墙钟时间预算从此算起
+    
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    tasks = relationship("DetectionTask", back_populates="batch")
+
+class BatchSegmentResult(Base):
+    """
+    批次内已经过LLM完整分析的片段结果，按空白规范化后的片段内容的哈希保存
+
+    同一批次的任务可能由不同的工作进程执行，相同片段的结果通过此表共享
+    """
+    __tablename__ = "batch_segment_results"
+
+    batch_id = Column(String, ForeignKey("detection_batches.id"), primary_key=True)
+    segment_key = Column(String, primary_key=True)
+    result = Column(Text)  # JSON存储片段结果（不含原文）
+    
+    created_at = Column(DateTime, default=datetime.now)
+
+class DetectionJob(Base):
+    """
+    检测作业队列
+
+    API进程只写入作业，独立的工作进程（worker.py）领取并执行；
+    领取时写入租约，执行期间定期心跳续约，进程退出后租约到期的作业由其他工作进程重新领取
+    """
+    __tablename__ = "detection_jobs"
+    __table_args__ = (
+        # 每个任务最多一个排队或执行中的作业，重复开始同一任务时不会启动两次检测
+        Index(
+            "ux_detection_jobs_active_task", "task_id", unique=True,
+            sqlite_where=text("status IN ('queued', 'running')")
+        ),
+    )
+
+    id = Column(String, primary_key=True, default=generate_uuid)
+    task_id = Column(String, ForeignKey("detection_tasks.id"), index=True)
+    batch_id = Column(String, nullable=True, index=True)  # 批量提交的任务所属批次，用于限制批次并发
+    owner_id = Column(String, nullable=True, index=True)  # 任务所属用户，用于公平分配和限制用户并发
+    lane = Column(String, default="interactive", index=True)  # 通道：interactive / bulk / rescore
+    resume = Column(Boolean, default=False)  # 是否从断点恢复
+    status = Column(String, index=True)
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    available_at = Column(DateTime, default=datetime.now, index=True)  # 重试时退避到此时间之后才能领取
+    queued_at = Column(DateTime, default=datetime.now)  # 进入队列（或重试退避结束）的时间
+    claimed_at = Column(DateTime, nullable=True, index=True)  # 最近一次被领取的时间
+    wait_seconds = Column(Float, nullable=True)  # 最近一次被领取前的排队等待时间
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    progress_data = Column(Text, nullable=True)  # JSON存储工作进程最近一次心跳时的进度
+    last_error = Column(Text, nullable=True)
+    
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    task = relationship("DetectionTask")
+
+class WorkerStats(Base):
+    """
+    工作进程的运行统计（LLM调用日志、对冲、端点和请求合并统计等）
+
+    检测在独立的工作进程中执行，这些统计只存在于工作进程的内存中；
+    工作进程定期把快照写入此表，管理接口与API进程自身的统计一起返回
+    """
+    __tablename__ = "worker_stats"
+
+    worker_id = Column(String, primary_key=True)
+    stats = Column(Text)  # JSON存储最近一次的统计快照
     
-    task = relationship("DetectionTask", back_populates="paragraphs") 
\ No newline at end of file
+    started_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, index=True)
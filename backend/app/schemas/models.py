@@ -9,6 +9,26 @@ class TaskStatus(str, Enum):
     COMPLETED = "completed"
     FAILED = "failed"
 
+class DetectionPhase(str, Enum):
+    """渐进式检测的阶段"""
+    LOCAL_SCAN = "local_scan"   # 正在计算本地指标，尚无结果
+    REFINING = "refining"       # 已保存只基于本地指标的初步结果，正在进行LLM分析
+    FINAL = "final"             # 已保存最终结果
+
+class JobLane(str, Enum):
+    """检测作业的通道，领取作业时按通道权重分配"""
+    INTERACTIVE = "interactive" # 用户直接开始或恢复的检测
+    BULK = "bulk"               # 批量提交的检测
+    RESCORE = "rescore"         # 服务启动时在后台恢复的检测
+
+class JobStatus(str, Enum):
+    """检测作业在队列中的状态"""
+    QUEUED = "queued"           # 等待工作进程领取（包括等待重试）
+    RUNNING = "running"         # 已被工作进程领取，租约到期前由该进程执行
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"           # 重试次数用完
+    CANCELLED = "cancelled"     # 任务在执行前或执行中被取消
+
 class ParagraphAnalysis(BaseModel):
     paragraph: str
     ai_generated: bool
@@ -33,6 +53,17 @@ class DetailedAnalysisResult(BaseModel):
     syntax_metrics: Optional[Dict[str, Any]] = None
     coherence_metrics: Optional[Dict[str, Any]] = None
     style_metrics: Optional[Dict[str, Any]] = None
+    # LLM不可用时部分片段只使用本地指标判断
+    degraded: Optional[bool] = None
+    degraded_segments: Optional[int] = None
+    # 任务LLM预算的使用情况，预算用完时记录原因和跳过的片段数
+    llm_budget: Optional[Dict[str, Any]] = None
+    # 检测流水线各阶段的处理数量和利用率
+    pipeline: Optional[Dict[str, Any]] = None
+    # 渐进式检测的初步结果只基于本地指标
+    preliminary: Optional[bool] = None
+    # 抽样检测时 ai_percentage 的置信区间和样本量
+    sampling: Optional[Dict[str, Any]] = None
 
 class DetectionResult(BaseModel):
     task_id: str
@@ -40,9 +71,31 @@ class DetectionResult(BaseModel):
     ai_generated_percentage: Optional[float] = None
     details: Optional[List[ParagraphAnalysis]] = None
     overall_analysis: Optional[DetailedAnalysisResult] = None
+    # 任务处理中时的实时进度
+    progress: Optional[Dict[str, Any]] = None
+    # 渐进式检测的阶段，处于 refining 时 ai_generated_percentage 和 overall_analysis 为初步结果
+    detection_phase: Optional[DetectionPhase] = None
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
 
+class TextDetectionRequest(BaseModel):
+    """直接检测一段文本的请求"""
+    text: str
+    # 跳过LLM分析，只使用本地指标，响应更快
+    skip_llm: bool = False
+    # 是否保存为检测任务，保存后可以像上传文件的任务一样查询结果和生成报告
+    persist: bool = False
+
+class TextDetectionResult(BaseModel):
+    ai_generated_percentage: Optional[float] = None
+    details: Optional[List[ParagraphAnalysis]] = None
+    overall_analysis: Optional[DetailedAnalysisResult] = None
+    # 仅在 persist 为 True 时创建任务
+    task_id: Optional[str] = None
+    # 结果是否来自缓存，以及接口处理耗时（毫秒）
+    cached: bool = False
+    elapsed_ms: Optional[float] = None
+
 class UploadResponse(BaseModel):
     task_id: str
     status: TaskStatus = TaskStatus.UPLOADED
@@ -50,6 +103,40 @@ class UploadResponse(BaseModel):
     file_size: int
     created_at: datetime = Field(default_factory=datetime.now)
 
+class BatchUploadResponse(BaseModel):
+    batch_id: str
+    name: Optional[str] = None
+    tasks: List[UploadResponse]
+    # 格式不支持或超过大小限制而未创建任务的文件
+    skipped: List[str] = []
+    started: bool = False
+
+class BatchTaskStatus(BaseModel):
+    task_id: str
+    filename: str
+    status: TaskStatus
+    detection_phase: Optional[DetectionPhase] = None
+    ai_generated_percentage: Optional[float] = None
+    segments_total: Optional[int] = None
+    segments_done: Optional[int] = None
+
+class BatchStatus(BaseModel):
+    """批次的汇总状态"""
+    batch_id: str
+    name: Optional[str] = None
+    status: TaskStatus
+    task_count: int
+    status_counts: Dict[str, int]
+    # 已结束（完成或失败）的任务比例
+    percent: float
+    # 已完成任务的AI生成内容比例
+    ai_percentage_avg: Optional[float] = None
+    ai_percentage_max: Optional[float] = None
+    tasks: List[BatchTaskStatus]
+    # 批次的并发上限，以及排队和执行中的作业数
+    runtime: Optional[Dict[str, Any]] = None
+    created_at: datetime = Field(default_factory=datetime.now)
+
 class UserBase(BaseModel):
     email: str
     username: str
@@ -4,9 +4,14 @@ import re
 import json
 import asyncio
 import numpy as np
-from typing import List, Dict, Tuple, Any, Optional
+from typing import List, Dict, Tuple, Any, Optional, Callable, Iterable, Union
 from ..schemas.models import ParagraphAnalysis
 from .llm_client import llm_client
+from .llm_resilience import LlmUnavailableError
+from .llm_budget import TaskBudget, BudgetExceededError, current_budget, get_current_budget
+from .singleflight import SingleFlight, content_key
+from .cancellation import DetectionCancelled
+from .sampling import SAMPLING_ENABLED, SequentialSampler
 
 # 导入NLP相关库
 from nltk.tokenize import sent_tokenize
@@ -80,6 +85,66 @@ def smart_split(text: str,
     else:
         raise ValueError("segment_level必须是'paragraph'或'sentence'")
 
+class IncrementalSegmenter:
+    """
+    增量版本的 smart_split
+
+    文本按块（例如逐页提取的内容）到达时，只切分已经遇到段落分隔符的部分，
+    剩余内容等待后续文本块，因此切分结果与对完整文本调用 smart_split 一致（片段内的空白可能略有不同）。
+    """
+
+    def __init__(self,
+                 min_chars: int = 30,
+                 max_chars: int = 300,
+                 segment_level: str = "sentence"):
+        if segment_level not in ("paragraph", "sentence"):
+            raise ValueError("segment_level必须是'paragraph'或'sentence'")
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.segment_level = segment_level
+        self._pending = ""  # 尚未遇到段落分隔符的文本
+        self._buffer = ""   # 等待与后续段落合并的过短段落
+
+    def feed(self, chunk: str) -> List[str]:
+        """加入一块文本，返回其中已经完整的片段"""
+        self._pending = (self._pending + chunk).replace('\r\n', '\n')
+        cut = self._pending.rfind('\n\n')
+        if cut < 0:
+            return []
+        head, self._pending = self._pending[:cut], self._pending[cut:]
+        return self._segment(self._blocks(head))
+
+    def finish(self) -> List[str]:
+        """文本结束，返回剩余的全部片段"""
+        blocks = self._blocks(self._pending)
+        self._pending = ""
+        if self._buffer:
+            blocks.append(self._buffer.strip())
+            self._buffer = ""
+        return self._segment(blocks)
+
+    def _blocks(self, text: str) -> List[str]:
+        """与 paragraph_split 相同的段落合并逻辑，过短段落的缓冲跨文本块保留"""
+        text = re.sub(r'\n{3,}', '\n\n', text).strip()
+        if not text:
+            return []
+        processed = []
+        for block in text.split('\n\n'):
+            block = block.strip()
+            if len(block) < self.min_chars:
+                self._buffer += " " + block
+            else:
+                if self._buffer:
+                    processed.append(self._buffer.strip())
+                    self._buffer = ""
+                processed.append(block)
+        return processed
+
+    def _segment(self, blocks: List[str]) -> List[str]:
+        if self.segment_level == "paragraph":
+            return blocks
+        return segment_sentences(blocks, max_chars=self.max_chars)
+
 def split_text_with_sliding_window(text: str, window_size: int = 500, step_size: int = 250) -> List[str]:
     """使用滑动窗口方法分割长文本"""
     if not text or len(text) <= window_size:
@@ -194,7 +259,15 @@ def get_gpt2_model():
     
     return _gpt2_model, _gpt2_tokenizer
 
+# 合并不同任务中相同片段的并发计算
+perplexity_flight = SingleFlight("perplexity")
+embedding_flight = SingleFlight("embedding")
+
 def compute_perplexity(text: str) -> float:
+    """计算文本的困惑度（perplexity），相同文本的并发计算只执行一次"""
+    return perplexity_flight.do(content_key(text or ""), _compute_perplexity, text)
+
+def _compute_perplexity(text: str) -> float:
     """计算文本的困惑度（perplexity）"""
     try:
         # 文本预处理：清理并检查文本内容
@@ -231,6 +304,44 @@ def compute_perplexity(text: str) -> float:
         print(f"计算困惑度时出错: {str(e)}")
         return 25.0  # 返回中等困惑度作为降级方案
 
+def compute_perplexities(texts: List[str]) -> List[float]:
+    """
+    批量计算多个文本的困惑度，整批文本填充到相同长度后一次前向计算
+    
+    结果与逐个调用 compute_perplexity 相同；批量计算出错时改为逐个计算
+    """
+    if len(texts) <= 1:
+        return [compute_perplexity(text) for text in texts]
+    
+    # 空文本和非常短的文本使用默认值，与单个计算一致
+    results = [25.0] * len(texts)
+    batch = [(i, text[:10000]) for i, text in enumerate(texts) if text and len(text.strip()) >= 5]
+    if not batch:
+        return results
+    try:
+        model, tokenizer = get_gpt2_model()
+        if model is None or tokenizer is None:
+            return results
+        # GPT-2没有填充词元，使用结束词元填充，填充位置由 attention_mask 排除
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        encodings = tokenizer([text for _, text in batch], return_tensors='pt', truncation=True, max_length=512, padding=True)
+        with torch.no_grad():
+            logits = model(input_ids=encodings["input_ids"], attention_mask=encodings["attention_mask"]).logits
+            # 与模型内置损失相同：用前一个位置的输出预测下一个词元，按每个文本的有效词元求平均
+            labels = encodings["input_ids"][:, 1:]
+            mask = encodings["attention_mask"][:, 1:].float()
+            losses = torch.nn.functional.cross_entropy(logits[:, :-1].transpose(1, 2), labels, reduction="none")
+            token_counts = mask.sum(dim=1)
+            perplexities = torch.exp((losses * mask).sum(dim=1) / token_counts.clamp(min=1))
+        for (i, text), perplexity, count in zip(batch, perplexities.tolist(), token_counts.tolist()):
+            # 只有一个词元的文本没有可预测的位置，单独计算以保持一致
+            results[i] = perplexity if count > 0 else compute_perplexity(text)
+        return results
+    except Exception as e:
+        print(f"批量计算困惑度时出错，改为逐个计算: {str(e)}")
+        return [compute_perplexity(text) for text in texts]
+
 # ----------- 风格一致性检测 -----------
 
 # 初始化句子编码模型
@@ -293,6 +404,22 @@ def get_embed_model():
     
     return _embed_model
 
+def encode_segments(segments: List[str]):
+    """计算片段的句向量，相同片段列表的并发计算只执行一次"""
+    return embedding_flight.do(content_key(*segments), lambda: get_embed_model().encode(segments))
+
+def warm_up_models():
+    """加载困惑度和句向量模型，避免第一次检测时才加载"""
+    get_gpt2_model()
+    get_embed_model()
+
+def get_coalescing_stats() -> Dict[str, Any]:
+    """返回本地模型计算的请求合并统计"""
+    return {
+        "perplexity": perplexity_flight.snapshot(),
+        "embedding": embedding_flight.snapshot(),
+    }
+
 def compute_style_consistency(segments: List[str]) -> float:
     """计算文本片段间的风格一致性"""
     try:
@@ -301,8 +428,7 @@ def compute_style_consistency(segments: List[str]) -> float:
             # 返回中等值，而不是0，避免因为段落少而导致AI可能性被低估
             return 0.5
             
-        embed_model = get_embed_model()
-        embeddings = embed_model.encode(segments)
+        embeddings = encode_segments(segments)
         similarities = []
         for i in range(len(embeddings) - 1):
             sim = cosine_similarity([embeddings[i]], [embeddings[i + 1]])[0][0]
@@ -316,6 +442,52 @@ def compute_style_consistency(segments: List[str]) -> float:
         print(f"计算风格一致性时出错: {str(e)}")
         return 0.5  # 返回中等值作为降级方案
 
+class StyleConsistencyAccumulator:
+    """
+    流式计算风格一致性
+
+    片段的句向量可以按任意顺序加入，相邻片段的向量都到达后立即计算相似度，
+    并丢弃两侧都已计算过的向量，最终结果与 compute_style_consistency 一致。
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.failed = False
+        self._embeddings = {}
+        self._pairs = {}  # 每个向量已参与计算的相邻片段对数量
+        self._similarities = []
+
+    def add(self, index: int, embedding) -> None:
+        """
+        加入第 index 个片段的句向量
+        
+        Args:
+            index: 片段序号，所有片段的序号需从0开始连续
+            embedding: 句向量，计算失败时传 None，结果将使用降级值
+        """
+        self.count += 1
+        if embedding is None:
+            self.failed = True
+            return
+        self._embeddings[index] = embedding
+        for left in (index - 1, index):
+            right = left + 1
+            if left in self._embeddings and right in self._embeddings:
+                sim = cosine_similarity([self._embeddings[left]], [self._embeddings[right]])[0][0]
+                self._similarities.append(sim)
+                for neighbor in (left, right):
+                    self._pairs[neighbor] = self._pairs.get(neighbor, 0) + 1
+                    if self._pairs[neighbor] == (1 if neighbor == 0 else 2):
+                        del self._embeddings[neighbor]
+                        del self._pairs[neighbor]
+
+    def value(self) -> float:
+        """当前已加入片段的风格一致性"""
+        if self.count < 2 or self.failed:
+            return 0.5
+        result = float(np.mean(self._similarities)) if self._similarities else 0.5
+        return max(result, 0.1)  # 确保风格一致性至少有一个最小值
+
 # ----------- AI评分整合 -----------
 
 def estimate_ai_likelihood(perplexity: float, style: float, ai_percentage: float, segment_count: int) -> str:
@@ -371,10 +543,81 @@ def estimate_ai_likelihood(perplexity: float, style: float, ai_percentage: float
         else:
             return "低（更可能为人类写作）"
 
-async def analyze_segment_comprehensive(segment: str) -> Dict[str, Any]:
-    """综合分析文本片段，计算困惑度和获取LLM评估"""
-    print(f"分析段落: {segment}")
-    if len(segment.strip()) < 20:  # 跳过过短的片段
+def perplexity_judgment(perplexity: float) -> Tuple[str, bool]:
+    """根据困惑度推断初步AI可能性，返回 (可能性评级, 是否判为AI生成)"""
+    if perplexity < 20:
+        return "高（AI生成可能性大）", True
+    elif perplexity < 30:
+        return "中（可能为AI生成）", perplexity < 25  # 25作为中等值的分界点
+    else:
+        return "低（更可能为人类写作）", False
+
+def score_segment_locally(segment: str) -> Dict[str, Any]:
+    """
+    计算片段的本地指标：困惑度及据此得出的初步判断，不调用LLM
+    
+    返回值同时作为LLM分析的上下文
+    """
+    try:
+        perplexity = compute_perplexity(segment)
+    except Exception as e:
+        print(f"为段落计算困惑度时出错: {str(e)}")
+        perplexity = 25.0  # 返回中等困惑度作为降级方案
+    return _local_scores(perplexity)
+
+def score_segments_locally(segments: List[str]) -> List[Dict[str, Any]]:
+    """批量计算多个片段的本地指标，结果与逐个调用 score_segment_locally 相同"""
+    try:
+        perplexities = compute_perplexities(segments)
+    except Exception as e:
+        print(f"为段落计算困惑度时出错: {str(e)}")
+        perplexities = [25.0] * len(segments)  # 返回中等困惑度作为降级方案
+    return [_local_scores(perplexity) for perplexity in perplexities]
+
+def _local_scores(perplexity: float) -> Dict[str, Any]:
+    # 根据困惑度推断初步AI可能性
+    ai_likelihood, initial_ai_judgment = perplexity_judgment(perplexity)
+    return {
+        "perplexity": perplexity,
+        "initial_likelihood": ai_likelihood,
+        "initial_judgment": initial_ai_judgment
+    }
+
+def local_segment_result(segment: str, local: Dict[str, Any], reason: str, degraded: bool = True) -> Dict[str, Any]:
+    """
+    只使用本地指标判断片段，用于LLM超时等无法完成综合分析的情况
+    
+    Args:
+        segment: 文本片段
+        local: score_segment_locally 的结果
+        reason: 判断原因说明，会附加困惑度数值
+        degraded: 是否计为降级；调用方主动跳过LLM分析时为 False
+    """
+    perplexity = local["perplexity"]
+    return {
+        "paragraph": segment,
+        "ai_generated": local["initial_judgment"],
+        "reason": f"{reason}，基于困惑度({perplexity:.2f})推断",
+        "perplexity": round(perplexity, 2),
+        "is_ai_likelihood": local["initial_likelihood"],
+        "degraded": degraded
+    }
+
+def preliminary_segment_result(segment: str, local: Dict[str, Any]) -> Dict[str, Any]:
+    """渐进式检测第一阶段的初步结果，只使用本地指标，LLM分析完成后被替换"""
+    perplexity = local["perplexity"]
+    return {
+        "paragraph": segment,
+        "ai_generated": local["initial_judgment"],
+        "reason": f"初步结果，基于困惑度({perplexity:.2f})推断，等待LLM分析",
+        "perplexity": round(perplexity, 2),
+        "is_ai_likelihood": local["initial_likelihood"],
+        "preliminary": True
+    }
+
+def short_segment_result(segment: str) -> Optional[Dict[str, Any]]:
+    """过短的片段无法有效分析，直接返回结果；否则返回 None"""
+    if len(segment.strip()) < 20:
         return {
             "paragraph": segment,
             "ai_generated": False,
@@ -382,36 +625,63 @@ async def analyze_segment_comprehensive(segment: str) -> Dict[str, Any]:
             "perplexity": 0,
             "is_ai_likelihood": "未知"
         }
+    return None
+
+async def analyze_segment_comprehensive(segment: str, on_verdict: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    综合分析文本片段，计算困惑度和获取LLM评估
     
+    Args:
+        segment: 文本片段
+        on_verdict: 可选回调，LLM流式输出判断结论时立即调用，不必等待完整原因
+    """
+    print(f"分析段落: {segment}")
+    short_result = short_segment_result(segment)
+    if short_result is not None:  # 跳过过短的片段
+        return short_result
+    
+    # 首先计算困惑度（带错误处理）
+    local = score_segment_locally(segment)
+    return await refine_segment_with_llm(segment, local, on_verdict=on_verdict)
+
+async def refine_segment_with_llm(segment: str,
+                                  local: Dict[str, Any],
+                                  on_verdict: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    在本地指标的基础上获取LLM评估，得出片段的最终判断
+    
+    Args:
+        segment: 文本片段
+        local: score_segment_locally 的结果，作为上下文传给LLM
+        on_verdict: 可选回调，LLM流式输出判断结论时立即调用，不必等待完整原因
+    """
     try:
-        # 首先计算困惑度（带错误处理）
-        try:
-            perplexity = compute_perplexity(segment)
-        except Exception as e:
-            print(f"为段落计算困惑度时出错: {str(e)}")
-            perplexity = 25.0  # 返回中等困惑度作为降级方案
-        
-        # 根据困惑度推断初步AI可能性
-        if perplexity < 20:
-            ai_likelihood = "高（AI生成可能性大）"
-            initial_ai_judgment = True
-        elif perplexity < 30:
-            ai_likelihood = "中（可能为AI生成）"
-            initial_ai_judgment = perplexity < 25  # 25作为中等值的分界点
-        else:
-            ai_likelihood = "低（更可能为人类写作）"
-            initial_ai_judgment = False
+        perplexity = local["perplexity"]
+        ai_likelihood = local["initial_likelihood"]
+        initial_ai_judgment = local["initial_judgment"]
         
-        # 将困惑度和初步判断作为上下文传递给LLM进行分析
-        context = {
-            "perplexity": perplexity,
-            "initial_likelihood": ai_likelihood,
-            "initial_judgment": initial_ai_judgment
-        }
-        
-        # 使用LLM客户端分析文本，将困惑度作为上下文传入
+        # 使用LLM客户端分析文本，将困惑度和初步判断作为上下文传入
+        # LLM服务熔断时直接走本地判断，不再等待失败的调用
+        degraded = False
+        budget_skipped = False
         try:
-            is_ai_generated, reason = await llm_client.analyze_text(segment, context=context)
+            budget = get_current_budget()
+            if budget is not None and budget.exhausted:
+                raise BudgetExceededError("任务LLM预算已用完")
+            if not llm_client.is_available():
+                raise LlmUnavailableError("LLM服务熔断中")
+            is_ai_generated, reason = await llm_client.analyze_text(segment, context=local, on_verdict=on_verdict)
+        except BudgetExceededError:
+            # 预算用完后剩余片段只使用本地指标判断
+            is_ai_generated = initial_ai_judgment
+            reason = f"任务LLM预算已用完，基于困惑度({perplexity:.2f})推断"
+            budget_skipped = True
+        except LlmUnavailableError:
+            is_ai_generated = initial_ai_judgment
+            reason = f"LLM服务暂不可用，基于困惑度({perplexity:.2f})推断"
+            degraded = True
+        except DetectionCancelled:
+            raise
         except Exception as e:
             print(f"调用LLM客户端分析文本时出错: {str(e)}")
             # 当LLM分析失败时，使用困惑度来进行基本判断
@@ -438,8 +708,12 @@ async def analyze_segment_comprehensive(segment: str) -> Dict[str, Any]:
             "ai_generated": is_ai_generated,
             "reason": reason,
             "perplexity": round(perplexity, 2),
-            "is_ai_likelihood": final_ai_likelihood
+            "is_ai_likelihood": final_ai_likelihood,
+            "degraded": degraded,
+            "budget_skipped": budget_skipped
         }
+    except DetectionCancelled:
+        raise
     except Exception as e:
         print(f"分析段落时出错: {str(e)}")
         return {
@@ -450,87 +724,182 @@ async def analyze_segment_comprehensive(segment: str) -> Dict[str, Any]:
             "is_ai_likelihood": "未知"
         }
 
-async def detect_ai_content_comprehensive(text: str) -> Dict[str, Any]:
+class EmptyTextError(ValueError):
+    """从文件中没有提取到任何文本"""
+
+async def detect_ai_content_comprehensive(
+    text: Union[str, Iterable[str]],
+    on_segment_verdict: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+    budget: Optional[TaskBudget] = None,
+    sampling: Optional[bool] = None,
+    **pipeline_options
+) -> Dict[str, Any]:
     """
     综合检测文本中的AI生成内容
     使用多种指标：困惑度、风格一致性、语言模型评估
     
+    Args:
+        text: 待检测文本，或按顺序产出文本块的迭代器（例如逐页提取的文件内容），
+            为迭代器时没有提取到任何文本会抛出 EmptyTextError
+        on_segment_verdict: 可选回调，某个片段的LLM判断结论到达时以 (片段序号, 结论) 调用
+        budget: 可选的任务LLM预算，用完后剩余片段使用本地判断
+        sampling: 是否使用抽样检测，默认取 DETECTION_SAMPLING 配置。抽样时只有部分片段经LLM分析，
+            ai_percentage 为分层抽样的估计值，置信区间和样本量记录在返回值的 sampling 中
+        **pipeline_options: 传给 DetectionPipeline 的其他选项，例如
+            progress: 任务进度（TaskProgress），处理片段时实时更新
+            on_result: 按片段顺序以 (片段序号, 结果) 调用的协程函数，用于边分析边写入数据库；
+                提供时片段结果不再保留在内存中，返回值的 detailed_analysis 为空
+            completed: 恢复检测时已经完成的片段结果，这些片段不再重新分析
+            on_segmented: 切分完成时以 (片段数, 片段列表哈希) 调用的协程函数
+            skip_llm: 为 True 时跳过LLM分析，所有片段只使用本地指标判断
+            on_preliminary: 渐进式检测：所有片段的本地指标计算完成后，以只基于本地指标的初步整体结果调用的
+                协程函数，之后再进行LLM分析；初步的片段结果同样交给 on_result
+    
     Returns:
         Dict: 包含AI生成内容的综合分析结果
     """
+    # 预算通过上下文变量传递给各片段的分析协程和LLM客户端
+    budget_token = current_budget.set(budget) if budget is not None else None
+    try:
+        if sampling is None:
+            sampling = SAMPLING_ENABLED
+        if sampling:
+            pipeline_options["sampler"] = SequentialSampler()
+        return await _detect_ai_content_comprehensive(text, on_segment_verdict, budget, pipeline_options)
+    finally:
+        if budget_token is not None:
+            current_budget.reset(budget_token)
+
+async def _detect_ai_content_comprehensive(
+    text: Union[str, Iterable[str]],
+    on_segment_verdict: Optional[Callable[[int, Dict[str, Any]], None]],
+    budget: Optional[TaskBudget],
+    pipeline_options: Dict[str, Any]
+) -> Dict[str, Any]:
+    # 流水线模块依赖本模块中的分析函数，在此处导入避免循环导入
+    from .detection_pipeline import DetectionPipeline
+    
     try:
-        # 使用智能拆分方式分割文本
-        segments = smart_split(text, segment_level="sentence")
-        print(f"分割后的片段数量: {len(segments)}")
+        # 提取、切分、本地指标、LLM分析各阶段通过有界队列并行执行
+        pipeline = DetectionPipeline(on_segment_verdict=on_segment_verdict, **pipeline_options)
+        summary = await pipeline.run([text] if isinstance(text, str) else text)
         
-        # 过滤掉太短的段落
-        valid_segments = [segment for segment in segments if len(segment) >= 20]
+        if not isinstance(text, str) and pipeline.extracted_chars == 0:
+            raise EmptyTextError("无法读取文件内容或文件为空")
         
-        if not valid_segments:
+        if pipeline.segment_count == 0:
             return {
                 "ai_percentage": 0,
                 "avg_perplexity": 0,
                 "style_consistency": 0,
                 "ai_likelihood": "未知",
                 "segment_count": 0,
+                "pipeline": pipeline.report(),
                 "detailed_analysis": []
             }
         
-        # 计算风格一致性（带错误处理）
-        try:
-            style_score = compute_style_consistency(valid_segments)
-        except Exception as e:
-            print(f"计算风格一致性失败: {str(e)}")
-            style_score = 0.5  # 使用中等风格一致性作为降级方案
-        
-        # 创建并发任务分析每个段落
-        tasks = [analyze_segment_comprehensive(segment) for segment in valid_segments]
+        if pipeline.sampler is not None:
+            sampling_report = pipeline.sampler.report()
+            result = summary.finish(pipeline.style_consistency(), budget, ai_percentage=sampling_report["ai_percentage"])
+            result["sampling"] = sampling_report
+        else:
+            result = summary.finish(pipeline.style_consistency(), budget)
+        result["pipeline"] = pipeline.report()
+        return result
+    except (EmptyTextError, DetectionCancelled):
+        raise
+    except Exception as e:
+        print(f"AI内容检测过程中出现严重错误: {str(e)}")
+        # 返回一个最小有效结果，确保至少有ai_percentage为0
+        return {
+            "ai_percentage": 0,
+            "avg_perplexity": 0,
+            "style_consistency": 0,
+            "ai_likelihood": f"检测失败: {str(e)}",
+            "segment_count": 0,
+            "detailed_analysis": []
+        }
+
+class SegmentSummary:
+    """
+    逐个累计片段分析结果，计算整体指标
         
-        # 控制并发数
-        MAX_CONCURRENCY = 2
-        detailed_analysis = []
-        ai_segments_count = 0
-        perplexity_values = []
+    只保存计数和困惑度总和，片段结果写入数据库后不必保留在内存中
+    """
+
+    def __init__(self, keep_details: bool = True):
+        """
+        Args:
+            keep_details: 是否保留每个片段的 ParagraphAnalysis 用于返回
+        """
+        self.keep_details = keep_details
+        self.detailed_analysis: List[ParagraphAnalysis] = []
+        self.count = 0
+        self.ai_segments_count = 0
+        self.degraded_segments_count = 0
+        self.budget_skipped_count = 0
+        self.perplexity_sum = 0.0
+        self.perplexity_count = 0
+
+    def add(self, result: Any) -> Optional[ParagraphAnalysis]:
+        """
+        加入一个片段的分析结果
         
-        # 分批处理任务
-        for i in range(0, len(tasks), MAX_CONCURRENCY):
-            batch = tasks[i:i+MAX_CONCURRENCY]
-            batch_results = await asyncio.gather(*batch, return_exceptions=True)
+        Returns:
+            ParagraphAnalysis: 片段分析结果，分析出错（结果为异常对象）时返回 None
+        """
+        # 跳过异常
+        if isinstance(result, Exception):
+            print(f"段落分析出现异常: {str(result)}")
+            return None
             
-            for result in batch_results:
-                # 跳过异常
-                if isinstance(result, Exception):
-                    print(f"段落分析出现异常: {str(result)}")
-                    continue
-                    
-                # 处理结果
-                if result["ai_generated"]:
-                    ai_segments_count += 1
-                
-                if result["perplexity"] > 0:
-                    perplexity_values.append(result["perplexity"])
-                
-                # 添加到结果
-                detailed_analysis.append(ParagraphAnalysis(
-                    paragraph=result["paragraph"],
-                    ai_generated=result["ai_generated"],
-                    reason=result["reason"],
-                    perplexity=result["perplexity"],
-                    ai_likelihood=result["is_ai_likelihood"]
-                ))
+        # 处理结果
+        self.count += 1
+        if result["ai_generated"]:
+            self.ai_segments_count += 1
+        
+        if result.get("degraded"):
+            self.degraded_segments_count += 1
+        
+        if result.get("budget_skipped"):
+            self.budget_skipped_count += 1
+        
+        if result["perplexity"] > 0:
+            self.perplexity_sum += result["perplexity"]
+            self.perplexity_count += 1
         
+        analysis = ParagraphAnalysis(
+            paragraph=result["paragraph"],
+            ai_generated=result["ai_generated"],
+            reason=result["reason"],
+            perplexity=result["perplexity"],
+            ai_likelihood=result["is_ai_likelihood"]
+        )
+        if self.keep_details:
+            self.detailed_analysis.append(analysis)
+        return analysis
+
+    def finish(self, style_score: float, budget: Optional[TaskBudget] = None, ai_percentage: Optional[float] = None) -> Dict[str, Any]:
+        """
+        计算整体指标
+        
+        Args:
+            style_score: 风格一致性
+            budget: 任务LLM预算，用于报告预算使用情况
+            ai_percentage: 抽样检测时由抽样估计给出的AI内容比例，为 None 时按全部片段计算
+        """
         # 计算AI生成内容百分比 - 增加安全检查，确保一定有有效值
-        segment_count = len(detailed_analysis)
+        segment_count = self.count
         # 确保分母不为零
-        if segment_count > 0:
-            ai_percentage = (ai_segments_count / segment_count) * 100
-        else:
+        if segment_count == 0:
             ai_percentage = 0
             print("警告: 没有有效的段落分析结果")
+        elif ai_percentage is None:
+            ai_percentage = (self.ai_segments_count / segment_count) * 100
         
         # 计算平均困惑度
-        if perplexity_values:
-            avg_perplexity = round(np.mean(perplexity_values), 2)
+        if self.perplexity_count:
+            avg_perplexity = round(self.perplexity_sum / self.perplexity_count, 2)
         else:
             avg_perplexity = 0
             print("警告: 没有有效的困惑度值")
@@ -542,7 +911,7 @@ async def detect_ai_content_comprehensive(text: str) -> Dict[str, Any]:
                 # 确保困惑度值合理 - 不再强行调整数值，因为这可能与LLM判断不一致
                 if avg_perplexity > 30:
                     print(f"注意: 全部段落被判为AI但困惑度较高({avg_perplexity})")
-                
+            
                 # 风格一致性仍可适当调整，因为这不影响段落级判断
                 if style_score < 0.8:
                     style_score = max(style_score, 0.85)  # 确保至少达到中等一致性
@@ -561,67 +930,8 @@ async def detect_ai_content_comprehensive(text: str) -> Dict[str, Any]:
             "style_consistency": round(style_score, 3),
             "ai_likelihood": ai_likelihood,
             "segment_count": segment_count,  # 添加段落数量信息
-            "detailed_analysis": detailed_analysis
+            "degraded": self.degraded_segments_count > 0,  # 是否有片段因LLM不可用而只使用本地判断
+            "degraded_segments": self.degraded_segments_count,
+            "llm_budget": dict(budget.snapshot(), skipped_segments=self.budget_skipped_count) if budget is not None else None,
+            "detailed_analysis": self.detailed_analysis
         }
-    except Exception as e:
-        print(f"AI内容检测过程中出现严重错误: {str(e)}")
-        # 返回一个最小有效结果，确保至少有ai_percentage为0
-        return {
-            "ai_percentage": 0,
-            "avg_perplexity": 0,
-            "style_consistency": 0,
-            "ai_likelihood": f"检测失败: {str(e)}",
-            "segment_count": 0,
-            "detailed_analysis": []
-        }
-
-# 保留原有功能以兼容旧接口
-async def analyze_segment(segment: str) -> Tuple[bool, str, str]:
-    """分析单个文本段落（兼容旧接口）"""
-    try:
-        is_ai_generated, reason = await llm_client.analyze_text(segment)
-        return is_ai_generated, reason, segment
-    except Exception as e:
-        print(f"分析段落时出错: {str(e)}")
-        return False, f"分析出错: {str(e)}", segment
-
-async def detect_ai_content(text: str, window_size: int = 500, step_size: int = 250) -> Tuple[float, List[ParagraphAnalysis]]:
-    """检测文本中的AI生成内容（兼容旧接口）"""
-    segments = smart_split(text, segment_level="sentence", max_chars=window_size)
-    print(f"分割后的片段数量: {len(segments)}")
-    
-    results = []
-    ai_segments_count = 0
-    
-    valid_segments = [segment for segment in segments if len(segment) >= 20]
-    
-    if not valid_segments:
-        return 0, []
-    
-    tasks = [analyze_segment(segment) for segment in valid_segments]
-    
-    MAX_CONCURRENCY = 2
-    
-    for i in range(0, len(tasks), MAX_CONCURRENCY):
-        batch = tasks[i:i+MAX_CONCURRENCY]
-        batch_results = await asyncio.gather(*batch, return_exceptions=True)
-        
-        for result in batch_results:
-            if isinstance(result, Exception):
-                print(f"段落分析出现异常: {str(result)}")
-                continue
-                
-            is_ai_generated, reason, segment = result
-            
-            if is_ai_generated:
-                ai_segments_count += 1
-            
-            results.append(ParagraphAnalysis(
-                paragraph=segment,
-                ai_generated=is_ai_generated,
-                reason=reason
-            ))
-    
-    ai_percentage = (ai_segments_count / len(results)) * 100 if results else 0
-    
-    return ai_percentage, results 
\ No newline at end of file
@@ -1,12 +1,15 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, status, Header
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 import os
 from typing import Optional
-from ..utils.database import get_db
+from ..utils.async_database import get_async_db
 from ..schemas.database_models import User
 from ..schemas.models import TokenData
 
@@ -14,6 +17,8 @@ from ..schemas.models import TokenData
 SECRET_KEY = os.getenv("SECRET_KEY", "af45d34a2b9584949af6be5cbb30b978fdd3b7fac3f5a8c41eac23c5c4b78902")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# 管理接口令牌，未配置时管理接口与其他接口一样不做校验
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
 # 密码处理
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -51,11 +56,13 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    """获取当前用户"""
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    """获取当前用户（使用异步会话，查询不阻塞事件循环）"""
     # 跳过令牌验证，直接返回一个默认的访客用户
     # 检查数据库中是否已有访客用户，如果没有则创建一个
-    guest_user = db.query(User).filter(User.email == "guest@example.com").first()
+    guest_user = (await db.execute(
+        select(User).where(User.email == "guest@example.com")
+    )).scalars().first()
     
     if guest_user is None:
         # 创建一个新的访客用户
@@ -67,7 +74,21 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
             created_at=datetime.utcnow()
         )
         db.add(guest_user)
-        db.commit()
-        db.refresh(guest_user)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # 并发的请求已创建访客用户
+            await db.rollback()
+            guest_user = (await db.execute(
+                select(User).where(User.email == "guest@example.com")
+            )).scalars().first()
     
-    return guest_user 
\ No newline at end of file
+    return guest_user 
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """校验管理接口令牌（请求头 X-Admin-Token）"""
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="无权访问管理接口",
+        )
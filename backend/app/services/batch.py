@@ -0,0 +1,330 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
+from ..utils.database import SessionLocal
+from ..schemas.database_models import BatchSegmentResult, DetectionBatch
+from .llm_budget import TaskBudget, BudgetExceededError, _env_number
+from .cancellation import DetectionCancelled
+from .singleflight import SingleFlight, content_key
+
+# 同一批次中同时检测的文档数
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "2"))
+# 批次的作业都结束后本地指标在工作进程中保留的时间（秒），之后领取的同批次作业仍可使用
+BATCH_CONTEXT_TTL_SECONDS = float(os.getenv("BATCH_CONTEXT_TTL_SECONDS", "600"))
+
+
+class BatchBudget(TaskBudget):
+    """
+    批次内所有任务共享的LLM预算，用量保存在 detection_batches 表中
+
+    同一批次的作业由多个工作进程执行，登记调用是带条件的 UPDATE：只有各项用量仍在限额内时
+    才累加调用次数，多个进程同时登记时也不会超出限额。墙钟时间从批次第一次LLM调用算起。
+    """
+
+    def __init__(self,
+                 batch_id: str,
+                 max_tokens: Optional[int] = None,
+                 max_calls: Optional[int] = None,
+                 max_seconds: Optional[float] = None):
+        super().__init__(task_id=f"batch:{batch_id}", max_tokens=max_tokens,
+                         max_calls=max_calls, max_seconds=max_seconds)
+        self.batch_id = batch_id
+        self.llm_started_at: Optional[datetime] = None
+
+    @classmethod
+    def from_env(cls, batch_id: str) -> Optional["BatchBudget"]:
+        """
+        根据环境变量配置创建批次预算
+
+        Returns:
+            BatchBudget: 批次预算；未配置任何批次限制时返回 None，各任务使用自己的预算
+        """
+        budget = cls(
+            batch_id,
+            max_tokens=_env_number("BATCH_LLM_MAX_TOKENS"),
+            max_calls=_env_number("BATCH_LLM_MAX_CALLS"),
+            max_seconds=_env_number("BATCH_LLM_MAX_SECONDS", float),
+        )
+        if budget.max_tokens is None and budget.max_calls is None and budget.max_seconds is None:
+            return None
+        return budget
+
+    @property
+    def elapsed(self) -> float:
+        if self.llm_started_at is None:
+            return 0.0
+        return (datetime.now() - self.llm_started_at).total_seconds()
+
+    def _refresh(self):
+        """从数据库读取批次的最新用量（调用方需持有锁）"""
+        db = SessionLocal()
+        try:
+            row = db.query(DetectionBatch).filter(DetectionBatch.id == self.batch_id).first()
+            if row is None:
+                return
+            self.calls = row.llm_calls or 0
+            self.rejected_calls = row.llm_rejected_calls or 0
+            self.prompt_tokens = row.llm_prompt_tokens or 0
+            self.completion_tokens = row.llm_completion_tokens or 0
+            self.estimated_calls = row.llm_estimated_calls or 0
+            self.llm_started_at = row.llm_started_at
+        finally:
+            db.close()
+
+    def _check_locked(self) -> Optional[str]:
+        # 预算用完后不会再恢复，之后不必再查询数据库
+        if self.exhausted_reason is None:
+            self._refresh()
+        return super()._check_locked()
+
+    def _within_limits(self, now: datetime):
+        """批次用量仍在各项限额内的条件"""
+        conditions = [DetectionBatch.id == self.batch_id]
+        if self.max_calls is not None:
+            conditions.append(func.coalesce(DetectionBatch.llm_calls, 0) < self.max_calls)
+        if self.max_tokens is not None:
+            conditions.append(
+                func.coalesce(DetectionBatch.llm_prompt_tokens, 0)
+                + func.coalesce(DetectionBatch.llm_completion_tokens, 0) < self.max_tokens
+            )
+        if self.max_seconds is not None:
+            conditions.append(or_(
+                DetectionBatch.llm_started_at.is_(None),
+                DetectionBatch.llm_started_at > now - timedelta(seconds=self.max_seconds)
+            ))
+        return conditions
+
+    def acquire_call(self):
+        """
+        发出LLM调用前在数据库中登记一次调用
+
+        Raises:
+            BudgetExceededError: 批次预算已用完
+        """
+        with self._lock:
+            reason = self.exhausted_reason
+            if reason is None:
+                now = datetime.now()
+                db = SessionLocal()
+                try:
+                    acquired = db.query(DetectionBatch).filter(*self._within_limits(now)).update({
+                        DetectionBatch.llm_calls: func.coalesce(DetectionBatch.llm_calls, 0) + 1,
+                        DetectionBatch.llm_started_at: func.coalesce(DetectionBatch.llm_started_at, now),
+                    }, synchronize_session=False)
+                    db.commit()
+                finally:
+                    db.close()
+                if acquired:
+                    return
+                # 其他工作进程已用完预算，查询具体原因
+                reason = self._check_locked() or "calls"
+            self._add({DetectionBatch.llm_rejected_calls: func.coalesce(DetectionBatch.llm_rejected_calls, 0) + 1})
+            raise BudgetExceededError(f"批次LLM预算已用完: {reason}")
+
+    def record_usage(self, prompt_tokens: int, completion_tokens: int, estimated: bool = False):
+        """把一次调用实际消耗的token累加到批次的用量中"""
+        values = {
+            DetectionBatch.llm_prompt_tokens: func.coalesce(DetectionBatch.llm_prompt_tokens, 0) + prompt_tokens,
+            DetectionBatch.llm_completion_tokens: func.coalesce(DetectionBatch.llm_completion_tokens, 0) + completion_tokens,
+        }
+        if estimated:
+            values[DetectionBatch.llm_estimated_calls] = func.coalesce(DetectionBatch.llm_estimated_calls, 0) + 1
+        self._add(values)
+
+    def _add(self, values: Dict[Any, Any]):
+        db = SessionLocal()
+        try:
+            db.query(DetectionBatch).filter(DetectionBatch.id == self.batch_id).update(
+                values, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refresh()
+        return super().snapshot()
+
+
+class SharedSegmentCache:
+    """
+    批次内各文档共享的片段分析结果
+
+    同一批作业中常有相同的文本（题目、模板、互相抄写的段落），
+    空白规范化后相同的片段只计算一次本地指标、只调用一次LLM，
+    其他文档中的相同片段直接使用已有结果。
+
+    同一批次的作业可能由不同的工作进程执行：经LLM完整分析的结果保存在 batch_segment_results 表中，
+    所有工作进程共用；本地指标和句向量只在本进程中共享。本进程中各文档的检测运行在
+    不同线程的事件循环中，内存中的状态都在锁内修改。
+    """
+
+    def __init__(self, batch_id: str):
+        self.batch_id = batch_id
+        self.local_hits = 0
+        self.result_hits = 0
+        self.stored_results = 0
+        self._local: Dict[str, Tuple[Dict[str, Any], Any]] = {}
+        self._flight = SingleFlight("batch_segment")
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(segment: str) -> str:
+        return content_key(" ".join(segment.split()))
+
+    def get_local(self, segment: str) -> Optional[Tuple[Dict[str, Any], Any]]:
+        """返回片段已计算的 (本地指标, 句向量)，没有时返回 None"""
+        with self._lock:
+            hit = self._local.get(self.key(segment))
+            if hit is not None:
+                self.local_hits += 1
+            return hit
+
+    def put_local(self, segment: str, local: Dict[str, Any], embedding: Any):
+        with self._lock:
+            self._local[self.key(segment)] = (local, embedding)
+
+    async def refine(self, segment: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        获取片段的分析结果，批次中还没有相同片段的结果时调用 compute 计算
+
+        本进程中正在计算的相同片段只等待它的结果；只保存经LLM完整分析的结果，
+        超时、降级或预算用完时的本地判断不保存，之后的相同片段仍会尝试LLM分析。
+        不同工作进程同时分析同一片段时各自调用LLM，先写入的结果被保留。
+        """
+        key = self.key(segment)
+        loop = asyncio.get_event_loop()
+        cached = await loop.run_in_executor(None, self._load_result, key)
+        if cached is not None:
+            with self._lock:
+                self.result_hits += 1
+        else:
+            async def _compute_and_store():
+                result = await compute()
+                if isinstance(result, dict) and not _is_local_only(result):
+                    await loop.run_in_executor(None, self._store_result, key, result)
+                return result
+
+            # 计算该片段的文档被取消时，其他文档自行重新计算
+            cached = await self._flight.do_async(key, _compute_and_store, retry_on=(DetectionCancelled,))
+        if isinstance(cached, dict):
+            # 结果中的原文使用当前文档的片段
+            return dict(cached, paragraph=segment)
+        return cached
+
+    def _load_result(self, key: str) -> Optional[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            data = db.query(BatchSegmentResult.result).filter(
+                BatchSegmentResult.batch_id == self.batch_id,
+                BatchSegmentResult.segment_key == key
+            ).scalar()
+        finally:
+            db.close()
+        return json.loads(data) if data else None
+
+    def _store_result(self, key: str, result: Dict[str, Any]):
+        # 原文由使用结果的文档填入，不重复保存
+        data = json.dumps({name: value for name, value in result.items() if name != "paragraph"},
+                          ensure_ascii=False, default=float)
+        db = SessionLocal()
+        try:
+            db.add(BatchSegmentResult(batch_id=self.batch_id, segment_key=key, result=data))
+            db.commit()
+            with self._lock:
+                self.stored_results += 1
+        except IntegrityError:
+            # 其他工作进程已保存了相同片段的结果
+            db.rollback()
+        finally:
+            db.close()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            flight = self._flight.snapshot()
+            return {
+                "unique_segments": len(self._local),
+                "local_hits": self.local_hits,
+                "llm_results": self.stored_results,
+                "llm_hits": self.result_hits + flight["shared"],
+            }
+
+
+def _is_local_only(result: Dict[str, Any]) -> bool:
+    return any(result.get(name) for name in ("degraded", "budget_skipped", "unsampled", "preliminary"))
+
+
+class BatchContext:
+    """
+    工作进程中正在执行的批次：共享的片段结果和共享的LLM预算
+
+    片段结果和预算用量保存在数据库中，由执行该批次作业的所有工作进程共用。
+    批次的并发由作业队列在领取作业时限制，同时执行的同批次作业不超过 BATCH_MAX_CONCURRENCY；
+    本进程中该批次的作业都结束且空闲超过 BATCH_CONTEXT_TTL_SECONDS 后批次从注册表中移除。
+    """
+
+    def __init__(self, batch_id: str):
+        self.batch_id = batch_id
+        self.budget = BatchBudget.from_env(batch_id)
+        self.segment_cache = SharedSegmentCache(batch_id)
+        self.pending = 0
+        self.last_used = time.time()
+        self._lock = threading.Lock()
+
+    def run(self, fn: Callable[..., Any], *args) -> Any:
+        """在当前线程中执行 fn(*args)，执行期间批次保留在注册表中"""
+        with self._lock:
+            self.pending += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.last_used = time.time()
+            batch_registry.prune()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "pending_tasks": self.pending,
+            "dedup": self.segment_cache.snapshot(),
+            "llm_budget": self.budget.snapshot() if self.budget is not None else None,
+        }
+
+
+class BatchRegistry:
+    """进程内正在执行的批次"""
+
+    def __init__(self):
+        self._batches: Dict[str, BatchContext] = {}
+        self._lock = threading.Lock()
+
+    def get_or_create(self, batch_id: str) -> BatchContext:
+        self.prune()
+        with self._lock:
+            context = self._batches.get(batch_id)
+            if context is None:
+                context = self._batches[batch_id] = BatchContext(batch_id)
+            return context
+
+    def get(self, batch_id: str) -> Optional[BatchContext]:
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def prune(self):
+        """移除空闲时间超过保留期的批次"""
+        now = time.time()
+        with self._lock:
+            expired = [batch_id for batch_id, context in self._batches.items()
+                       if context.pending == 0 and now - context.last_used > BATCH_CONTEXT_TTL_SECONDS]
+            for batch_id in expired:
+                del self._batches[batch_id]
+
+
+batch_registry = BatchRegistry()
@@ -0,0 +1,138 @@
+import asyncio
+import threading
+import contextvars
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+class DetectionCancelled(Exception):
+    """检测任务已被取消"""
+
+
+class CancellationToken:
+    """
+    检测任务的取消令牌
+
+    取消请求来自处理接口请求的事件循环，检测任务运行在另一个线程的事件循环中，
+    LLM调用和本地模型计算运行在线程池中，因此令牌状态可以在任意线程中查询，
+    取消时通过回调唤醒各自的事件循环。
+    """
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "任务已取消"):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"执行取消回调时出错: {str(e)}")
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise DetectionCancelled(self.reason)
+
+    def add_callback(self, callback: Callable[[], None]):
+        """注册取消时调用的回调（在调用 cancel 的线程中执行），已取消时立即调用"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    async def guard(self, awaitable: Awaitable):
+        """
+        等待 awaitable 完成；令牌先被取消时取消它并抛出 DetectionCancelled
+
+        用于检测流程中长时间等待的位置，取消请求到达后立即停止等待，
+        不必等正在进行的片段分析结束。
+        """
+        future = asyncio.ensure_future(awaitable)
+        loop = asyncio.get_event_loop()
+        waiter = loop.create_future()
+
+        def _wake_waiter():
+            if not waiter.done():
+                waiter.set_result(None)
+
+        def _on_cancel():
+            try:
+                loop.call_soon_threadsafe(_wake_waiter)
+            except RuntimeError:
+                # 事件循环已经关闭
+                pass
+
+        self.add_callback(_on_cancel)
+        try:
+            await asyncio.wait({future, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        finally:
+            self.remove_callback(_on_cancel)
+        if future.done():
+            return future.result()
+        future.cancel()
+        raise DetectionCancelled(self.reason)
+
+
+# 当前协程所属检测任务的取消令牌，由检测流程设置，LLM客户端和调度器据此提前停止
+current_cancel_token = contextvars.ContextVar("current_cancel_token", default=None)
+
+
+def get_current_cancel_token() -> Optional[CancellationToken]:
+    return current_cancel_token.get()
+
+
+class CancellationRegistry:
+    """进程内正在运行的检测任务的取消令牌"""
+
+    def __init__(self):
+        self._tokens: Dict[str, CancellationToken] = {}
+        self._lock = threading.Lock()
+
+    def register(self, task_id: str) -> CancellationToken:
+        token = CancellationToken(task_id)
+        with self._lock:
+            self._tokens[task_id] = token
+        return token
+
+    def unregister(self, task_id: str, token: CancellationToken):
+        with self._lock:
+            if self._tokens.get(task_id) is token:
+                del self._tokens[task_id]
+
+    def cancel(self, task_id: str, reason: str = "任务已取消") -> bool:
+        """
+        取消正在运行的任务
+
+        Returns:
+            bool: 任务是否正在本进程中运行
+        """
+        with self._lock:
+            token = self._tokens.get(task_id)
+        if token is None:
+            return False
+        token.cancel(reason)
+        return True
+
+
+cancellation_registry = CancellationRegistry()
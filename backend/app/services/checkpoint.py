@@ -0,0 +1,122 @@
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from ..schemas.database_models import DetectionCheckpoint, ParagraphResult
+from ..utils.database import SessionLocal
+
+
+def load_checkpoint(task_id: str) -> Optional[Dict[str, Any]]:
+    """读取任务的断点信息，不存在时返回 None"""
+    db = SessionLocal()
+    try:
+        checkpoint = db.query(DetectionCheckpoint).filter(DetectionCheckpoint.task_id == task_id).first()
+        if checkpoint is None:
+            return None
+        return {
+            "source_text": checkpoint.source_text,
+            "segments_hash": checkpoint.segments_hash,
+            "segment_count": checkpoint.segment_count,
+        }
+    finally:
+        db.close()
+
+
+def _update_checkpoint(task_id: str, **fields):
+    db = SessionLocal()
+    try:
+        checkpoint = db.query(DetectionCheckpoint).filter(DetectionCheckpoint.task_id == task_id).first()
+        if checkpoint is None:
+            checkpoint = DetectionCheckpoint(task_id=task_id)
+            db.add(checkpoint)
+        for name, value in fields.items():
+            setattr(checkpoint, name, value)
+        db.commit()
+    finally:
+        db.close()
+
+
+def save_source_text(task_id: str, text: str):
+    """保存提取出的完整文本"""
+    _update_checkpoint(task_id, source_text=text)
+
+
+def save_segmentation(task_id: str, segment_count: int, segments_hash: str):
+    """保存切分结果的片段数和哈希"""
+    _update_checkpoint(task_id, segment_count=segment_count, segments_hash=segments_hash)
+
+
+def delete_checkpoint(task_id: str):
+    """任务完成后删除断点信息"""
+    db = SessionLocal()
+    try:
+        db.query(DetectionCheckpoint).filter(DetectionCheckpoint.task_id == task_id).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def checkpointing_blocks(task_id: str, blocks: Iterable[str]) -> Iterator[str]:
+    """原样产出文本块，全部提取完成后把完整文本保存到断点信息中"""
+    parts = []
+    for block in blocks:
+        parts.append(block)
+        yield block
+    save_source_text(task_id, "".join(parts))
+
+
+def restore_completed_results(task_id: str,
+                              segments: List[str],
+                              segments_hash: str,
+                              checkpoint: Optional[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    """
+    读取任务已写入的片段结果，作为恢复检测时可以跳过的片段
+
+    切分结果的哈希与断点一致时直接按序号复用；不一致或断点中没有哈希时
+    （例如切分完成前中断），只复用文本与当前切分结果相同的片段。
+    抽样检测中未被抽中的片段和渐进式检测的初步结果只有本地判断，恢复时重新分析。
+    无法复用的结果会被删除，由恢复后的检测重新写入。
+
+    Args:
+        task_id: 任务ID
+        segments: 重新切分得到的有效片段
+        segments_hash: 这些片段的哈希
+        checkpoint: load_checkpoint 的结果
+
+    Returns:
+        Dict[int, Dict]: 片段序号到分析结果的映射
+    """
+    hash_matches = checkpoint is not None and checkpoint.get("segments_hash") == segments_hash
+    db = SessionLocal()
+    try:
+        completed = {}
+        stale_ids = []
+        rows = db.query(ParagraphResult).filter(ParagraphResult.task_id == task_id).all()
+        for row in rows:
+            index = row.segment_index
+            valid = index is not None and 0 <= index < len(segments) and index not in completed
+            if valid and not hash_matches:
+                valid = " ".join(row.paragraph.split()) == " ".join(segments[index].split())
+            metrics = {}
+            if valid and row.metrics_data:
+                try:
+                    metrics = json.loads(row.metrics_data)
+                except ValueError:
+                    pass
+            if not valid or metrics.get("unsampled") or metrics.get("preliminary"):
+                stale_ids.append(row.id)
+                continue
+            completed[index] = {
+                "paragraph": row.paragraph,
+                "ai_generated": row.ai_generated,
+                "reason": row.reason,
+                "perplexity": row.perplexity or 0,
+                "is_ai_likelihood": row.ai_likelihood,
+                "degraded": metrics.get("degraded", False),
+                "budget_skipped": metrics.get("budget_skipped", False),
+            }
+        if stale_ids:
+            db.query(ParagraphResult).filter(ParagraphResult.id.in_(stale_ids)).delete(synchronize_session=False)
+            db.commit()
+            print(f"任务 {task_id} 有 {len(stale_ids)} 个已写入的片段结果与当前切分不一致，将重新检测")
+        return completed
+    finally:
+        db.close()
@@ -0,0 +1,506 @@
+import os
+import time
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+from .ai_detection_service import (
+    IncrementalSegmenter,
+    SegmentSummary,
+    StyleConsistencyAccumulator,
+    encode_segments,
+    local_segment_result,
+    refine_segment_with_llm,
+    preliminary_segment_result,
+    score_segments_locally,
+)
+from .progress import TaskProgress
+from .sampling import SequentialSampler, unsampled_segment_result
+from .batch import SharedSegmentCache
+from .cancellation import CancellationToken, DetectionCancelled, get_current_cancel_token
+
+# 阶段之间传递的结束标记
+_DONE = object()
+
+# 过短的片段不参与检测
+MIN_SEGMENT_CHARS = 20
+
+# 本地模型计算（困惑度、句向量）在共享线程池中执行，限制所有检测任务加起来的CPU并发
+LOCAL_WORKERS = int(os.getenv("PIPELINE_LOCAL_WORKERS", "2"))
+# 本地指标阶段每批最多计算的片段数
+LOCAL_BATCH_SIZE = int(os.getenv("PIPELINE_LOCAL_BATCH_SIZE", "8"))
+_local_executor = ThreadPoolExecutor(max_workers=max(1, LOCAL_WORKERS), thread_name_prefix="local-scoring")
+
+
+def split_segments(text: str) -> List[str]:
+    """与流水线切分阶段相同的方式切分完整文本，返回有效片段"""
+    segmenter = IncrementalSegmenter()
+    segments = segmenter.feed(text) + segmenter.finish()
+    return [segment for segment in segments if len(segment) >= MIN_SEGMENT_CHARS]
+
+
+class SegmentsHasher:
+    """
+    计算片段列表的哈希
+
+    片段内的空白先规范化，文本分块方式不同时切分出的片段可能只有空白差异，
+    哈希仍然相同。
+    """
+
+    def __init__(self):
+        self._digest = hashlib.sha256()
+
+    def update(self, segment: str):
+        self._digest.update(" ".join(segment.split()).encode("utf-8"))
+        self._digest.update(b"\x1e")
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+    @classmethod
+    def of(cls, segments: Iterable[str]) -> str:
+        hasher = cls()
+        for segment in segments:
+            hasher.update(segment)
+        return hasher.hexdigest()
+
+
+class StageStats:
+    """流水线单个阶段的运行统计"""
+
+    def __init__(self, name: str, workers: int, queue: Optional[asyncio.Queue] = None):
+        self.name = name
+        self.workers = workers
+        self.queue = queue
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+
+    def observe_queue(self):
+        """记录输入队列的最大深度"""
+        if self.queue is not None:
+            self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    def report(self, wall_seconds: float) -> Dict[str, Any]:
+        capacity = self.workers * wall_seconds
+        return {
+            "workers": self.workers,
+            "items": self.items,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "utilization": round(self.busy_seconds / capacity, 3) if capacity > 0 else 0,
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+
+class DetectionPipeline:
+    """
+    分阶段的检测流水线：提取 → 切分 → 本地指标 → LLM分析 → 写入
+
+    各阶段通过有界队列连接并同时运行：CPU密集的本地指标阶段和等待网络的LLM阶段
+    互相重叠，每个阶段有独立的并发数。下游处理不过来时队列写满，上游自动等待，
+    因此内存占用不随文档长度增长。
+    """
+
+    def __init__(self,
+                 local_workers: Optional[int] = None,
+                 llm_workers: Optional[int] = None,
+                 queue_size: Optional[int] = None,
+                 segment_timeout: Optional[float] = None,
+                 on_segment_verdict: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+                 on_result: Optional[Callable[[int, Any], Awaitable[None]]] = None,
+                 progress: Optional[TaskProgress] = None,
+                 completed: Optional[Dict[int, Dict[str, Any]]] = None,
+                 on_segmented: Optional[Callable[[int, str], Awaitable[None]]] = None,
+                 cancel_token: Optional[CancellationToken] = None,
+                 sampler: Optional[SequentialSampler] = None,
+                 on_preliminary: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+                 local_batch_size: Optional[int] = None,
+                 skip_llm: bool = False,
+                 segment_cache: Optional[SharedSegmentCache] = None):
+        """
+        Args:
+            local_workers: 本地指标阶段的并发数，默认取 PIPELINE_LOCAL_WORKERS 配置
+            llm_workers: LLM阶段的并发数，默认取 DETECTION_WORKERS 配置
+            queue_size: 阶段之间队列的容量，默认取 PIPELINE_QUEUE_SIZE 配置
+            segment_timeout: 单个片段LLM分析的超时时间（秒），默认取 SEGMENT_TIMEOUT 配置，0 表示不限制
+            on_segment_verdict: 可选回调，某个片段的LLM判断结论到达时以 (片段序号, 结论) 调用
+            on_result: 可选协程函数，写入阶段按片段顺序以 (片段序号, 结果) 调用
+            progress: 可选的任务进度，各阶段处理片段时更新
+            completed: 恢复检测时已经完成的片段结果（片段序号到结果），这些片段只计算句向量，
+                结果直接计入汇总，不再交给 on_result
+            on_segmented: 可选协程函数，切分完成时以 (片段数, 片段列表哈希) 调用
+            cancel_token: 任务的取消令牌，默认取当前上下文中的令牌；取消后各阶段立即停止，
+                run 抛出 DetectionCancelled
+            sampler: 可选的抽样器。提供时先计算所有片段的本地指标，再按抽样器的顺序逐个交给LLM分析，
+                整体估计足够精确时停止，其余片段只使用本地指标判断
+            on_preliminary: 可选协程函数，渐进式检测时使用。所有片段的本地指标计算完成后，
+                先把只基于本地指标的初步片段结果交给 on_result，再以初步整体结果调用，之后才开始LLM分析
+            local_batch_size: 本地指标阶段每批最多计算的片段数，默认取 PIPELINE_LOCAL_BATCH_SIZE 配置
+            skip_llm: 为 True 时不调用LLM，所有片段只使用本地指标判断
+            segment_cache: 可选的共享片段结果（批量检测时同一批次的文档共用），
+                已有相同片段的本地指标或LLM结果时直接使用
+        """
+        if local_workers is None:
+            local_workers = LOCAL_WORKERS
+        if llm_workers is None:
+            llm_workers = int(os.getenv("DETECTION_WORKERS", "4"))
+        if queue_size is None:
+            queue_size = int(os.getenv("PIPELINE_QUEUE_SIZE", "16"))
+        if segment_timeout is None:
+            segment_timeout = float(os.getenv("SEGMENT_TIMEOUT", "120"))
+        self.local_workers = max(1, local_workers)
+        self.llm_workers = max(1, llm_workers)
+        self.queue_size = max(1, queue_size)
+        self.segment_timeout = segment_timeout if segment_timeout and segment_timeout > 0 else None
+        self.on_segment_verdict = on_segment_verdict
+        self.on_result = on_result
+        self.progress = progress
+        self.completed = completed or {}
+        self.on_segmented = on_segmented
+        self.segments_hash: Optional[str] = None
+        self.cancel_token = cancel_token if cancel_token is not None else get_current_cancel_token()
+        self.sampler = sampler
+        self.on_preliminary = on_preliminary
+        self.skip_llm = skip_llm
+        self.segment_cache = segment_cache
+        self.local_batch_size = max(1, local_batch_size if local_batch_size is not None else LOCAL_BATCH_SIZE)
+        # 抽样和渐进式检测需要先得到所有片段的本地指标，LLM阶段不再与本地指标阶段重叠，
+        # 所有片段在LLM分析开始前都保留在内存中，有界队列的背压不再限制内存占用
+        self.collect_local = sampler is not None or on_preliminary is not None
+
+        self.extracted_chars = 0
+        self.segment_count = 0
+        self.wall_seconds = 0.0
+        self.stages: Dict[str, StageStats] = {}
+        # 提供 on_result 时结果交给调用方写入，流水线只累计整体指标
+        self.summary = SegmentSummary(keep_details=on_result is None)
+        self._style = StyleConsistencyAccumulator()
+
+    def style_consistency(self) -> float:
+        """已处理片段的风格一致性"""
+        return self._style.value()
+
+    def report(self) -> Dict[str, Any]:
+        """各阶段的利用率报告"""
+        return {
+            "wall_seconds": round(self.wall_seconds, 3),
+            "extracted_chars": self.extracted_chars,
+            "segment_count": self.segment_count,
+            "resumed_segments": len(self.completed),
+            "sampled": self.sampler is not None,
+            "stages": {name: stage.report(self.wall_seconds) for name, stage in self.stages.items()},
+        }
+
+    async def run(self, blocks: Iterable[str]) -> SegmentSummary:
+        """
+        运行流水线
+
+        Args:
+            blocks: 按顺序产出文本块的可迭代对象，迭代在线程池中进行，可以是逐页读取文件的生成器
+
+        Returns:
+            SegmentSummary: 累计的整体指标，未提供 on_result 时包含各片段的分析结果
+        """
+        loop = asyncio.get_event_loop()
+        block_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        local_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        llm_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        result_queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        # 抽样和渐进式检测时本地指标阶段的结果先全部保留
+        scored: Dict[int, Any] = {}
+
+        self.stages = {
+            "extract": StageStats("extract", 1),
+            "segment": StageStats("segment", 1, block_queue),
+            "local": StageStats("local", self.local_workers, local_queue),
+            "llm": StageStats("llm", self.llm_workers, llm_queue),
+            "persist": StageStats("persist", 1, result_queue),
+        }
+        async def _extract():
+            stats = self.stages["extract"]
+            iterator = iter(blocks)
+            while True:
+                self._check_cancelled()
+                started = time.monotonic()
+                block = await loop.run_in_executor(None, next, iterator, _DONE)
+                stats.busy_seconds += time.monotonic() - started
+                if block is _DONE:
+                    break
+                stats.items += 1
+                self.extracted_chars += len(block)
+                await block_queue.put(block)
+            await block_queue.put(_DONE)
+
+        async def _segment():
+            stats = self.stages["segment"]
+            segmenter = IncrementalSegmenter()
+            hasher = SegmentsHasher()
+            while True:
+                stats.observe_queue()
+                block = await block_queue.get()
+                started = time.monotonic()
+                segments = segmenter.finish() if block is _DONE else segmenter.feed(block)
+                stats.busy_seconds += time.monotonic() - started
+                # 过滤掉太短的段落
+                for segment in segments:
+                    if len(segment) < MIN_SEGMENT_CHARS:
+                        continue
+                    stats.items += 1
+                    hasher.update(segment)
+                    await local_queue.put((self.segment_count, segment))
+                    self.segment_count += 1
+                    if self.progress is not None:
+                        self.progress.add_segments()
+                if block is _DONE:
+                    break
+            print(f"分割后的片段数量: {self.segment_count}")
+            self.segments_hash = hasher.hexdigest()
+            if self.progress is not None:
+                self.progress.segmentation_finished()
+            if self.on_segmented is not None:
+                await self.on_segmented(self.segment_count, self.segments_hash)
+            for _ in range(self.local_workers):
+                await local_queue.put(_DONE)
+
+        def _embed(segments: List[str]) -> List[Any]:
+            try:
+                return list(encode_segments(segments))
+            except Exception as e:
+                print(f"计算片段句向量失败: {str(e)}")
+                return [None] * len(segments)
+
+        def _score(segments: List[str]):
+            # 在线程池中排队期间任务可能已被取消
+            self._check_cancelled()
+            if self.segment_cache is None:
+                return score_segments_locally(segments), _embed(segments)
+            # 只计算共享结果中还没有的片段
+            scored_segments = [self.segment_cache.get_local(segment) for segment in segments]
+            misses = [i for i, hit in enumerate(scored_segments) if hit is None]
+            if misses:
+                missing = [segments[i] for i in misses]
+                for i, local, embedding in zip(misses, score_segments_locally(missing), _embed(missing)):
+                    scored_segments[i] = (local, embedding)
+                    self.segment_cache.put_local(segments[i], local, embedding)
+            return [hit[0] for hit in scored_segments], [hit[1] for hit in scored_segments]
+
+        async def _local_worker():
+            stats = self.stages["local"]
+            while True:
+                stats.observe_queue()
+                # 一次取出队列中已有的多个片段，困惑度和句向量按批计算
+                batch = [await local_queue.get()]
+                while len(batch) < self.local_batch_size and batch[-1] is not _DONE:
+                    try:
+                        batch.append(local_queue.get_nowait())
+                    except asyncio.QueueEmpty:
+                        break
+                finished = batch[-1] is _DONE
+                items = batch[:-1] if finished else batch
+                # 已完成的片段只需要句向量用于风格一致性，结果直接交给写入阶段
+                resumed = [(index, segment) for index, segment in items if index in self.completed]
+                pending = [(index, segment) for index, segment in items if index not in self.completed]
+                if resumed:
+                    started = time.monotonic()
+                    embeddings = await loop.run_in_executor(_local_executor, _embed, [segment for _, segment in resumed])
+                    stats.busy_seconds += time.monotonic() - started
+                    for (index, _), embedding in zip(resumed, embeddings):
+                        stats.items += 1
+                        self._style.add(index, embedding)
+                        await result_queue.put((index, self.completed[index]))
+                if pending:
+                    started = time.monotonic()
+                    locals_, embeddings = await loop.run_in_executor(_local_executor, _score, [segment for _, segment in pending])
+                    stats.busy_seconds += time.monotonic() - started
+                    for (index, segment), local, embedding in zip(pending, locals_, embeddings):
+                        stats.items += 1
+                        self._style.add(index, embedding)
+                        if self.collect_local:
+                            scored[index] = (segment, local)
+                        else:
+                            await llm_queue.put((index, segment, local))
+                if finished:
+                    return
+
+        async def _local_stage():
+            await asyncio.gather(*[_local_worker() for _ in range(self.local_workers)])
+            if self.on_preliminary is not None:
+                await self._publish_preliminary(scored)
+            if self.sampler is not None:
+                await self._run_sampling(scored, result_queue)
+                await result_queue.put(_DONE)
+                return
+            # 渐进式检测：初步结果发布后再把所有片段交给LLM阶段
+            for index in sorted(scored):
+                segment, local = scored.pop(index)
+                await llm_queue.put((index, segment, local))
+            for _ in range(self.llm_workers):
+                await llm_queue.put(_DONE)
+
+        async def _llm_worker():
+            stats = self.stages["llm"]
+            while True:
+                stats.observe_queue()
+                item = await llm_queue.get()
+                if item is _DONE:
+                    return
+                index, segment, local = item
+                result = await self._refine(index, segment, local)
+                await result_queue.put((index, result))
+
+        async def _llm_stage():
+            await asyncio.gather(*[_llm_worker() for _ in range(self.llm_workers)])
+            await result_queue.put(_DONE)
+
+        async def _persist():
+            stats = self.stages["persist"]
+            # 按序号重新排序：已完成但前面还有未完成片段的结果暂存在 pending 中
+            pending = {}
+            next_index = 0
+            while True:
+                stats.observe_queue()
+                item = await result_queue.get()
+                if item is _DONE:
+                    break
+                index, result = item
+                pending[index] = result
+                while next_index in pending:
+                    result = pending.pop(next_index)
+                    started = time.monotonic()
+                    self.summary.add(result)
+                    if self.on_result is not None and next_index not in self.completed:
+                        await self.on_result(next_index, result)
+                    stats.busy_seconds += time.monotonic() - started
+                    stats.items += 1
+                    next_index += 1
+                    if self.progress is not None:
+                        self.progress.segment_done()
+
+        started = time.monotonic()
+        # 抽样模式下LLM分析由本地指标阶段结束后的抽样过程完成，不需要LLM阶段
+        stage_functions = (_extract, _segment, _local_stage, _persist) if self.sampler is not None \
+            else (_extract, _segment, _local_stage, _llm_stage, _persist)
+        tasks = [asyncio.ensure_future(stage()) for stage in stage_functions]
+        try:
+            stages = asyncio.gather(*tasks)
+            if self.cancel_token is not None:
+                # 取消请求到达时立即停止等待，由下面的 finally 取消所有阶段
+                await self.cancel_token.guard(stages)
+            else:
+                await stages
+        finally:
+            # 任一阶段出错时取消其余阶段，避免它们阻塞在队列上
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            self.wall_seconds = time.monotonic() - started
+            self._print_report()
+        return self.summary
+
+    async def _refine(self, index: int, segment: str, local: Dict[str, Any]) -> Any:
+        """LLM分析单个片段，超时时使用本地判断，出错时返回异常对象"""
+        if self.skip_llm:
+            return local_segment_result(segment, local, "未进行LLM分析", degraded=False)
+        if self.segment_cache is not None:
+            return await self.segment_cache.refine(segment, lambda: self._refine_uncached(index, segment, local))
+        return await self._refine_uncached(index, segment, local)
+
+    async def _refine_uncached(self, index: int, segment: str, local: Dict[str, Any]) -> Any:
+        stats = self.stages["llm"]
+        started = time.monotonic()
+        if self.progress is not None:
+            self.progress.llm_started()
+        try:
+            refine = refine_segment_with_llm(segment, local, on_verdict=self._verdict_publisher(index))
+            if self.segment_timeout is None:
+                result = await refine
+            else:
+                result = await asyncio.wait_for(refine, timeout=self.segment_timeout)
+        except asyncio.TimeoutError:
+            print(f"片段 {index} 处理超时（{self.segment_timeout}秒）")
+            result = local_segment_result(segment, local, "片段分析超时")
+        except DetectionCancelled:
+            raise
+        except Exception as e:
+            result = e
+        finally:
+            if self.progress is not None:
+                self.progress.llm_finished()
+        stats.busy_seconds += time.monotonic() - started
+        stats.items += 1
+        return result
+
+    async def _publish_preliminary(self, scored: Dict[int, Any]):
+        """渐进式检测第一阶段：写入只基于本地指标的片段结果，并以初步整体结果调用 on_preliminary"""
+        summary = SegmentSummary(keep_details=self.on_result is None)
+        for index in range(self.segment_count):
+            if index in self.completed:
+                summary.add(self.completed[index])
+                continue
+            segment, local = scored[index]
+            result = preliminary_segment_result(segment, local)
+            summary.add(result)
+            if self.on_result is not None:
+                await self.on_result(index, result)
+        preliminary = summary.finish(self.style_consistency())
+        preliminary["preliminary"] = True
+        await self.on_preliminary(preliminary)
+
+    async def _run_sampling(self, scored: Dict[int, Any], result_queue: asyncio.Queue):
+        """
+        分层序贯抽样：同时保持 llm_workers 个片段在分析中，每得到一个结果就检查是否可以停止
+
+        恢复检测时已完成的片段直接计为样本，未被抽中的片段使用本地判断
+        """
+        sampler = self.sampler
+        perplexities = {index: local["perplexity"] for index, (_, local) in scored.items()}
+        perplexities.update({index: result.get("perplexity") or 0 for index, result in self.completed.items()})
+        # 以片段列表的哈希作为随机种子，同一文档重新检测时抽到相同的片段
+        sampler.stratify(perplexities, seed=self.segments_hash)
+        for index, result in self.completed.items():
+            sampler.mark_observed(index, result["ai_generated"])
+
+        in_flight: Dict[asyncio.Future, int] = {}
+        try:
+            while True:
+                while len(in_flight) < self.llm_workers:
+                    index = sampler.draw()
+                    if index is None:
+                        break
+                    segment, local = scored[index]
+                    in_flight[asyncio.ensure_future(self._refine(index, segment, local))] = index
+                if not in_flight:
+                    break
+                finished, _ = await asyncio.wait(list(in_flight), return_when=asyncio.FIRST_COMPLETED)
+                for future in finished:
+                    index = in_flight.pop(future)
+                    result = future.result()
+                    sampler.record(index, None if isinstance(result, Exception) else result["ai_generated"])
+                    await result_queue.put((index, result))
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+        unsampled = sampler.unsampled()
+        report = sampler.report()
+        print(f"抽样检测: 分析了 {report['sample_size']}/{report['population']} 个片段，"
+              f"AI内容比例 {report['ai_percentage']}% ± {report['half_width']}%")
+        for index in unsampled:
+            segment, local = scored[index]
+            await result_queue.put((index, unsampled_segment_result(segment, local)))
+
+    def _check_cancelled(self):
+        if self.cancel_token is not None:
+            self.cancel_token.raise_if_cancelled()
+
+    def _verdict_publisher(self, index: int):
+        if self.on_segment_verdict is None:
+            return None
+        return lambda verdict: self.on_segment_verdict(index, verdict)
+
+    def _print_report(self):
+        parts = []
+        for name, stage in self.stages.items():
+            report = stage.report(self.wall_seconds)
+            parts.append(f"{name} {report['items']}项/利用率{report['utilization']:.0%}")
+        print(f"检测流水线耗时 {self.wall_seconds:.2f}秒: " + "，".join(parts))
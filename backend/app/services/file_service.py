@@ -5,8 +5,9 @@ import aiofiles
 # import fitz  # PyMuPDF
 import docx
 from pathlib import Path
+from typing import Iterator
 # 导入我们新创建的模块
-from .pymupdf_related import extract_text_from_pdf as pdf_text_extractor
+from .pymupdf_related import extract_text_from_pdf as pdf_text_extractor, iter_pdf_pages
 
 # 创建上传文件存储路径
 UPLOAD_DIR = Path("./uploads")
@@ -16,10 +17,16 @@ def get_file_extension(filename: str) -> str:
     """获取文件扩展名"""
     return os.path.splitext(filename)[1].lower()
 
+# 支持检测的文件格式
+VALID_EXTENSIONS = ['.pdf', '.docx', '.doc', '.txt']
+
+def is_supported_filename(filename: str) -> bool:
+    """文件名的扩展名是否为支持的格式"""
+    return get_file_extension(filename) in VALID_EXTENSIONS
+
 def validate_file(file: UploadFile) -> bool:
     """验证文件格式是否支持"""
-    valid_extensions = ['.pdf', '.docx', '.doc', '.txt']
-    return get_file_extension(file.filename) in valid_extensions
+    return is_supported_filename(file.filename)
 
 async def save_upload_file(task_id: str, file: UploadFile) -> str:
     """保存上传文件"""
@@ -35,6 +42,16 @@ async def save_upload_file(task_id: str, file: UploadFile) -> str:
     
     return file.filename
 
+def save_file_content(task_id: str, filename: str, content: bytes) -> str:
+    """保存已读入内存的文件内容（例如从压缩包中解出的文件），返回保存的文件名"""
+    task_dir = UPLOAD_DIR / task_id
+    task_dir.mkdir(exist_ok=True)
+    # 只保留文件名部分，避免压缩包中的路径写到任务目录之外
+    filename = os.path.basename(filename.replace("\\", "/"))
+    with open(task_dir / filename, 'wb') as out_file:
+        out_file.write(content)
+    return filename
+
 def extract_text_from_pdf(file_path: str) -> str:
     """从PDF文件中提取文本"""
     # 使用新的辅助函数
@@ -79,6 +96,27 @@ def extract_text(task_id: str, filename: str) -> str:
     else:
         return ""
 
+def iter_text_blocks(task_id: str, filename: str) -> Iterator[str]:
+    """
+    根据文件类型逐块提取文本（PDF按页、DOCX按段落），
+    便于检测流水线在提取剩余内容的同时开始处理已提取的部分
+    """
+    file_path = UPLOAD_DIR / task_id / filename
+    ext = get_file_extension(filename)
+    
+    if ext == '.pdf':
+        yield from iter_pdf_pages(str(file_path))
+    elif ext in ['.docx', '.doc']:
+        try:
+            doc = docx.Document(str(file_path))
+        except Exception as e:
+            print(f"从DOCX提取文本时出错: {str(e)}")
+            return
+        for para in doc.paragraphs:
+            yield para.text + "\n"
+    elif ext == '.txt':
+        yield extract_text_from_txt(str(file_path))
+
 def clean_up_task_files(task_id: str):
     """清理任务文件"""
     task_dir = UPLOAD_DIR / task_id
@@ -0,0 +1,451 @@
+import os
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased
+from ..schemas.database_models import DetectionJob, DetectionTask
+from ..schemas.models import JobLane, JobStatus, TaskStatus
+from .batch import BATCH_MAX_CONCURRENCY
+from .task_state import transition
+
+# 作业租约时长（秒），工作进程在租约到期前心跳续约，进程退出后租约到期的作业可被其他工作进程领取
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+# 每个作业最多执行的次数，以及失败后重试的退避时间（秒，按次数指数增长）
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "10"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "600"))
+# 与其他工作进程竞争同一作业失败时，重新选择作业的次数
+CLAIM_ATTEMPTS = 5
+
+# 各通道的权重，通道之间按近期领取的作业数与权重之比轮流领取
+JOB_LANE_WEIGHTS = json.loads(os.getenv("JOB_LANE_WEIGHTS", '{"interactive": 6, "bulk": 3, "rescore": 1}'))
+# 用户的权重（owner_id 到权重的映射），未配置的用户权重为1
+JOB_OWNER_WEIGHTS = json.loads(os.getenv("JOB_OWNER_WEIGHTS", "{}") or "{}")
+# 每个用户同时执行的作业数上限，0 表示不限制
+USER_MAX_RUNNING_JOBS = int(os.getenv("USER_MAX_RUNNING_JOBS", "2"))
+# 统计近期领取作业数和排队等待时间的时间窗口（秒）
+JOB_FAIR_SHARE_WINDOW_SECONDS = float(os.getenv("JOB_FAIR_SHARE_WINDOW_SECONDS", "600"))
+
+# 任务每次执行的截止时间：基础时长加上按文件大小（MB）计算的时长，不超过上限（秒）
+TASK_DEADLINE_BASE_SECONDS = float(os.getenv("TASK_DEADLINE_BASE_SECONDS", "600"))
+TASK_DEADLINE_SECONDS_PER_MB = float(os.getenv("TASK_DEADLINE_SECONDS_PER_MB", "1800"))
+TASK_DEADLINE_MAX_SECONDS = float(os.getenv("TASK_DEADLINE_MAX_SECONDS", "14400"))
+
+ACTIVE_JOB_STATUSES = (JobStatus.QUEUED.value, JobStatus.RUNNING.value)
+
+
+def task_deadline_seconds(file_size: Optional[int]) -> float:
+    """按文档大小计算任务一次执行允许的最长时间"""
+    size_mb = (file_size or 0) / (1024 * 1024)
+    return min(TASK_DEADLINE_MAX_SECONDS, TASK_DEADLINE_BASE_SECONDS + TASK_DEADLINE_SECONDS_PER_MB * size_mb)
+
+
+class ClaimedJob:
+    """工作进程领取到的作业"""
+
+    def __init__(self, job: DetectionJob, filename: str):
+        self.id = job.id
+        self.task_id = job.task_id
+        self.batch_id = job.batch_id
+        self.lane = job.lane
+        self.owner_id = job.owner_id
+        self.wait_seconds = job.wait_seconds
+        self.filename = filename
+        self.attempts = job.attempts
+        self.max_attempts = job.max_attempts
+        # 重试或接管的作业已有部分结果，从断点恢复
+        self.resume = bool(job.resume) or job.attempts > 1
+
+    @property
+    def can_retry(self) -> bool:
+        return self.attempts < self.max_attempts
+
+
+class JobQueue:
+    """
+    基于数据库表 detection_jobs 的检测作业队列
+
+    所有状态变化都是带条件的 UPDATE，并检查影响的行数：领取时只更新仍可领取的作业，
+    续约和结束时只更新租约仍属于本工作进程的作业，多个工作进程同时操作时只有一个成功。
+
+    作业分为三个通道：用户直接开始的检测（interactive）、批量检测（bulk）和后台恢复的检测（rescore）。
+    领取时先按通道权重、再按用户权重选择近期领取作业最少的通道和用户，最后取该用户在该通道中最早排队的作业，
+    一个用户提交大量文档时其他用户的作业仍能轮流执行；执行中的作业数达到上限的用户暂不领取。
+    """
+
+    def enqueue(self,
+                db: Session,
+                task: DetectionTask,
+                lane: JobLane = JobLane.INTERACTIVE,
+                resume: bool = False) -> DetectionJob:
+        """
+        为任务添加作业；任务已有排队或执行中的作业时直接返回该作业
+
+        每个任务最多有一个排队或执行中的作业（由部分唯一索引保证），
+        两个请求同时添加作业时后提交的一方插入失败，返回先添加的作业
+        """
+        task_id = task.id
+        job = self.active_job(db, task_id)
+        if job is not None:
+            return job
+        now = datetime.now()
+        job = DetectionJob(
+            task_id=task_id,
+            batch_id=task.batch_id,
+            owner_id=task.owner_id,
+            lane=lane.value,
+            resume=resume,
+            status=JobStatus.QUEUED.value,
+            max_attempts=JOB_MAX_ATTEMPTS,
+            available_at=now,
+            queued_at=now
+        )
+        db.add(job)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return self.active_job(db, task_id)
+        return job
+
+    def active_job(self, db: Session, task_id: str) -> Optional[DetectionJob]:
+        return db.query(DetectionJob).filter(
+            DetectionJob.task_id == task_id,
+            DetectionJob.status.in_(ACTIVE_JOB_STATUSES)
+        ).first()
+
+    def cancel(self, db: Session, task_id: str) -> int:
+        """
+        取消任务排队中的作业
+
+        执行中的作业由工作进程在心跳时发现任务已不在处理中后停止
+        """
+        cancelled = db.query(DetectionJob).filter(
+            DetectionJob.task_id == task_id,
+            DetectionJob.status == JobStatus.QUEUED.value
+        ).update({DetectionJob.status: JobStatus.CANCELLED.value}, synchronize_session=False)
+        db.commit()
+        return cancelled
+
+    @staticmethod
+    def _running_count(column, now: datetime):
+        """与当前作业 column 相同、租约有效的执行中作业数"""
+        running = aliased(DetectionJob)
+        return select(func.count(running.id)).where(
+            getattr(running, column.key) == column,
+            running.status == JobStatus.RUNNING.value,
+            running.lease_expires_at >= now
+        ).correlate(DetectionJob).scalar_subquery()
+
+    def _claimable(self, now: datetime):
+        conditions = [
+            or_(
+                and_(DetectionJob.status == JobStatus.QUEUED.value, DetectionJob.available_at <= now),
+                # 租约已到期的执行中作业，执行它的工作进程已退出
+                and_(DetectionJob.status == JobStatus.RUNNING.value, DetectionJob.lease_expires_at < now)
+            ),
+            # 批次或用户执行中的作业数达到上限时不再领取其作业
+            or_(
+                DetectionJob.batch_id.is_(None),
+                self._running_count(DetectionJob.batch_id, now) < BATCH_MAX_CONCURRENCY
+            )
+        ]
+        if USER_MAX_RUNNING_JOBS > 0:
+            conditions.append(self._running_count(DetectionJob.owner_id, now) < USER_MAX_RUNNING_JOBS)
+        return and_(*conditions)
+
+    def _recent_usage(self, db: Session, column, now: datetime) -> Dict[Any, int]:
+        """窗口期内领取过以及仍在执行的作业数，按 column 分组"""
+        since = now - timedelta(seconds=JOB_FAIR_SHARE_WINDOW_SECONDS)
+        return dict(db.query(column, func.count(DetectionJob.id)).filter(
+            or_(
+                DetectionJob.claimed_at >= since,
+                and_(DetectionJob.status == JobStatus.RUNNING.value, DetectionJob.lease_expires_at >= now)
+            )
+        ).group_by(column).all())
+
+    @staticmethod
+    def _share(usage: int, weight: float) -> float:
+        return usage / weight if weight > 0 else float("inf")
+
+    def _select(self, db: Session, now: datetime) -> Optional[DetectionJob]:
+        """按通道和用户的公平份额选择下一个作业"""
+        # 每个 (通道, 用户) 中最早排队的可领取作业
+        heads = db.query(
+            DetectionJob.lane, DetectionJob.owner_id, func.min(DetectionJob.queued_at)
+        ).filter(self._claimable(now)).group_by(DetectionJob.lane, DetectionJob.owner_id).all()
+        if not heads:
+            return None
+
+        lane_usage = self._recent_usage(db, DetectionJob.lane, now)
+        owner_usage = self._recent_usage(db, DetectionJob.owner_id, now)
+        oldest_in_lane: Dict[str, datetime] = {}
+        for lane, _, queued_at in heads:
+            if lane not in oldest_in_lane or queued_at < oldest_in_lane[lane]:
+                oldest_in_lane[lane] = queued_at
+
+        # 份额相同时先排队的优先
+        lane = min(oldest_in_lane, key=lambda item: (
+            self._share(lane_usage.get(item, 0), JOB_LANE_WEIGHTS.get(item, 1)), oldest_in_lane[item]
+        ))
+        owner = min((head for head in heads if head[0] == lane), key=lambda head: (
+            self._share(owner_usage.get(head[1], 0), JOB_OWNER_WEIGHTS.get(head[1], 1)), head[2]
+        ))[1]
+        return db.query(DetectionJob).filter(
+            self._claimable(now),
+            DetectionJob.lane == lane,
+            DetectionJob.owner_id == owner
+        ).order_by(DetectionJob.queued_at, DetectionJob.created_at).first()
+
+    def claim(self, db: Session, worker_id: str) -> Optional[ClaimedJob]:
+        """
+        领取最早可执行的作业并写入租约
+
+        Returns:
+            ClaimedJob: 领取到的作业；没有可执行的作业时返回 None
+        """
+        for _ in range(CLAIM_ATTEMPTS):
+            now = datetime.now()
+            candidate = self._select(db, now)
+            if candidate is None:
+                return None
+            # 排队等待时间：租约到期被接管的作业从租约到期时算起
+            if candidate.status == JobStatus.RUNNING.value:
+                eligible_at = candidate.lease_expires_at
+            else:
+                eligible_at = max(candidate.queued_at, candidate.available_at)
+            wait_seconds = max(0.0, (now - eligible_at).total_seconds())
+
+            claimed = db.query(DetectionJob).filter(
+                DetectionJob.id == candidate.id,
+                self._claimable(now)
+            ).update({
+                DetectionJob.status: JobStatus.RUNNING.value,
+                DetectionJob.lease_owner: worker_id,
+                DetectionJob.lease_expires_at: now + timedelta(seconds=JOB_LEASE_SECONDS),
+                DetectionJob.heartbeat_at: now,
+                DetectionJob.claimed_at: now,
+                DetectionJob.wait_seconds: wait_seconds,
+                DetectionJob.attempts: DetectionJob.attempts + 1
+            }, synchronize_session=False)
+            db.commit()
+            if not claimed:
+                # 作业已被其他工作进程领取
+                continue
+
+            db.refresh(candidate)
+            job = candidate
+            task = db.query(DetectionTask).filter(DetectionTask.id == job.task_id).first()
+            if task is None or job.attempts > job.max_attempts:
+                # 执行中的工作进程多次退出的作业不再执行
+                self.fail(db, job.id, worker_id, job.last_error or "工作进程多次异常退出")
+                continue
+            # 看门狗据此发现停滞或超时的任务
+            task.heartbeat_at = now
+            task.deadline_at = now + timedelta(seconds=task_deadline_seconds(task.file_size))
+            db.commit()
+            return ClaimedJob(job, task.filename)
+        return None
+
+    def heartbeat(self,
+                  db: Session,
+                  job_id: str,
+                  worker_id: str,
+                  progress: Optional[Dict[str, Any]] = None,
+                  advanced: bool = False) -> bool:
+        """
+        续约并保存进度
+
+        Args:
+            advanced: 自上次心跳后检测进度是否有变化，有变化时更新任务的心跳时间；
+                只有进度变化才算任务的心跳，检测流程卡住时即使工作进程仍在续约，看门狗也能发现
+
+        Returns:
+            bool: 作业是否应继续执行；租约已被其他工作进程接管或任务已不在处理中时为 False
+        """
+        now = datetime.now()
+        values = {
+            DetectionJob.lease_expires_at: now + timedelta(seconds=JOB_LEASE_SECONDS),
+            DetectionJob.heartbeat_at: now
+        }
+        if progress is not None:
+            values[DetectionJob.progress_data] = json.dumps(progress, ensure_ascii=False)
+        renewed = db.query(DetectionJob).filter(
+            DetectionJob.id == job_id,
+            DetectionJob.lease_owner == worker_id,
+            DetectionJob.status == JobStatus.RUNNING.value
+        ).update(values, synchronize_session=False)
+        db.commit()
+        if not renewed:
+            return False
+        task_id = db.query(DetectionJob.task_id).filter(DetectionJob.id == job_id).scalar()
+        if advanced:
+            db.query(DetectionTask).filter(DetectionTask.id == task_id).update(
+                {DetectionTask.heartbeat_at: now}, synchronize_session=False
+            )
+            db.commit()
+        task_status = db.query(DetectionTask.status).filter(DetectionTask.id == task_id).scalar()
+        return task_status == TaskStatus.PROCESSING.value
+
+    def _release(self, db: Session, job_id: str, worker_id: str, values: Dict[Any, Any]) -> bool:
+        """更新租约仍属于本工作进程的作业并清除租约"""
+        values = dict(values)
+        values[DetectionJob.lease_owner] = None
+        values[DetectionJob.lease_expires_at] = None
+        updated = db.query(DetectionJob).filter(
+            DetectionJob.id == job_id,
+            DetectionJob.lease_owner == worker_id,
+            DetectionJob.status == JobStatus.RUNNING.value
+        ).update(values, synchronize_session=False)
+        db.commit()
+        return updated > 0
+
+    def finish(self, db: Session, job_id: str, worker_id: str, progress: Optional[Dict[str, Any]] = None) -> bool:
+        """检测流程正常返回后结束作业，任务未完成时说明检测被取消"""
+        task_status = db.query(DetectionTask.status).join(
+            DetectionJob, DetectionJob.task_id == DetectionTask.id
+        ).filter(DetectionJob.id == job_id).scalar()
+        status = JobStatus.SUCCEEDED if task_status == TaskStatus.COMPLETED.value else JobStatus.CANCELLED
+        values = {DetectionJob.status: status.value}
+        if progress is not None:
+            values[DetectionJob.progress_data] = json.dumps(progress, ensure_ascii=False)
+        return self._release(db, job_id, worker_id, values)
+
+    def requeue(self, db: Session, job: ClaimedJob, worker_id: str) -> bool:
+        """工作进程退出前把未完成的作业放回队列，不计入执行次数，由其他工作进程从断点恢复"""
+        now = datetime.now()
+        return self._release(db, job.id, worker_id, {
+            DetectionJob.status: JobStatus.QUEUED.value,
+            DetectionJob.resume: True,
+            DetectionJob.attempts: DetectionJob.attempts - 1,
+            DetectionJob.available_at: now,
+            DetectionJob.queued_at: now
+        })
+
+    def retry(self, db: Session, job: ClaimedJob, worker_id: str, error: str) -> bool:
+        """作业执行出错，退避一段时间后重新排队，从断点恢复"""
+        delay = min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * 2 ** (job.attempts - 1))
+        available_at = datetime.now() + timedelta(seconds=delay)
+        return self._release(db, job.id, worker_id, {
+            DetectionJob.status: JobStatus.QUEUED.value,
+            DetectionJob.resume: True,
+            DetectionJob.available_at: available_at,
+            DetectionJob.queued_at: available_at,
+            DetectionJob.last_error: error
+        })
+
+    def reap(self, db: Session, job: DetectionJob, reason: str) -> Optional[str]:
+        """
+        回收卡住的执行中作业：还有执行次数时放回队列从断点恢复，否则作业和任务置为失败
+
+        只在作业仍由看门狗观察到的工作进程持有时生效；该工作进程下次心跳时发现租约已失去，停止检测
+
+        Returns:
+            str: "requeued" 或 "failed"；作业状态已变化时返回 None
+        """
+        if job.attempts >= job.max_attempts:
+            return "failed" if self.fail(db, job.id, job.lease_owner, reason) else None
+        now = datetime.now()
+        requeued = self._release(db, job.id, job.lease_owner, {
+            DetectionJob.status: JobStatus.QUEUED.value,
+            DetectionJob.resume: True,
+            DetectionJob.available_at: now,
+            DetectionJob.queued_at: now,
+            DetectionJob.last_error: reason
+        })
+        return "requeued" if requeued else None
+
+    def fail(self, db: Session, job_id: str, worker_id: str, error: str) -> bool:
+        """作业不再重试，任务仍在处理中时置为失败"""
+        released = self._release(db, job_id, worker_id, {
+            DetectionJob.status: JobStatus.FAILED.value,
+            DetectionJob.last_error: error
+        })
+        if released:
+            task_id = db.query(DetectionJob.task_id).filter(DetectionJob.id == job_id).scalar()
+            transition(db, task_id, TaskStatus.PROCESSING, TaskStatus.FAILED)
+        return released
+
+    def progress(self, db: Session, task_id: str) -> Optional[Dict[str, Any]]:
+        """执行中的作业最近一次心跳时保存的任务进度"""
+        progress_data = db.query(DetectionJob.progress_data).filter(
+            DetectionJob.task_id == task_id,
+            DetectionJob.status.in_(ACTIVE_JOB_STATUSES),
+            DetectionJob.progress_data.isnot(None)
+        ).limit(1).scalar()
+        if not progress_data:
+            return None
+        try:
+            return json.loads(progress_data)
+        except ValueError:
+            return None
+
+    def batch_snapshot(self, db: Session, batch_id: str) -> Dict[str, Any]:
+        """批次中排队和执行中的作业数"""
+        counts = dict(db.query(DetectionJob.status, func.count(DetectionJob.id)).filter(
+            DetectionJob.batch_id == batch_id,
+            DetectionJob.status.in_(ACTIVE_JOB_STATUSES)
+        ).group_by(DetectionJob.status).all())
+        return {
+            "concurrency": BATCH_MAX_CONCURRENCY,
+            "queued_jobs": counts.get(JobStatus.QUEUED.value, 0),
+            "running_jobs": counts.get(JobStatus.RUNNING.value, 0),
+        }
+
+    def wait_report(self, db: Session) -> Dict[str, Any]:
+        """
+        各通道的排队情况：当前排队的作业数和最长等待时间，
+        以及窗口期内领取的作业的等待时间（秒）
+        """
+        now = datetime.now()
+        since = now - timedelta(seconds=JOB_FAIR_SHARE_WINDOW_SECONDS)
+        queued = {
+            lane: (count, oldest)
+            for lane, count, oldest in db.query(
+                DetectionJob.lane, func.count(DetectionJob.id), func.min(DetectionJob.queued_at)
+            ).filter(
+                DetectionJob.status == JobStatus.QUEUED.value,
+                DetectionJob.available_at <= now
+            ).group_by(DetectionJob.lane).all()
+        }
+        waits: Dict[str, List[float]] = {}
+        for lane, wait_seconds in db.query(DetectionJob.lane, DetectionJob.wait_seconds).filter(
+            DetectionJob.claimed_at >= since,
+            DetectionJob.wait_seconds.isnot(None)
+        ).all():
+            waits.setdefault(lane, []).append(wait_seconds)
+
+        lanes = {}
+        for lane in JobLane:
+            count, oldest = queued.get(lane.value, (0, None))
+            samples = sorted(waits.get(lane.value, []))
+            lanes[lane.value] = {
+                "weight": JOB_LANE_WEIGHTS.get(lane.value, 1),
+                "queued": count,
+                "oldest_wait_seconds": round((now - oldest).total_seconds(), 1) if oldest is not None else None,
+                "claimed": len(samples),
+                "wait_avg_seconds": round(sum(samples) / len(samples), 1) if samples else None,
+                "wait_p50_seconds": round(_percentile(samples, 50), 1) if samples else None,
+                "wait_p95_seconds": round(_percentile(samples, 95), 1) if samples else None,
+                "wait_max_seconds": round(samples[-1], 1) if samples else None,
+            }
+        running = dict(db.query(DetectionJob.owner_id, func.count(DetectionJob.id)).filter(
+            DetectionJob.status == JobStatus.RUNNING.value,
+            DetectionJob.lease_expires_at >= now
+        ).group_by(DetectionJob.owner_id).all())
+        return {
+            "window_seconds": JOB_FAIR_SHARE_WINDOW_SECONDS,
+            "user_max_running_jobs": USER_MAX_RUNNING_JOBS,
+            "lanes": lanes,
+            "running_by_owner": running,
+        }
+
+
+def _percentile(samples: List[float], percent: float) -> float:
+    """已排序样本的百分位数"""
+    return samples[min(len(samples) - 1, int(round(percent / 100.0 * (len(samples) - 1))))]
+
+
+job_queue = JobQueue()
@@ -0,0 +1,157 @@
+import os
+import time
+import threading
+import contextvars
+from typing import Optional, Dict, Any
+from .llm_resilience import LlmUnavailableError
+
+
+class BudgetExceededError(LlmUnavailableError):
+    """当前任务的LLM预算已用完，剩余片段应使用本地判断"""
+
+
+def _env_number(name: str, cast=int):
+    """读取数值型环境变量，0 或未设置表示不限制"""
+    value = cast(os.getenv(name, "0") or 0)
+    return value if value > 0 else None
+
+
+class TaskBudget:
+    """
+    单个检测任务的LLM资源预算
+
+    限制总token数、调用次数和墙钟时间，任意一项用完后任务内的后续LLM调用都会被拒绝。
+    """
+
+    def __init__(self,
+                 task_id: Optional[str] = None,
+                 max_tokens: Optional[int] = None,
+                 max_calls: Optional[int] = None,
+                 max_seconds: Optional[float] = None):
+        self.task_id = task_id
+        self.max_tokens = max_tokens
+        self.max_calls = max_calls
+        self.max_seconds = max_seconds
+        self.started_at = time.monotonic()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.estimated_calls = 0  # 未返回usage、token数为估算值的调用次数
+        self.calls = 0
+        self.rejected_calls = 0
+        self.exhausted_reason = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, task_id: Optional[str] = None) -> "TaskBudget":
+        """根据环境变量配置创建预算"""
+        return cls(
+            task_id=task_id,
+            max_tokens=_env_number("TASK_LLM_MAX_TOKENS"),
+            max_calls=_env_number("TASK_LLM_MAX_CALLS"),
+            max_seconds=_env_number("TASK_LLM_MAX_SECONDS", float),
+        )
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def exhausted(self) -> bool:
+        with self._lock:
+            return self._check_locked() is not None
+
+    def _check_locked(self) -> Optional[str]:
+        """检查各项预算，返回用完的原因（调用方需持有锁）"""
+        if self.exhausted_reason is None:
+            if self.max_tokens is not None and self.total_tokens >= self.max_tokens:
+                self.exhausted_reason = "tokens"
+            elif self.max_calls is not None and self.calls >= self.max_calls:
+                self.exhausted_reason = "calls"
+            elif self.max_seconds is not None and self.elapsed >= self.max_seconds:
+                self.exhausted_reason = "wall_time"
+            if self.exhausted_reason:
+                print(f"任务 {self.task_id} 的LLM预算已用完（{self.exhausted_reason}），剩余片段使用本地判断")
+        return self.exhausted_reason
+
+    def acquire_call(self):
+        """
+        发出LLM调用前登记一次调用
+
+        Raises:
+            BudgetExceededError: 预算已用完
+        """
+        with self._lock:
+            reason = self._check_locked()
+            if reason is not None:
+                self.rejected_calls += 1
+                raise BudgetExceededError(f"任务LLM预算已用完: {reason}")
+            self.calls += 1
+
+    def record_usage(self, prompt_tokens: int, completion_tokens: int, estimated: bool = False):
+        """记录一次调用实际消耗的token"""
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            if estimated:
+                self.estimated_calls += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._check_locked()
+            return {
+                "limits": {
+                    "max_tokens": self.max_tokens,
+                    "max_calls": self.max_calls,
+                    "max_seconds": self.max_seconds,
+                },
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": self.total_tokens,
+                "estimated_calls": self.estimated_calls,
+                "calls": self.calls,
+                "rejected_calls": self.rejected_calls,
+                "elapsed_seconds": round(self.elapsed, 2),
+                "exhausted": self.exhausted_reason is not None,
+                "exhausted_reason": self.exhausted_reason,
+            }
+
+
+# 当前协程所属任务的预算，由检测流程设置，LlmClient 在调用前读取
+current_budget = contextvars.ContextVar("current_budget", default=None)
+
+
+def get_current_budget() -> Optional[TaskBudget]:
+    return current_budget.get()
+
+
+class TokenUsageStats:
+    """客户端级别的token累计统计"""
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.estimated_calls = 0
+        self._lock = threading.Lock()
+
+    def record(self, prompt_tokens: int, completion_tokens: int, estimated: bool = False):
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            if estimated:
+                self.estimated_calls += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": self.prompt_tokens + self.completion_tokens,
+                "estimated_calls": self.estimated_calls,
+            }
@@ -3,19 +3,49 @@ import uuid
 import json
 import time
 import asyncio
-from volcenginesdkarkruntime import Ark
+import threading
 from concurrent.futures import ThreadPoolExecutor
+from .llm_stream import StreamingVerdictParser, VerdictBroadcast, estimate_tokens
+from .llm_resilience import LatencyTracker, HedgeBudget, HedgeStats, LlmUnavailableError
+from .llm_budget import TokenUsageStats, BudgetExceededError, get_current_budget
+from .singleflight import SingleFlight, content_key
+from .llm_journal import LlmJournal
+from .llm_router import EndpointPool
+from .cancellation import DetectionCancelled, get_current_cancel_token
 
 class LlmClient:
     """
     LLM 客户端，用于与大语言模型服务通信
     """
     def __init__(self):
-        self.endpoint_id = os.getenv('ENDPOINT_ID', 'ep-20250422142640-ksbch')  # 从环境变量获取模型 ID，默认使用提供的ID
-        self.responses = {}  # 存储请求的响应
-        self.client = Ark(
-            base_url="https://ark.cn-beijing.volces.com/api/v3",
-            api_key=os.environ.get("ARK_API_KEY", "f1298f35-98b3-4068-82b9-fd0bae492fc7"),
+        # 端点池：按延迟、错误率和剩余配额加权路由，失败时转移到其他端点
+        # 未配置 LLM_ENDPOINTS 时使用 ENDPOINT_ID 对应的单个端点
+        self.pool = EndpointPool.from_env()
+        self.failover_attempts = int(os.getenv('LLM_FAILOVER_ATTEMPTS', str(len(self.pool.endpoints))))
+        # 最近调用的固定容量日志，只保存延迟、用量等元数据，不保存响应对象
+        self.journal = LlmJournal(capacity=int(os.getenv('LLM_JOURNAL_CAPACITY', '1000')))
+        # 流式输出配置：开启后判断结论一到达即可发布，原因文本可按token上限截断
+        self.streaming = os.getenv('LLM_STREAMING', 'false').lower() == 'true'
+        self.reason_max_tokens = int(os.getenv('LLM_REASON_MAX_TOKENS', '0')) or None
+        # 对冲请求配置：调用耗时超过滚动百分位阈值时再发一个相同请求，先返回者胜出
+        self.hedging = os.getenv('LLM_HEDGING', 'true').lower() == 'true'
+        self.hedge_percentile = float(os.getenv('LLM_HEDGE_PERCENTILE', '95'))
+        self.latency_tracker = LatencyTracker(
+            window_size=int(os.getenv('LLM_LATENCY_WINDOW', '200')),
+            min_samples=int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '20'))
+        )
+        self.hedge_budget = HedgeBudget(ratio=float(os.getenv('LLM_HEDGE_BUDGET_RATIO', '0.05')))
+        self.hedge_stats = HedgeStats()
+        self.usage_stats = TokenUsageStats()
+        # 合并相同提示词的并发请求，重复上传或通用模板文本只调用一次LLM
+        self.inflight = SingleFlight("analyze_text")
+        # 合并的流式调用把判断结论转发给所有等待者，按提示词的键登记
+        self._broadcasts = {}
+        self._broadcasts_lock = threading.Lock()
+        # 共享线程池：被对冲淘汰的请求在后台自然结束，不阻塞调用方
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('LLM_MAX_WORKERS', '16')),
+            thread_name_prefix="llm"
         )
         
     def query(self, system_message, user_message, request_id=None):
@@ -32,23 +62,30 @@ class LlmClient:
         """
         if request_id is None:
             request_id = str(uuid.uuid4())
-            
+        
+        started = time.monotonic()
         try:
-            completion = self.client.chat.completions.create(
-                model=self.endpoint_id,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": user_message},
-                ],
+            endpoint = self.pool.choose()
+            if endpoint is None:
+                raise LlmUnavailableError("没有可用的LLM端点")
+            completion = endpoint.create([
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": user_message},
+            ])
+            # 记录调用日志（不保存响应对象）
+            response_text = completion.choices[0].message.content if completion.choices else ""
+            prompt_tokens, completion_tokens = self._record_usage(
+                getattr(completion, "usage", None), system_message, user_message, response_text
             )
-            # 存储响应
-            self.responses[request_id] = completion
+            self.journal.record(request_id, (time.monotonic() - started) * 1000, "ok",
+                                prompt_tokens, completion_tokens)
             return completion
         except Exception as e:
             print(f"调用LLM API时出错: {str(e)}")
+            self.journal.record(request_id, (time.monotonic() - started) * 1000, "error")
             return None
     
-    async def analyze_text(self, text, is_ai_generated=False, context=None):
+    async def analyze_text(self, text, is_ai_generated=False, context=None, on_verdict=None, stream=None):
         """
         异步分析文本是否为AI生成，并提供原因
         
@@ -56,6 +93,10 @@ class LlmClient:
             text: 要分析的文本
             is_ai_generated: 是否已知是AI生成的内容
             context: 可选的上下文信息，包含其他评估指标的数据
+            on_verdict: 可选回调，流式模式下判断结论到达时立即调用，参数为
+                {"is_ai_generated": bool, "confidence": float}；
+                与其他请求合并为同一次调用时同样会收到执行者的判断结论
+            stream: 是否使用流式调用，默认取 LLM_STREAMING 配置
             
         Returns:
             (bool, str): 返回判断结果和原因
@@ -108,8 +149,26 @@ class LlmClient:
             user_prompt = f"请分析以下文本段落是人类撰写还是AI生成的:\n\n{text}"
         
         try:
-            # 使用异步方法调用模型
-            response_text = await self.call_model(system_prompt, user_prompt)
+            # 使用异步方法调用模型，相同提示词的并发请求共享同一次调用
+            key = content_key(system_prompt, user_prompt)
+            broadcast = self._join_broadcast(key)
+            broadcast.subscribe(on_verdict)
+            
+            async def _call():
+                if self.streaming if stream is None else stream:
+                    return await self.call_model_stream(system_prompt, user_prompt, on_verdict=broadcast.publish)
+                return await self.call_model(system_prompt, user_prompt)
+            
+            try:
+                # 预算和取消令牌属于发起调用的任务：执行者预算用完或所属任务被取消时，
+                # 等待者用自己的预算和令牌重新调用，不把执行者的取消当作自己任务的取消
+                response_text = await self.inflight.do_async(
+                    key,
+                    _call,
+                    retry_on=(BudgetExceededError, DetectionCancelled)
+                )
+            finally:
+                self._leave_broadcast(key, broadcast)
             
             try:
                 # 尝试解析JSON响应
@@ -142,6 +201,9 @@ class LlmClient:
                 
                 return is_ai, reason
                 
+        except (LlmUnavailableError, DetectionCancelled):
+            # 熔断中由调用方决定降级方式，任务取消时不再降级
+            raise
         except Exception as e:
             print(f"分析文本时出错: {str(e)}")
             # 如果提供了困惑度，在错误时使用困惑度简单判断
@@ -151,63 +213,407 @@ class LlmClient:
                 return is_ai_guess, f"LLM分析失败，基于困惑度({perplexity:.2f})推断: {str(e)}"
             return False, f"分析过程出错: {str(e)}"
 
+    def _join_broadcast(self, key):
+        """获取相同提示词的调用共用的判断结论转发器"""
+        with self._broadcasts_lock:
+            broadcast = self._broadcasts.get(key)
+            if broadcast is None:
+                broadcast = self._broadcasts[key] = VerdictBroadcast()
+            broadcast.refs += 1
+            return broadcast
+
+    def _leave_broadcast(self, key, broadcast):
+        with self._broadcasts_lock:
+            broadcast.refs -= 1
+            if broadcast.refs == 0 and self._broadcasts.get(key) is broadcast:
+                del self._broadcasts[key]
+
     async def call_model(self, system_prompt, user_prompt):
         """
         异步调用大模型并返回JSON格式结果
         
+        请求按权重路由到端点池中的某个端点，失败时依次转移到其他可用端点。
+        调用耗时超过近期延迟的百分位阈值时，在对冲预算允许的情况下向另一个端点
+        发出重复请求，两者中先成功返回的结果胜出。
+        
         Args:
             system_prompt: 系统提示
             user_prompt: 用户提示
             
         Returns:
             str: 模型返回的JSON格式文本
+            
+        Raises:
+            LlmUnavailableError: 所有端点都熔断时立即抛出，不发出请求
+            BudgetExceededError: 当前任务的LLM预算已用完（故障转移重试前预算用完时同样抛出）
         """
-        # 在线程池中执行同步API调用
-        with ThreadPoolExecutor() as executor:
-            def _call_api():
-                try:
-                    completion = self.client.chat.completions.create(
-                        model=self.endpoint_id,
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": user_prompt},
-                        ],
-                    )
-                    return completion
-                except Exception as e:
-                    print(f"调用LLM API时出错: {str(e)}")
-                    return None
-            
-            # 异步执行调用
-            completion = await asyncio.get_event_loop().run_in_executor(executor, _call_api)
-            
-            if not completion:
-                raise Exception("无法获取LLM响应")
-                
-            # 提取响应文本
-            response_text = completion.choices[0].message.content
+        request_id = str(uuid.uuid4())
+        endpoint = self._acquire(request_id)
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+        
+        started = time.monotonic()
+        retries = 0
+        tried = []
+        completion = None
+        while endpoint is not None:
+            tried.append(endpoint)
+            try:
+                completion, hedges = await self._run_hedged(endpoint, messages)
+                retries += hedges
+                break
+            except Exception as e:
+                print(f"调用LLM API时出错({endpoint.name}): {str(e)}")
             
-            # 尝试提取JSON部分
+            # 故障转移到尚未尝试过的端点，任务已取消时不再重试
+            if len(tried) >= self.failover_attempts or _is_cancelled():
+                break
+            endpoint = self.pool.choose(exclude=tried)
+            if endpoint is not None:
+                self._charge_retry(request_id, started, retries)
+                retries += 1
+        
+        if not completion:
+            self.journal.record(request_id, (time.monotonic() - started) * 1000, "error", retries=retries)
+            raise Exception("无法获取LLM响应")
+            
+        # 提取响应文本
+        response_text = completion.choices[0].message.content
+        prompt_tokens, completion_tokens = self._record_usage(
+            getattr(completion, "usage", None), system_prompt, user_prompt, response_text
+        )
+        self.journal.record(request_id, (time.monotonic() - started) * 1000, "ok",
+                            prompt_tokens, completion_tokens, retries)
+        return self._extract_json(response_text)
+
+    def _acquire(self, request_id):
+        """
+        发出调用前检查任务预算并选择端点，被拒绝的调用也记录到日志
+        
+        Returns:
+            LlmEndpoint: 本次调用使用的端点
+        """
+        token = get_current_cancel_token()
+        if token is not None:
+            token.raise_if_cancelled()
+        try:
+            budget = get_current_budget()
+            if budget is not None:
+                budget.acquire_call()
+            endpoint = self.pool.choose()
+            if endpoint is None:
+                raise LlmUnavailableError("所有LLM端点都在熔断中，跳过调用")
+            return endpoint
+        except LlmUnavailableError:
+            self.journal.record(request_id, 0, "rejected")
+            raise
+
+    def _charge_retry(self, request_id, started, retries):
+        """
+        故障转移重试前登记一次调用，重试与首次调用一样计入任务预算
+
+        Raises:
+            BudgetExceededError: 预算已用完，不再重试
+        """
+        budget = get_current_budget()
+        if budget is None:
+            return
+        try:
+            budget.acquire_call()
+        except BudgetExceededError:
+            self.journal.record(request_id, (time.monotonic() - started) * 1000, "rejected", retries=retries)
+            raise
+
+    def _acquire_hedge(self, budget):
+        """对冲请求同时占用全局对冲额度和当前任务预算中的一次调用，任一不足时不发出"""
+        if not self.hedge_budget.try_acquire():
+            return False
+        if budget is not None:
             try:
-                # 尝试直接解析整个响应
-                json.loads(response_text)
-                return response_text
-            except json.JSONDecodeError:
-                # 尝试从响应中提取JSON字符串
-                start_idx = response_text.find('{')
-                end_idx = response_text.rfind('}') + 1
-                
-                if start_idx >= 0 and end_idx > start_idx:
-                    json_str = response_text[start_idx:end_idx]
-                    try:
-                        # 验证提取的是有效JSON
-                        json.loads(json_str)
-                        return json_str
-                    except:
-                        pass
+                budget.acquire_call()
+            except BudgetExceededError:
+                self.hedge_budget.release()
+                return False
+        return True
+
+    def _record_usage(self, usage, system_prompt, user_prompt, response_text, budget=None):
+        """
+        记录一次调用的token消耗，优先使用接口返回的usage，缺失时按文本长度估算
+        
+        Args:
+            budget: 计入的任务预算，默认为当前任务的预算
+        
+        Returns:
+            (int, int): 输入token数和输出token数
+        """
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+        estimated = prompt_tokens is None or completion_tokens is None
+        if prompt_tokens is None:
+            prompt_tokens = estimate_tokens(system_prompt) + estimate_tokens(user_prompt)
+        if completion_tokens is None:
+            completion_tokens = estimate_tokens(response_text or "")
+        
+        self.usage_stats.record(prompt_tokens, completion_tokens, estimated)
+        if budget is None:
+            budget = get_current_budget()
+        if budget is not None:
+            budget.record_usage(prompt_tokens, completion_tokens, estimated)
+        return prompt_tokens, completion_tokens
+
+    async def _run_hedged(self, endpoint, messages, **kwargs):
+        """
+        在线程池中调用端点，必要时向另一个端点发出对冲请求
+        
+        对冲请求计入当前任务预算的调用次数，被淘汰的请求结束后它消耗的token同样计入预算
+        
+        Args:
+            endpoint: 主请求使用的端点
+            messages: 请求消息
+            
+        Returns:
+            (result, int): 最先成功返回的调用结果，以及额外发出的对冲请求数
+        """
+        loop = asyncio.get_event_loop()
+        budget = get_current_budget()
+        self.hedge_stats.record_request()
+        self.hedge_budget.on_request()
+        
+        started = time.monotonic()
+        primary = loop.run_in_executor(self.executor, lambda: endpoint.create(messages, **kwargs))
+        
+        threshold = self.latency_tracker.percentile(self.hedge_percentile) if self.hedging else None
+        if threshold is None:
+            result = await primary
+            self.latency_tracker.record(time.monotonic() - started)
+            return result, 0
+        
+        done, _ = await asyncio.wait({primary}, timeout=threshold)
+        if done:
+            result = primary.result()
+            self.latency_tracker.record(time.monotonic() - started)
+            return result, 0
+        
+        if _is_cancelled() or not self._acquire_hedge(budget):
+            self.hedge_stats.record_budget_denied()
+            result = await primary
+            self.latency_tracker.record(time.monotonic() - started)
+            return result, 0
+        
+        # 优先把对冲请求发往其他端点，只有一个端点时发往同一端点
+        hedge_endpoint = self.pool.choose(exclude=[endpoint]) or endpoint
+        self.hedge_stats.record_hedge()
+        hedge_started = time.monotonic()
+        hedge = loop.run_in_executor(self.executor, lambda: hedge_endpoint.create(messages, **kwargs))
+        
+        pending = {primary, hedge}
+        last_error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    last_error = future.exception()
+                    continue
                 
-                # 如果无法提取JSON，返回原始响应
-                return response_text
+                finished = time.monotonic()
+                # 另一个请求稍后成功时记录它的token消耗，失败时不需要处理它的异常
+                for other in pending:
+                    other.add_done_callback(self._record_abandoned(messages, budget))
+                if future is primary:
+                    self.latency_tracker.record(finished - started)
+                else:
+                    # 对冲胜出：原请求结束后再统计实际节省的时间
+                    self.latency_tracker.record(finished - hedge_started)
+                    self._track_hedge_win(primary, started, finished)
+                return future.result(), 1
+        
+        raise last_error
+
+    def _record_abandoned(self, messages, budget):
+        """被对冲淘汰的请求结束后，把它实际消耗的token计入统计和任务预算"""
+        def _on_done(future):
+            if future.cancelled() or future.exception() is not None:
+                return
+            completion = future.result()
+            response_text = completion.choices[0].message.content if getattr(completion, "choices", None) else ""
+            self._record_usage(
+                getattr(completion, "usage", None), messages[0]["content"], messages[1]["content"],
+                response_text, budget=budget
+            )
+        
+        return _on_done
+
+    def _track_hedge_win(self, primary, started, hedge_finished):
+        """原请求结束后记录对冲请求节省的延迟"""
+        def _on_primary_done(future):
+            saved = time.monotonic() - hedge_finished if not future.cancelled() else 0.0
+            self.hedge_stats.record_hedge_win(saved)
+            # 被淘汰的原请求依然是一个有效的延迟样本
+            if not future.cancelled() and future.exception() is None:
+                self.latency_tracker.record(time.monotonic() - started)
+        
+        primary.add_done_callback(_on_primary_done)
+
+    def is_available(self):
+        """LLM服务是否可用，所有端点都熔断时返回 False"""
+        return self.pool.any_available()
+
+    def get_stats(self):
+        """返回客户端运行统计"""
+        threshold = self.latency_tracker.percentile(self.hedge_percentile)
+        return {
+            "usage": self.usage_stats.snapshot(),
+            "coalescing": self.inflight.snapshot(),
+            "endpoints": self.pool.snapshot(),
+            "hedging": {
+                "enabled": self.hedging,
+                "percentile": self.hedge_percentile,
+                "threshold_ms": round(threshold * 1000, 1) if threshold is not None else None,
+                "samples": len(self.latency_tracker),
+                **self.hedge_stats.snapshot(),
+            }
+        }
+
+    async def call_model_stream(self, system_prompt, user_prompt, on_verdict=None, reason_max_tokens=None):
+        """
+        以流式方式调用大模型，增量解析JSON结果
+        
+        is_ai_generated 和 confidence 一旦完整输出就通过 on_verdict 回调发布，
+        reason 超过 token 上限时提前关闭流，减少等待时间和输出token。
+        尚未收到判断结论时失败会转移到其他端点重试。
+        
+        Args:
+            system_prompt: 系统提示
+            user_prompt: 用户提示
+            on_verdict: 判断结论到达时在事件循环中调用的回调
+            reason_max_tokens: 原因文本的token上限，默认取 LLM_REASON_MAX_TOKENS 配置
+            
+        Returns:
+            str: 与 call_model 相同格式的JSON文本
+        """
+        request_id = str(uuid.uuid4())
+        endpoint = self._acquire(request_id)
+        if reason_max_tokens is None:
+            reason_max_tokens = self.reason_max_tokens
+        loop = asyncio.get_event_loop()
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+        
+        request_kwargs = {"stream": True}
+        if reason_max_tokens:
+            # 为 JSON 结构和前两个字段预留少量token
+            request_kwargs["max_tokens"] = reason_max_tokens + 64
+        
+        # 流式读取在线程池中进行，上下文变量不会传递过去，先取出当前任务的取消令牌
+        token = get_current_cancel_token()
+        
+        def _stream_api(endpoint, parser, stream_usage):
+            stream_started = time.monotonic()
+            stream = endpoint.create(messages, **request_kwargs)
+            try:
+                for chunk in stream:
+                    if token is not None and token.is_cancelled:
+                        # 任务已取消，关闭连接让服务端停止生成
+                        raise DetectionCancelled(token.reason)
+                    if getattr(chunk, "usage", None) is not None:
+                        stream_usage.append(chunk.usage)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content or ""
+                    if parser.feed(delta) and on_verdict:
+                        loop.call_soon_threadsafe(on_verdict, parser.verdict())
+                    if parser.done:
+                        break
+            except DetectionCancelled:
+                raise
+            except Exception:
+                endpoint.mark_failed(time.monotonic() - stream_started)
+                raise
+            finally:
+                # 提前结束时关闭底层连接，服务端停止继续生成
+                _close_stream(stream)
+        
+        started = time.monotonic()
+        retries = 0
+        tried = []
+        while True:
+            tried.append(endpoint)
+            parser = StreamingVerdictParser(reason_max_tokens=reason_max_tokens)
+            stream_usage = []
+            try:
+                await loop.run_in_executor(self.executor, _stream_api, endpoint, parser, stream_usage)
+                break
+            except DetectionCancelled:
+                self.journal.record(request_id, (time.monotonic() - started) * 1000, "cancelled", retries=retries)
+                raise
+            except Exception as e:
+                print(f"调用LLM流式API时出错({endpoint.name}): {str(e)}")
+                if parser.has_verdict:
+                    # 判断结论已经拿到，原因不完整也可以使用
+                    break
+            
+            next_endpoint = self.pool.choose(exclude=tried) if len(tried) < self.failover_attempts and not _is_cancelled() else None
+            if next_endpoint is None:
+                self.journal.record(request_id, (time.monotonic() - started) * 1000, "error", retries=retries)
+                raise Exception("无法获取LLM响应")
+            self._charge_retry(request_id, started, retries)
+            endpoint = next_endpoint
+            retries += 1
+        
+        prompt_tokens, completion_tokens = self._record_usage(
+            stream_usage[-1] if stream_usage else None, system_prompt, user_prompt, parser.buffer
+        )
+        self.journal.record(request_id, (time.monotonic() - started) * 1000, "ok",
+                            prompt_tokens, completion_tokens, retries)
+        
+        if not parser.has_verdict:
+            # 模型未按预期格式输出时，退回到整体解析
+            return self._extract_json(parser.buffer)
+        return json.dumps(parser.result(), ensure_ascii=False)
+
+    @staticmethod
+    def _extract_json(response_text):
+        """从模型响应中提取JSON部分，无法提取时返回原始响应"""
+        try:
+            # 尝试直接解析整个响应
+            json.loads(response_text)
+            return response_text
+        except json.JSONDecodeError:
+            # 尝试从响应中提取JSON字符串
+            start_idx = response_text.find('{')
+            end_idx = response_text.rfind('}') + 1
+            
+            if start_idx >= 0 and end_idx > start_idx:
+                json_str = response_text[start_idx:end_idx]
+                try:
+                    # 验证提取的是有效JSON
+                    json.loads(json_str)
+                    return json_str
+                except:
+                    pass
+            
+            # 如果无法提取JSON，返回原始响应
+            return response_text
+
+def _is_cancelled():
+    """当前任务是否已被取消"""
+    token = get_current_cancel_token()
+    return token is not None and token.is_cancelled
+
+def _close_stream(stream):
+    """关闭流式响应，兼容不同版本SDK的Stream对象"""
+    close = getattr(stream, "close", None)
+    if close is None:
+        close = getattr(getattr(stream, "response", None), "close", None)
+    if close is not None:
+        try:
+            close()
+        except Exception:
+            pass
 
 # 创建单例实例
 llm_client = LlmClient() 
\ No newline at end of file
@@ -0,0 +1,94 @@
+import time
+import threading
+import contextvars
+from collections import deque
+from typing import Optional, Dict, Any, List
+
+# 当前协程所属的检测任务ID，由检测流程设置，写入调用日志
+current_task_id = contextvars.ContextVar("current_task_id", default=None)
+
+
+class LlmJournal:
+    """
+    固定容量的LLM调用日志（环形缓冲区）
+
+    只保留最近 capacity 条调用记录，每条记录只包含排查延迟和用量所需的字段，
+    不保存响应对象，避免长期运行的服务内存持续增长。
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.total = 0
+        self._entries = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def record(self,
+               request_id: str,
+               latency_ms: float,
+               status: str,
+               prompt_tokens: int = 0,
+               completion_tokens: int = 0,
+               retries: int = 0,
+               task_id: Optional[str] = None):
+        """
+        记录一次调用
+
+        Args:
+            request_id: 请求ID
+            latency_ms: 调用耗时（毫秒）
+            status: 调用结果，ok / error / rejected
+            prompt_tokens: 输入token数
+            completion_tokens: 输出token数
+            retries: 额外发出的请求次数（对冲、故障转移）
+            task_id: 所属检测任务，默认取当前上下文中的任务ID
+        """
+        entry = {
+            "request_id": request_id,
+            "timestamp": round(time.time(), 3),
+            "task_id": task_id if task_id is not None else current_task_id.get(),
+            "latency_ms": round(latency_ms, 1),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "status": status,
+            "retries": retries,
+        }
+        with self._lock:
+            self._entries.append(entry)
+            self.total += 1
+
+    def entries(self, limit: Optional[int] = None, task_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """返回最近的调用记录，新记录在前"""
+        with self._lock:
+            entries = list(self._entries)
+        entries.reverse()
+        if task_id is not None:
+            entries = [entry for entry in entries if entry["task_id"] == task_id]
+        if limit is not None:
+            entries = entries[:limit]
+        return entries
+
+    def latency_percentiles(self, percents=(50, 90, 95, 99)) -> Dict[str, Optional[float]]:
+        """计算日志中成功调用的延迟百分位数（毫秒）"""
+        with self._lock:
+            latencies = sorted(entry["latency_ms"] for entry in self._entries if entry["status"] == "ok")
+        result = {}
+        for percent in percents:
+            if not latencies:
+                result[f"p{percent}"] = None
+                continue
+            index = min(len(latencies) - 1, int(round(percent / 100.0 * (len(latencies) - 1))))
+            result[f"p{percent}"] = latencies[index]
+        return result
+
+    def summary(self) -> Dict[str, Any]:
+        """日志容量、记录数和各状态计数"""
+        with self._lock:
+            status_counts = {}
+            for entry in self._entries:
+                status_counts[entry["status"]] = status_counts.get(entry["status"], 0) + 1
+            return {
+                "capacity": self.capacity,
+                "size": len(self._entries),
+                "total_recorded": self.total,
+                "status_counts": status_counts,
+            }
@@ -0,0 +1,194 @@
+import time
+import threading
+from collections import deque
+from typing import Optional, Dict, Any
+
+
+class LatencyTracker:
+    """
+    滚动窗口内的LLM调用延迟统计，用于计算对冲请求的触发阈值
+
+    多个检测任务可能在不同线程的事件循环中共用同一个客户端，因此所有操作都加锁。
+    """
+
+    def __init__(self, window_size: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float):
+        """记录一次调用耗时（秒）"""
+        with self._lock:
+            self._samples.append(latency)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """
+        返回窗口内延迟的百分位数
+
+        样本不足 min_samples 时返回 None，此时不应触发对冲
+        """
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(percent / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._samples)
+
+
+class HedgeBudget:
+    """
+    全局对冲预算（令牌桶）
+
+    每个普通请求积累 ratio 个令牌，每发出一次对冲请求消耗一个令牌，
+    因此对冲请求占总请求的比例不会超过 ratio，桶容量限制了突发的对冲数量。
+    """
+
+    def __init__(self, ratio: float = 0.05, burst: float = 5.0):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = burst
+        self._lock = threading.Lock()
+
+    def on_request(self):
+        """每发出一个普通请求时调用，积累对冲额度"""
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def try_acquire(self) -> bool:
+        """尝试消耗一个对冲额度，额度不足时返回 False"""
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+    def release(self):
+        """归还已取得但最终没有使用的对冲额度"""
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + 1.0)
+
+
+class HedgeStats:
+    """对冲请求的计数和节省的延迟统计"""
+
+    def __init__(self):
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+        self.latency_saved = 0.0
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_hedge(self):
+        with self._lock:
+            self.hedges += 1
+
+    def record_budget_denied(self):
+        with self._lock:
+            self.budget_denied += 1
+
+    def record_hedge_win(self, saved: float):
+        """对冲请求先返回时记录，saved 为原请求比对冲请求多花的时间（秒）"""
+        with self._lock:
+            self.hedge_wins += 1
+            self.latency_saved += max(0.0, saved)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_rate": round(self.hedges / self.requests, 4) if self.requests else 0,
+                "hedge_wins": self.hedge_wins,
+                "budget_denied": self.budget_denied,
+                "latency_saved_ms": round(self.latency_saved * 1000, 1),
+                "avg_saved_per_win_ms": round(self.latency_saved * 1000 / self.hedge_wins, 1) if self.hedge_wins else 0,
+            }
+
+
+class LlmUnavailableError(Exception):
+    """LLM服务当前不可用（熔断器打开），调用方应直接走本地降级路径"""
+
+
+class CircuitBreaker:
+    """
+    LLM调用熔断器
+
+    - closed: 正常放行，连续失败达到 failure_threshold 次后打开
+    - open: 直接拒绝调用，经过 reset_timeout 秒后进入半开状态
+    - half_open: 只放行一个探测请求，成功则关闭，失败则重新打开
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _refresh(self, now: float):
+        """打开状态超时后转为半开（调用方需持有锁）"""
+        if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+
+    def is_open(self) -> bool:
+        """熔断器是否处于拒绝状态（不占用半开探测名额）"""
+        with self._lock:
+            self._refresh(time.monotonic())
+            return self.state == self.OPEN or (self.state == self.HALF_OPEN and self._probe_in_flight)
+
+    def allow_request(self) -> bool:
+        """判断是否允许发出请求，半开状态下只允许一个探测请求"""
+        with self._lock:
+            self._refresh(time.monotonic())
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                    print(f"LLM熔断器打开，连续失败 {self.consecutive_failures} 次")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refresh(time.monotonic())
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "trips": self.trips,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import random
+import threading
+from collections import deque
+from typing import Optional, List, Dict, Any, Iterable
+from volcenginesdkarkruntime import Ark
+from .llm_resilience import CircuitBreaker
+
+DEFAULT_BASE_URL = "https://ark.cn-beijing.volces.com/api/v3"
+
+
+class LlmEndpoint:
+    """
+    一个兼容OpenAI接口的LLM服务端点
+
+    每个端点有独立的客户端、熔断器和运行统计，路由时根据观测到的延迟、
+    错误率和剩余配额计算权重。
+    """
+
+    def __init__(self,
+                 name: str,
+                 model: str,
+                 base_url: str = DEFAULT_BASE_URL,
+                 api_key: Optional[str] = None,
+                 weight: float = 1.0,
+                 quota_per_minute: Optional[int] = None,
+                 timeout: float = 60.0,
+                 failure_threshold: int = 5,
+                 reset_timeout: float = 30.0):
+        self.name = name
+        self.model = model
+        self.base_url = base_url
+        self.weight = weight
+        self.quota_per_minute = quota_per_minute
+        self.client = Ark(base_url=base_url, api_key=api_key or "EMPTY", timeout=timeout)
+        self.breaker = CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout)
+
+        # 指数加权移动平均，初始值使未观测过的端点也能获得流量
+        self.ewma_latency = None
+        self.ewma_error_rate = 0.0
+        self.alpha = 0.2
+        self.requests = 0
+        self.failures = 0
+        self.in_flight = 0
+        self._recent_calls = deque()  # 最近一分钟内的调用时间，用于计算剩余配额
+        self._lock = threading.Lock()
+
+    def remaining_quota(self) -> Optional[int]:
+        """最近一分钟内剩余的调用配额，未配置配额时返回 None"""
+        if self.quota_per_minute is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            while self._recent_calls and now - self._recent_calls[0] > 60:
+                self._recent_calls.popleft()
+            return max(0, self.quota_per_minute - len(self._recent_calls))
+
+    def score(self, default_latency: float) -> float:
+        """路由权重：配置权重 × 延迟倒数 × 成功率 × 配额余量"""
+        latency = self.ewma_latency if self.ewma_latency is not None else default_latency
+        score = self.weight / max(latency, 0.05)
+        score *= (1.0 - min(self.ewma_error_rate, 0.95)) ** 2
+        remaining = self.remaining_quota()
+        if remaining is not None:
+            score *= min(1.0, remaining / max(1.0, self.quota_per_minute * 0.2))
+        # 并发中的请求越多，分到的新请求越少
+        return score / (1 + self.in_flight)
+
+    def create(self, messages: List[Dict[str, str]], **kwargs):
+        """同步调用 chat completions 接口，并记录延迟、错误和配额"""
+        started = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self._recent_calls.append(started)
+        try:
+            result = self.client.chat.completions.create(model=self.model, messages=messages, **kwargs)
+        except Exception:
+            self._record(time.monotonic() - started, failed=True)
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        self._record(time.monotonic() - started, failed=False)
+        return result
+
+    def mark_failed(self, latency: float):
+        """记录在 create 返回之后才发生的失败（例如流式读取中断）"""
+        self._record(latency, failed=True)
+
+    def _record(self, latency: float, failed: bool):
+        with self._lock:
+            if failed:
+                self.failures += 1
+            else:
+                self.ewma_latency = latency if self.ewma_latency is None else \
+                    self.alpha * latency + (1 - self.alpha) * self.ewma_latency
+            self.ewma_error_rate = self.alpha * (1.0 if failed else 0.0) + (1 - self.alpha) * self.ewma_error_rate
+        if failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def snapshot(self) -> Dict[str, Any]:
+        remaining = self.remaining_quota()
+        with self._lock:
+            return {
+                "name": self.name,
+                "base_url": self.base_url,
+                "model": self.model,
+                "weight": self.weight,
+                "requests": self.requests,
+                "failures": self.failures,
+                "in_flight": self.in_flight,
+                "ewma_latency_ms": round(self.ewma_latency * 1000, 1) if self.ewma_latency is not None else None,
+                "ewma_error_rate": round(self.ewma_error_rate, 4),
+                "quota_per_minute": self.quota_per_minute,
+                "remaining_quota": remaining,
+                "circuit_breaker": self.breaker.snapshot(),
+            }
+
+
+class EndpointPool:
+    """
+    LLM端点池，按健康状况和延迟加权路由，并支持故障转移
+
+    熔断中或配额用完的端点不参与路由。
+    """
+
+    def __init__(self, endpoints: List[LlmEndpoint]):
+        if not endpoints:
+            raise ValueError("至少需要配置一个LLM端点")
+        self.endpoints = endpoints
+
+    @classmethod
+    def from_env(cls) -> "EndpointPool":
+        """
+        根据环境变量创建端点池
+
+        LLM_ENDPOINTS 为JSON数组，每一项包含 name、model、base_url、api_key（或 api_key_env）、
+        weight、quota_per_minute；未配置时使用 ENDPOINT_ID 和 ARK_API_KEY 创建单个端点。
+        """
+        timeout = float(os.getenv('LLM_TIMEOUT', '60'))
+        failure_threshold = int(os.getenv('LLM_BREAKER_FAILURES', '5'))
+        reset_timeout = float(os.getenv('LLM_BREAKER_RESET_SECONDS', '30'))
+
+        endpoints = []
+        raw = os.getenv('LLM_ENDPOINTS', '').strip()
+        if raw:
+            try:
+                configs = json.loads(raw)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"LLM_ENDPOINTS 不是有效的JSON: {str(e)}")
+            for index, config in enumerate(configs):
+                api_key = config.get("api_key")
+                if not api_key and config.get("api_key_env"):
+                    api_key = os.environ.get(config["api_key_env"])
+                endpoints.append(LlmEndpoint(
+                    name=config.get("name", f"endpoint-{index}"),
+                    model=config["model"],
+                    base_url=config.get("base_url", DEFAULT_BASE_URL),
+                    api_key=api_key,
+                    weight=float(config.get("weight", 1.0)),
+                    quota_per_minute=config.get("quota_per_minute"),
+                    timeout=float(config.get("timeout", timeout)),
+                    failure_threshold=failure_threshold,
+                    reset_timeout=reset_timeout,
+                ))
+        else:
+            endpoints.append(LlmEndpoint(
+                name="default",
+                model=os.getenv('ENDPOINT_ID', 'ep-20250422142640-ksbch'),
+                base_url=os.getenv('LLM_BASE_URL', DEFAULT_BASE_URL),
+                api_key=os.environ.get("ARK_API_KEY", "f1298f35-98b3-4068-82b9-fd0bae492fc7"),
+                timeout=timeout,
+                failure_threshold=failure_threshold,
+                reset_timeout=reset_timeout,
+            ))
+        return cls(endpoints)
+
+    def _default_latency(self) -> float:
+        """未观测过的端点使用已观测端点的平均延迟，保证它们也能分到探索流量"""
+        observed = [endpoint.ewma_latency for endpoint in self.endpoints if endpoint.ewma_latency is not None]
+        return sum(observed) / len(observed) if observed else 1.0
+
+    def choose(self, exclude: Iterable[LlmEndpoint] = ()) -> Optional[LlmEndpoint]:
+        """
+        按权重随机选择一个可用端点
+
+        选中的端点如果处于半开状态会占用其探测名额，因此只对真正要发出的请求调用。
+
+        Returns:
+            LlmEndpoint: 选中的端点，没有可用端点时返回 None
+        """
+        excluded = set(id(endpoint) for endpoint in exclude)
+        default_latency = self._default_latency()
+        candidates = []
+        for endpoint in self.endpoints:
+            if id(endpoint) in excluded or endpoint.breaker.is_open():
+                continue
+            if endpoint.remaining_quota() == 0:
+                continue
+            candidates.append((endpoint, endpoint.score(default_latency)))
+
+        while candidates:
+            total = sum(score for _, score in candidates)
+            pick = random.uniform(0, total) if total > 0 else 0
+            chosen_index = len(candidates) - 1
+            for index, (_, score) in enumerate(candidates):
+                pick -= score
+                if pick <= 0:
+                    chosen_index = index
+                    break
+            endpoint, _ = candidates.pop(chosen_index)
+            if endpoint.breaker.allow_request():
+                return endpoint
+        return None
+
+    def any_available(self) -> bool:
+        """是否至少有一个端点没有熔断"""
+        return any(not endpoint.breaker.is_open() for endpoint in self.endpoints)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [endpoint.snapshot() for endpoint in self.endpoints]
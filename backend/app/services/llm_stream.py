@@ -0,0 +1,210 @@
+import re
+import json
+import asyncio
+import threading
+from typing import Optional, Dict, Any, Callable, List, Tuple
+
+# 匹配已经完整输出的判断字段
+_IS_AI_PATTERN = re.compile(r'"is_ai_generated"\s*:\s*(true|false)', re.IGNORECASE)
+# 数字后必须跟分隔符，避免把流中被截断的 "8" 当作 "85"
+_CONFIDENCE_PATTERN = re.compile(r'"confidence"\s*:\s*"?(-?\d+(?:\.\d+)?)"?\s*[,}\n]')
+_REASON_START_PATTERN = re.compile(r'"reason"\s*:\s*"')
+_CJK_PATTERN = re.compile(r'[\u4e00-\u9fff\u3000-\u303f\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估计文本的token数量
+
+    中文字符大约按一个字符一个token计算，其余字符按4个字符一个token计算
+    """
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return _tokens_of(cjk_count, len(text) - cjk_count)
+
+
+def _tokens_of(cjk_count: int, other_count: int) -> int:
+    return cjk_count + (other_count + 3) // 4
+
+
+class StreamingVerdictParser:
+    """
+    增量解析LLM流式输出的JSON结果
+
+    模型按 is_ai_generated、confidence、reason 的顺序输出字段，
+    前两个字段一旦完整即可得到判断结论，无需等待较长的 reason 文本。
+    """
+
+    def __init__(self, reason_max_tokens: Optional[int] = None):
+        self.reason_max_tokens = reason_max_tokens
+        self.buffer = ""
+        self.is_ai_generated = None
+        self.confidence = None
+        self.reason_chars = []
+        # reason 中的中文字符数和其他字符数，逐字符累加，不必每次重新扫描整个 reason
+        self._reason_cjk = 0
+        self._reason_other = 0
+        self.reason_complete = False
+        self.reason_truncated = False
+        self._reason_pos = None  # reason 字符串内容在 buffer 中的起始位置
+        self._escape = False
+
+    @property
+    def has_verdict(self) -> bool:
+        """判断字段和置信度是否都已解析出来"""
+        return self.is_ai_generated is not None and self.confidence is not None
+
+    @property
+    def done(self) -> bool:
+        """是否已经拿到全部需要的内容，可以提前结束流"""
+        return self.has_verdict and (self.reason_complete or self.reason_truncated)
+
+    @property
+    def reason(self) -> str:
+        return "".join(self.reason_chars)
+
+    @property
+    def reason_tokens(self) -> int:
+        """已解析的 reason 的估算token数，与 estimate_tokens(self.reason) 相同"""
+        return _tokens_of(self._reason_cjk, self._reason_other)
+
+    def feed(self, chunk: str) -> bool:
+        """
+        输入一段新的流式文本
+
+        Returns:
+            bool: 本次输入是否让判断结论首次变为可用
+        """
+        if not chunk:
+            return False
+
+        had_verdict = self.has_verdict
+        self.buffer += chunk
+
+        if self.is_ai_generated is None:
+            match = _IS_AI_PATTERN.search(self.buffer)
+            if match:
+                self.is_ai_generated = match.group(1).lower() == "true"
+
+        if self.confidence is None:
+            match = _CONFIDENCE_PATTERN.search(self.buffer)
+            if match:
+                try:
+                    self.confidence = float(match.group(1))
+                except ValueError:
+                    pass
+
+        self._consume_reason()
+
+        return self.has_verdict and not had_verdict
+
+    def _consume_reason(self):
+        """逐字符读取 reason 字符串，处理转义并按token上限截断"""
+        if self.reason_complete or self.reason_truncated:
+            return
+
+        if self._reason_pos is None:
+            match = _REASON_START_PATTERN.search(self.buffer)
+            if not match:
+                return
+            self._reason_pos = match.end()
+
+        pos = self._reason_pos
+        while pos < len(self.buffer):
+            char = self.buffer[pos]
+            pos += 1
+            if self._escape:
+                self._escape = False
+                escaped = {"n": "\n", "t": "\t", '"': '"', "\\": "\\", "/": "/"}.get(char)
+                # \uXXXX 等不常见的转义直接保留原样
+                self._append_reason(escaped if escaped is not None else "\\" + char)
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self.reason_complete = True
+                break
+            else:
+                self._append_reason(char)
+
+            if self.reason_max_tokens and self.reason_tokens >= self.reason_max_tokens:
+                self.reason_truncated = True
+                break
+
+        self._reason_pos = pos
+
+    def _append_reason(self, text: str):
+        self.reason_chars.append(text)
+        cjk_count = len(_CJK_PATTERN.findall(text))
+        self._reason_cjk += cjk_count
+        self._reason_other += len(text) - cjk_count
+
+    def verdict(self) -> Dict[str, Any]:
+        """返回当前可用的判断结论（不含原因）"""
+        return {
+            "is_ai_generated": self.is_ai_generated,
+            "confidence": self.confidence,
+        }
+
+    def result(self) -> Dict[str, Any]:
+        """返回与非流式调用相同结构的结果"""
+        # 流完整结束时优先使用完整JSON，保留模型可能输出的其他字段
+        if not self.reason_truncated:
+            start_idx = self.buffer.find("{")
+            end_idx = self.buffer.rfind("}") + 1
+            if start_idx >= 0 and end_idx > start_idx:
+                try:
+                    return json.loads(self.buffer[start_idx:end_idx])
+                except json.JSONDecodeError:
+                    pass
+
+        reason = self.reason or "未提供原因"
+        if self.reason_truncated:
+            reason += "…"
+        return {
+            "is_ai_generated": bool(self.is_ai_generated),
+            "confidence": self.confidence if self.confidence is not None else 50,
+            "reason": reason,
+        }
+
+
+class VerdictBroadcast:
+    """
+    把流式判断结论转发给合并到同一次LLM调用的所有调用方
+
+    相同提示词的并发请求只有执行者发出流式调用，等待者各自注册 on_verdict 回调，
+    结论到达时在各调用方自己的事件循环中调用；结论已到达后才注册的回调立即调用。
+    调用方可能运行在不同线程的事件循环中，所有状态在锁内修改。
+    """
+
+    def __init__(self):
+        self.refs = 0
+        self._verdict: Optional[Dict[str, Any]] = None
+        self._listeners: List[Tuple[asyncio.AbstractEventLoop, Callable[[Dict[str, Any]], None]]] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback: Optional[Callable[[Dict[str, Any]], None]]):
+        """在调用方的事件循环中注册回调"""
+        if callback is None:
+            return
+        loop = asyncio.get_event_loop()
+        with self._lock:
+            verdict = self._verdict
+            if verdict is None:
+                self._listeners.append((loop, callback))
+                return
+        loop.call_soon(callback, verdict)
+
+    def publish(self, verdict: Dict[str, Any]):
+        """发布判断结论，只有第一次发布有效（执行者失败后等待者自行重试时不会重复通知）"""
+        with self._lock:
+            if self._verdict is not None:
+                return
+            self._verdict = verdict
+            listeners, self._listeners = self._listeners, []
+        for loop, callback in listeners:
+            try:
+                loop.call_soon_threadsafe(callback, verdict)
+            except RuntimeError:
+                # 调用方的事件循环已经关闭
+                pass
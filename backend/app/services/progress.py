@@ -0,0 +1,162 @@
+import os
+import time
+import threading
+from collections import deque
+from typing import Any, Dict, Optional
+
+# 任务结束后进度信息在内存中保留的时间（秒）
+PROGRESS_RETENTION_SECONDS = float(os.getenv("PROGRESS_RETENTION_SECONDS", "600"))
+# 进度中保留的最近提前到达的片段判断结论数
+PROGRESS_RECENT_VERDICTS = int(os.getenv("PROGRESS_RECENT_VERDICTS", "20"))
+
+# 进度阶段
+PHASE_QUEUED = "queued"
+PHASE_ANALYZING = "analyzing"
+PHASE_COMPLETED = "completed"
+PHASE_FAILED = "failed"
+TERMINAL_PHASES = (PHASE_COMPLETED, PHASE_FAILED)
+
+
+class TaskProgress:
+    """
+    单个检测任务的实时进度
+
+    由工作进程中的检测流水线在任务线程中更新，由作业心跳线程读取后保存到数据库，
+    API的进度接口和SSE读取保存的进度。所有状态都在锁内修改。
+    """
+
+    def __init__(self, task_id: str, owner_id: Optional[str] = None):
+        self.task_id = task_id
+        self.owner_id = owner_id
+        self.phase = PHASE_QUEUED
+        self.total = 0               # 已切分出的片段数
+        self.total_final = False     # 切分是否已经完成，完成前 total 还会增长
+        self.done = 0
+        self.llm_in_flight = 0
+        # LLM流式输出中提前到达的判断结论，原因尚未输出完时即可从进度中读取
+        self.verdicts = 0
+        self.verdicts_ai = 0
+        self.recent_verdicts = deque(maxlen=PROGRESS_RECENT_VERDICTS)
+        self.message: Optional[str] = None
+        self.started_at = time.time()
+        self.updated_at = self.started_at
+        self.finished_at: Optional[float] = None
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def _changed(self):
+        """在锁内调用：更新版本号"""
+        self.version += 1
+        self.updated_at = time.time()
+
+    def set_phase(self, phase: str, message: Optional[str] = None):
+        with self._lock:
+            self.phase = phase
+            if message is not None:
+                self.message = message
+            if phase in TERMINAL_PHASES:
+                self.finished_at = time.time()
+                self.llm_in_flight = 0
+            self._changed()
+
+    def add_segments(self, count: int = 1):
+        with self._lock:
+            self.total += count
+            self._changed()
+
+    def segmentation_finished(self):
+        with self._lock:
+            self.total_final = True
+            self._changed()
+
+    def llm_started(self):
+        with self._lock:
+            self.llm_in_flight += 1
+            self._changed()
+
+    def llm_finished(self):
+        with self._lock:
+            self.llm_in_flight = max(0, self.llm_in_flight - 1)
+            self._changed()
+
+    def segment_verdict(self, index: int, verdict: Dict[str, Any]):
+        """记录某个片段提前到达的LLM判断结论（is_ai_generated 和 confidence）"""
+        with self._lock:
+            self.verdicts += 1
+            if verdict.get("is_ai_generated"):
+                self.verdicts_ai += 1
+            self.recent_verdicts.append({
+                "index": index,
+                "is_ai_generated": verdict.get("is_ai_generated"),
+                "confidence": verdict.get("confidence"),
+            })
+            self._changed()
+
+    def segment_done(self, count: int = 1):
+        with self._lock:
+            self.done += count
+            self._changed()
+
+    def _eta_seconds(self, now: float) -> Optional[float]:
+        """按开始处理以来的平均速度估计剩余时间，切分未完成时基于已知片段数"""
+        if self.phase in TERMINAL_PHASES:
+            return 0.0
+        if self.done == 0 or self.total <= self.done:
+            return None
+        elapsed = now - self.started_at
+        rate = self.done / elapsed if elapsed > 0 else 0
+        if rate <= 0:
+            return None
+        return round((self.total - self.done) / rate, 1)
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            return {
+                "task_id": self.task_id,
+                "phase": self.phase,
+                "segments_total": self.total,
+                "segments_total_final": self.total_final,
+                "segments_done": self.done,
+                "percent": round(self.done / self.total * 100, 1) if self.total else 0.0,
+                "llm_in_flight": self.llm_in_flight,
+                "verdicts_ready": self.verdicts,
+                "verdicts_ai": self.verdicts_ai,
+                "recent_verdicts": list(self.recent_verdicts),
+                "eta_seconds": self._eta_seconds(now),
+                "elapsed_seconds": round((self.finished_at or now) - self.started_at, 1),
+                "message": self.message,
+                "version": self.version,
+            }
+
+
+class ProgressRegistry:
+    """工作进程内所有检测任务的进度，已结束的任务保留一段时间后清除"""
+
+    def __init__(self, retention_seconds: float = PROGRESS_RETENTION_SECONDS):
+        self.retention_seconds = retention_seconds
+        self._tasks: Dict[str, TaskProgress] = {}
+        self._lock = threading.Lock()
+
+    def start(self, task_id: str, owner_id: Optional[str] = None) -> TaskProgress:
+        """为任务创建新的进度记录（重新检测时替换旧记录）"""
+        progress = TaskProgress(task_id, owner_id)
+        with self._lock:
+            self._prune()
+            self._tasks[task_id] = progress
+        return progress
+
+    def get(self, task_id: str) -> Optional[TaskProgress]:
+        with self._lock:
+            self._prune()
+            return self._tasks.get(task_id)
+
+    def _prune(self):
+        now = time.time()
+        expired = [task_id for task_id, progress in self._tasks.items()
+                   if progress.finished_at is not None and now - progress.finished_at > self.retention_seconds]
+        for task_id in expired:
+            del self._tasks[task_id]
+
+
+progress_registry = ProgressRegistry()
@@ -30,4 +30,24 @@ def extract_text_from_pdf(file_path):
         doc.close()
     except Exception as e:
         print(f"从PDF提取文本时出错: {str(e)}")
-    return text 
\ No newline at end of file
+    return text
+
+def iter_pdf_pages(file_path):
+    """逐页提取PDF文件中的文本
+    Args:
+        file_path (str): PDF文件路径
+    Yields:
+        str: 每一页的文本内容
+    """
+    try:
+        doc = fitz.open(file_path)
+    except Exception as e:
+        print(f"从PDF提取文本时出错: {str(e)}")
+        return
+    try:
+        for page in doc:
+            yield page.get_text()
+    except Exception as e:
+        print(f"从PDF提取文本时出错: {str(e)}")
+    finally:
+        doc.close()
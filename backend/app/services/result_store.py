@@ -0,0 +1,211 @@
+import os
+import json
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from ..schemas.database_models import ParagraphResult, TaskResultBlob
+from ..utils.database import SessionLocal
+
+# 片段结果的存储方式：blob 表示任务完成后把片段结果合并为一个压缩块，rows 表示保留逐行存储
+RESULT_STORAGE = os.getenv("RESULT_STORAGE", "blob").lower()
+# 压缩级别（1-9）
+RESULT_BLOB_COMPRESS_LEVEL = int(os.getenv("RESULT_BLOB_COMPRESS_LEVEL", "6"))
+
+FORMAT_VERSION = 1
+
+# metrics_data 中的降级标记，按位存储
+FLAG_BITS = {"degraded": 1, "budget_skipped": 2, "unsampled": 4, "preliminary": 8}
+
+
+class StoredParagraph:
+    """
+    从压缩块中解码出的片段结果
+
+    属性与 ParagraphResult 相同，读取结果的代码（状态接口、报告）不需要区分两种存储方式
+    """
+
+    __slots__ = ("id", "task_id", "segment_index", "paragraph", "ai_generated", "reason",
+                 "perplexity", "burstiness", "confidence", "ai_likelihood", "metrics_data")
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+
+def encode_results(rows: List[Any]) -> Tuple[bytes, int]:
+    """
+    把按片段顺序排列的结果编码为压缩块
+
+    按列存储：文本列为字符串数组，AI可能性评级按出现顺序编为标签表中的序号，
+    降级标记编为位掩码，整体用JSON序列化后以zlib压缩
+
+    Returns:
+        Tuple[bytes, int]: 压缩块和压缩前的字节数
+    """
+    labels: List[str] = []
+    label_codes: Dict[str, int] = {}
+    likelihood = []
+    flags = []
+    for row in rows:
+        label = row.ai_likelihood
+        if label is None:
+            likelihood.append(-1)
+        else:
+            if label not in label_codes:
+                label_codes[label] = len(labels)
+                labels.append(label)
+            likelihood.append(label_codes[label])
+        mask = 0
+        if row.metrics_data:
+            try:
+                metrics = json.loads(row.metrics_data)
+            except ValueError:
+                metrics = {}
+            for name, bit in FLAG_BITS.items():
+                if metrics.get(name):
+                    mask |= bit
+        flags.append(mask)
+
+    columns = {
+        "segment_index": [row.segment_index for row in rows],
+        "paragraph": [row.paragraph for row in rows],
+        "ai_generated": [1 if row.ai_generated else 0 for row in rows],
+        "reason": [row.reason for row in rows],
+        "perplexity": [row.perplexity for row in rows],
+        "confidence": [row.confidence for row in rows],
+        "likelihood_labels": labels,
+        "likelihood": likelihood,
+        "flags": flags,
+    }
+    raw = json.dumps(columns, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return zlib.compress(raw, RESULT_BLOB_COMPRESS_LEVEL), len(raw)
+
+
+def decode_results(task_id: str, data: bytes) -> List[StoredParagraph]:
+    """解码压缩块，返回按片段顺序排列的结果"""
+    columns = json.loads(zlib.decompress(data).decode("utf-8"))
+    labels = columns["likelihood_labels"]
+    paragraphs = []
+    for position, index in enumerate(columns["segment_index"]):
+        code = columns["likelihood"][position]
+        mask = columns["flags"][position]
+        flags = {name: True for name, bit in FLAG_BITS.items() if mask & bit}
+        paragraphs.append(StoredParagraph(
+            id=f"{task_id}:{position:06d}",
+            task_id=task_id,
+            segment_index=index,
+            paragraph=columns["paragraph"][position],
+            ai_generated=bool(columns["ai_generated"][position]),
+            reason=columns["reason"][position],
+            perplexity=columns["perplexity"][position],
+            confidence=columns["confidence"][position],
+            ai_likelihood=labels[code] if code >= 0 else None,
+            metrics_data=json.dumps(flags) if flags else None
+        ))
+    return paragraphs
+
+
+class ResultBlob:
+    """任务的压缩结果；汇总列直接可用，片段结果在第一次访问 paragraphs 时才解码"""
+
+    def __init__(self, blob: TaskResultBlob):
+        self.task_id = blob.task_id
+        self.segment_count = blob.segment_count
+        self.ai_segment_count = blob.ai_segment_count
+        self._data = blob.data
+        self._paragraphs: Optional[List[StoredParagraph]] = None
+
+    @property
+    def paragraphs(self) -> List[StoredParagraph]:
+        if self._paragraphs is None:
+            self._paragraphs = decode_results(self.task_id, self._data)
+            self._data = None
+        return self._paragraphs
+
+
+def load_result_blob(db: Session, task_id: str) -> Optional[ResultBlob]:
+    blob = db.query(TaskResultBlob).filter(TaskResultBlob.task_id == task_id).first()
+    return ResultBlob(blob) if blob is not None else None
+
+
+def load_paragraph_results(db: Session, task_id: str) -> List[Any]:
+    """
+    按片段顺序读取任务的片段结果，已合并为压缩块的任务从压缩块解码
+
+    逐行存储的结果只读取列，不创建ORM对象，处理中的任务每次轮询都会读取全部已完成的片段
+
+    Returns:
+        List: 与 ParagraphResult 属性相同的只读行，或 StoredParagraph
+    """
+    blob = load_result_blob(db, task_id)
+    if blob is not None:
+        return blob.paragraphs
+    table = ParagraphResult.__table__
+    rows = db.execute(
+        select(table).where(table.c.task_id == task_id).order_by(table.c.segment_index)
+    ).all()
+    if not rows:
+        # 读取期间任务的结果恰好完成合并
+        blob = load_result_blob(db, task_id)
+        if blob is not None:
+            return blob.paragraphs
+    return rows
+
+
+def store_result_blob(db: Session, task_id: str, rows: List[Any]) -> TaskResultBlob:
+    """把片段结果编码后写入压缩块（不提交），已有的压缩块被替换"""
+    data, raw_size = encode_results(rows)
+    db.query(TaskResultBlob).filter(TaskResultBlob.task_id == task_id).delete(synchronize_session=False)
+    blob = TaskResultBlob(
+        task_id=task_id,
+        format_version=FORMAT_VERSION,
+        segment_count=len(rows),
+        ai_segment_count=sum(1 for row in rows if row.ai_generated),
+        raw_size=raw_size,
+        data=data
+    )
+    db.add(blob)
+    return blob
+
+
+def compact_rows(db: Session, task_id: str) -> Optional[TaskResultBlob]:
+    """
+    把任务逐行存储的片段结果合并为压缩块并删除原有的行（不提交）
+
+    Returns:
+        TaskResultBlob: 新的压缩块；任务没有逐行存储的结果时返回 None
+    """
+    rows = db.query(ParagraphResult).filter(
+        ParagraphResult.task_id == task_id
+    ).order_by(ParagraphResult.segment_index).all()
+    if not rows:
+        return None
+    blob = store_result_blob(db, task_id, rows)
+    db.query(ParagraphResult).filter(ParagraphResult.task_id == task_id).delete(synchronize_session=False)
+    return blob
+
+
+def compact_task_results(task_id: str) -> bool:
+    """
+    任务完成后合并片段结果，合并和删除在同一个事务中完成，读取方不会看到结果缺失
+
+    Returns:
+        bool: 是否已合并；RESULT_STORAGE 不是 blob 或没有需要合并的结果时为 False
+    """
+    if RESULT_STORAGE != "blob":
+        return False
+    db = SessionLocal()
+    try:
+        compacted = compact_rows(db, task_id) is not None
+        db.commit()
+        return compacted
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def delete_result_blob(db: Session, task_id: str):
+    db.query(TaskResultBlob).filter(TaskResultBlob.task_id == task_id).delete(synchronize_session=False)
@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import asyncio
+from typing import Any, Dict, List
+from sqlalchemy.orm import Session
+from ..schemas.database_models import ParagraphResult
+from ..utils.database import SessionLocal
+from .result_store import delete_result_blob
+
+# 每批写入的片段数量，以及距上次写入的最长间隔（秒），任一条件满足即写入
+RESULT_BATCH_SIZE = int(os.getenv("RESULT_BATCH_SIZE", "20"))
+RESULT_FLUSH_SECONDS = float(os.getenv("RESULT_FLUSH_SECONDS", "2"))
+
+
+def insert_paragraph_results(db: Session, rows: List[Dict[str, Any]]):
+    """
+    批量插入片段结果（不提交）
+
+    使用Core的 insert 一次 executemany 写入整批，不为每行创建ORM对象和跟踪状态；
+    rows 中每个字典的键为 ParagraphResult 的列名，id 等默认值由列定义生成
+    """
+    if rows:
+        db.execute(ParagraphResult.__table__.insert(), rows)
+
+
+class ResultWriter:
+    """
+    边分析边写入片段结果
+
+    片段结果按顺序到达后先缓存在内存中，凑满一批或超过写入间隔时在一个短事务中写入，
+    数据库操作在线程池中执行，不阻塞检测任务的事件循环。任务中途崩溃时已写入的结果保留，
+    处理中的任务也能查询到已完成的片段。
+    同一片段再次写入时替换之前的结果，渐进式检测中LLM分析结果替换初步结果。
+    """
+
+    def __init__(self, task_id: str, batch_size: int = RESULT_BATCH_SIZE, flush_seconds: float = RESULT_FLUSH_SECONDS):
+        self.task_id = task_id
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        self.written = 0
+        self.batches = 0
+        self._rows: List[Dict[str, Any]] = []
+        self._last_flush = time.monotonic()
+
+    async def reset(self):
+        """删除任务之前写入的片段结果，重新检测前调用"""
+        await asyncio.get_event_loop().run_in_executor(None, self._delete_existing)
+
+    async def add(self, index: int, result: Any):
+        """
+        加入一个片段的分析结果，可直接作为检测流水线的 on_result
+
+        Args:
+            index: 片段序号
+            result: 片段分析结果，分析出错的片段（异常对象）不写入
+        """
+        if isinstance(result, Exception):
+            return
+        # 降级标记写入额外指标，恢复检测时据此还原整体统计
+        flags = {name: True for name in ("degraded", "budget_skipped", "unsampled", "preliminary") if result.get(name)}
+        self._rows.append({
+            "task_id": self.task_id,
+            "segment_index": index,
+            "paragraph": result["paragraph"],
+            "ai_generated": result["ai_generated"],
+            "reason": result["reason"],
+            "perplexity": result.get("perplexity"),
+            "ai_likelihood": result.get("is_ai_likelihood"),
+            "metrics_data": json.dumps(flags) if flags else None,
+        })
+        if len(self._rows) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_seconds:
+            await self.flush()
+
+    async def flush(self, raise_errors: bool = False):
+        """
+        写入缓存中的全部结果
+
+        Args:
+            raise_errors: 写入失败时是否抛出异常；为 False 时结果保留在缓存中，下次写入时重试
+        """
+        self._last_flush = time.monotonic()
+        if not self._rows:
+            return
+        # 同一片段在一批中出现多次时只保留最后的结果
+        rows = list({row["segment_index"]: row for row in self._rows}.values())
+        self._rows = []
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, self._write, rows)
+        except Exception as e:
+            print(f"写入任务 {self.task_id} 的片段结果失败，稍后重试: {str(e)}")
+            self._rows = rows + self._rows
+            if raise_errors:
+                raise
+            return
+        self.written += len(rows)
+        self.batches += 1
+
+    async def close(self):
+        """写入剩余结果，失败时抛出异常"""
+        await self.flush(raise_errors=True)
+
+    def _write(self, rows: List[Dict[str, Any]]):
+        db = SessionLocal()
+        try:
+            indices = [row["segment_index"] for row in rows]
+            db.query(ParagraphResult).filter(
+                ParagraphResult.task_id == self.task_id,
+                ParagraphResult.segment_index.in_(indices)
+            ).delete(synchronize_session=False)
+            insert_paragraph_results(db, rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _delete_existing(self):
+        db = SessionLocal()
+        try:
+            db.query(ParagraphResult).filter(ParagraphResult.task_id == self.task_id).delete(synchronize_session=False)
+            delete_result_blob(db, self.task_id)
+            db.commit()
+        finally:
+            db.close()
@@ -0,0 +1,226 @@
+import os
+import math
+import random
+from bisect import bisect_right
+from statistics import NormalDist
+from typing import Any, Dict, List, Optional, Tuple
+
+# 是否默认对长文档使用抽样检测
+SAMPLING_ENABLED = os.getenv("DETECTION_SAMPLING", "false").lower() == "true"
+# 置信水平，以及 ai_percentage 置信区间半宽的目标（百分点），达到后停止抽样
+SAMPLING_CONFIDENCE = float(os.getenv("SAMPLING_CONFIDENCE", "0.95"))
+SAMPLING_TARGET_HALF_WIDTH = float(os.getenv("SAMPLING_TARGET_HALF_WIDTH", "5"))
+# 至少分析的样本数、最多分析的样本数（0 表示不限制），片段数少于下限时全部分析
+SAMPLING_MIN_SAMPLES = int(os.getenv("SAMPLING_MIN_SAMPLES", "30"))
+SAMPLING_MAX_SAMPLES = int(os.getenv("SAMPLING_MAX_SAMPLES", "0"))
+SAMPLING_MIN_SEGMENTS = int(os.getenv("SAMPLING_MIN_SEGMENTS", "100"))
+# 按位置和困惑度划分的层数
+SAMPLING_POSITION_STRATA = int(os.getenv("SAMPLING_POSITION_STRATA", "4"))
+SAMPLING_PERPLEXITY_STRATA = int(os.getenv("SAMPLING_PERPLEXITY_STRATA", "3"))
+
+# 停止抽样的原因
+STOP_PRECISION = "precision"        # 置信区间达到目标宽度
+STOP_EXHAUSTED = "exhausted"        # 所有片段都已分析
+STOP_MAX_SAMPLES = "max_samples"    # 达到样本数上限
+
+
+class _Stratum:
+    """一层片段：未抽取的片段序号，以及已抽取、已得到结果的数量"""
+
+    def __init__(self, key: Tuple[int, int]):
+        self.key = key
+        self.indices: List[int] = []
+        self.drawn = 0
+        self.observed = 0
+        self.ai_count = 0
+
+    @property
+    def size(self) -> int:
+        return len(self.indices) + self.drawn
+
+
+class SequentialSampler:
+    """
+    分层序贯抽样，估计文档的 ai_percentage
+
+    片段按在文档中的位置和困惑度分层，每次从已抽取比例最低的层中随机抽取一个片段交给LLM分析，
+    保证各层的样本数与层的大小成比例。每得到一个结果就更新分层估计和置信区间，
+    区间半宽小于目标时停止，其余片段只使用本地指标判断。
+    """
+
+    def __init__(self,
+                 target_half_width: float = SAMPLING_TARGET_HALF_WIDTH,
+                 confidence: float = SAMPLING_CONFIDENCE,
+                 min_samples: int = SAMPLING_MIN_SAMPLES,
+                 max_samples: int = SAMPLING_MAX_SAMPLES,
+                 min_segments: int = SAMPLING_MIN_SEGMENTS,
+                 position_strata: int = SAMPLING_POSITION_STRATA,
+                 perplexity_strata: int = SAMPLING_PERPLEXITY_STRATA):
+        """
+        Args:
+            target_half_width: ai_percentage 置信区间半宽的目标（百分点）
+            confidence: 置信水平
+            min_samples: 至少分析的样本数，避免样本太少时区间估计不可靠
+            max_samples: 最多分析的样本数，0 表示不限制
+            min_segments: 片段数少于该值时不抽样，全部分析
+            position_strata: 按位置划分的层数
+            perplexity_strata: 按困惑度划分的层数
+        """
+        self.target_half_width = target_half_width
+        self.confidence = confidence
+        self.min_samples = max(1, min_samples)
+        self.max_samples = max(0, max_samples)
+        self.min_segments = min_segments
+        self.position_strata = max(1, position_strata)
+        self.perplexity_strata = max(1, perplexity_strata)
+        self.population = 0
+        self.stop_reason: Optional[str] = None
+        self._z = NormalDist().inv_cdf((1 + confidence) / 2)
+        self._strata: List[_Stratum] = []
+        self._stratum_of: Dict[int, _Stratum] = {}
+        self._rng = random.Random()
+
+    def stratify(self, perplexities: Dict[int, float], seed: Any = None):
+        """
+        对全部片段分层
+
+        Args:
+            perplexities: 片段序号到困惑度的映射，包含文档中的所有片段
+            seed: 随机数种子，同一文档使用相同的种子时抽到相同的片段
+        """
+        self._rng = random.Random(seed)
+        self.population = len(perplexities)
+        ordered = sorted(perplexities)
+        values = sorted(perplexities.values())
+        # 困惑度按分位数分层
+        cuts = [values[len(values) * q // self.perplexity_strata] for q in range(1, self.perplexity_strata)] if values else []
+        strata: Dict[Tuple[int, int], _Stratum] = {}
+        for position, index in enumerate(ordered):
+            key = (position * self.position_strata // self.population, bisect_right(cuts, perplexities[index]))
+            stratum = strata.get(key)
+            if stratum is None:
+                stratum = strata[key] = _Stratum(key)
+            stratum.indices.append(index)
+            self._stratum_of[index] = stratum
+        self._strata = list(strata.values())
+        for stratum in self._strata:
+            self._rng.shuffle(stratum.indices)
+
+    @property
+    def exhaustive(self) -> bool:
+        """片段数太少，全部分析"""
+        return self.population < self.min_segments
+
+    @property
+    def drawn(self) -> int:
+        return sum(stratum.drawn for stratum in self._strata)
+
+    @property
+    def observed(self) -> int:
+        return sum(stratum.observed for stratum in self._strata)
+
+    def mark_observed(self, index: int, ai_generated: bool):
+        """把已有结果的片段（例如恢复检测时已完成的片段）计为样本"""
+        stratum = self._stratum_of[index]
+        stratum.indices.remove(index)
+        stratum.drawn += 1
+        self.record(index, ai_generated)
+
+    def draw(self) -> Optional[int]:
+        """
+        抽取下一个待分析的片段
+
+        Returns:
+            int: 片段序号；应当停止抽样时返回 None
+        """
+        if self.should_stop():
+            return None
+        candidates = [stratum for stratum in self._strata if stratum.indices]
+        # 已抽取比例最低的层优先，比例相同时随机选择
+        stratum = min(candidates, key=lambda item: (item.drawn / item.size, self._rng.random()))
+        stratum.drawn += 1
+        return stratum.indices.pop()
+
+    def record(self, index: int, ai_generated: Optional[bool]):
+        """
+        记录一个样本的分析结果
+
+        Args:
+            index: 片段序号
+            ai_generated: 是否判为AI生成；分析出错时为 None，不计入估计
+        """
+        if ai_generated is None:
+            return
+        stratum = self._stratum_of[index]
+        stratum.observed += 1
+        if ai_generated:
+            stratum.ai_count += 1
+
+    def should_stop(self) -> bool:
+        if not any(stratum.indices for stratum in self._strata):
+            self.stop_reason = STOP_EXHAUSTED
+            return True
+        if self.exhaustive:
+            return False
+        if self.max_samples and self.drawn >= self.max_samples:
+            self.stop_reason = STOP_MAX_SAMPLES
+            return True
+        if self.observed >= self.min_samples and self.estimate()[1] <= self.target_half_width:
+            self.stop_reason = STOP_PRECISION
+            return True
+        return False
+
+    def unsampled(self) -> List[int]:
+        """未被抽取的片段序号"""
+        return sorted(index for stratum in self._strata for index in stratum.indices)
+
+    def estimate(self) -> Tuple[float, float]:
+        """
+        分层估计 ai_percentage 及其置信区间半宽（百分点）
+
+        还没有样本的层不参与估计，权重按有样本的层重新归一化。
+        方差使用加0.5平滑的比例，避免某层样本全部相同时区间宽度为零而过早停止。
+        """
+        sampled = [stratum for stratum in self._strata if stratum.observed > 0]
+        total = sum(stratum.size for stratum in sampled)
+        if total == 0:
+            return 0.0, 100.0
+        proportion = 0.0
+        variance = 0.0
+        for stratum in sampled:
+            weight = stratum.size / total
+            proportion += weight * stratum.ai_count / stratum.observed
+            smoothed = (stratum.ai_count + 0.5) / (stratum.observed + 1)
+            # 有限总体校正：一层全部分析完时该层没有抽样误差
+            correction = 1 - stratum.observed / stratum.size
+            variance += weight ** 2 * correction * smoothed * (1 - smoothed) / stratum.observed
+        return proportion * 100, self._z * math.sqrt(variance) * 100
+
+    def report(self) -> Dict[str, Any]:
+        """抽样结果，写入 overall_analysis"""
+        ai_percentage, half_width = self.estimate()
+        return {
+            "ai_percentage": round(ai_percentage, 2),
+            "confidence": self.confidence,
+            "ci_low": round(max(0.0, ai_percentage - half_width), 2),
+            "ci_high": round(min(100.0, ai_percentage + half_width), 2),
+            "half_width": round(half_width, 2),
+            "target_half_width": self.target_half_width,
+            "sample_size": self.observed,
+            "population": self.population,
+            "strata": len(self._strata),
+            "stop_reason": self.stop_reason,
+        }
+
+
+def unsampled_segment_result(segment: str, local: Dict[str, Any]) -> Dict[str, Any]:
+    """未被抽中的片段只使用本地指标判断，不计为降级"""
+    perplexity = local["perplexity"]
+    return {
+        "paragraph": segment,
+        "ai_generated": local["initial_judgment"],
+        "reason": f"抽样检测未抽中该片段，基于困惑度({perplexity:.2f})推断",
+        "perplexity": round(perplexity, 2),
+        "is_ai_likelihood": local["initial_likelihood"],
+        "unsampled": True
+    }
@@ -0,0 +1,130 @@
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future, InvalidStateError
+from typing import Any, Callable, Awaitable, Dict, Tuple, Type
+
+
+def content_key(*parts: str) -> str:
+    """根据内容生成合并请求使用的键"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part or "").encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+class _LeaderCancelled(Exception):
+    """执行中的请求被取消，等待者需要自行重新执行"""
+
+
+def _set_result(future: Future, result: Any):
+    # future 已被取消时忽略，不能让 InvalidStateError 掩盖执行者自己的结果
+    try:
+        future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+def _set_exception(future: Future, exception: BaseException):
+    try:
+        future.set_exception(exception)
+    except InvalidStateError:
+        pass
+
+
+class SingleFlight:
+    """
+    合并相同内容的并发请求（singleflight）
+
+    同一个键同时只有一个调用在执行，其余调用等待并共享它的结果。
+    检测任务运行在不同线程的事件循环中，因此使用 concurrent.futures.Future
+    在线程和事件循环之间传递结果。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.executed = 0
+        self.shared = 0
+        self._calls: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key: str) -> Tuple[Future, bool]:
+        """获取键对应的执行中请求，返回 (future, 是否由当前调用执行)"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.shared += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self.executed += 1
+            return future, True
+
+    def _leave(self, key: str, future: Future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def do(self, key: str, fn: Callable[..., Any], *args) -> Any:
+        """同步版本：相同键的并发调用只执行一次 fn(*args)"""
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args)
+            _set_result(future, result)
+            return result
+        except BaseException as e:
+            _set_exception(future, e)
+            raise
+        finally:
+            self._leave(key, future)
+
+    async def do_async(self,
+                       key: str,
+                       fn: Callable[[], Awaitable[Any]],
+                       retry_on: Tuple[Type[BaseException], ...] = ()) -> Any:
+        """
+        异步版本：相同键的并发调用只执行一次 fn()
+
+        Args:
+            key: 合并请求的键
+            fn: 返回协程的无参数函数
+            retry_on: 执行者以这些异常失败时，等待者自行重新执行一次，
+                用于与调用方自身状态相关的错误（例如任务预算用完）
+        """
+        future, leader = self._join(key)
+        if not leader:
+            try:
+                # 等待者超时或被取消时只取消自己的等待，不能取消共享的 future，
+                # 否则执行者和其他等待者都会收到 CancelledError
+                return await asyncio.shield(asyncio.wrap_future(future))
+            except _LeaderCancelled:
+                return await fn()
+            except retry_on:
+                return await fn()
+
+        try:
+            result = await fn()
+            _set_result(future, result)
+            return result
+        except asyncio.CancelledError:
+            _set_exception(future, _LeaderCancelled())
+            raise
+        except BaseException as e:
+            _set_exception(future, e)
+            raise
+        finally:
+            self._leave(key, future)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.executed + self.shared
+            return {
+                "executed": self.executed,
+                "shared": self.shared,
+                "in_flight": len(self._calls),
+                "shared_rate": round(self.shared / total, 4) if total else 0,
+            }
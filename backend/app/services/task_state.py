@@ -0,0 +1,63 @@
+from typing import Any, Dict, Iterable, Optional, Union
+from sqlalchemy.orm import Session
+from ..schemas.database_models import DetectionTask
+from ..schemas.models import TaskStatus
+
+# 允许的任务状态变化；处理中到处理中用于检测期间保存初步结果
+ALLOWED_TRANSITIONS = {
+    TaskStatus.UPLOADED: {TaskStatus.PROCESSING},
+    TaskStatus.PROCESSING: {TaskStatus.PROCESSING, TaskStatus.COMPLETED, TaskStatus.FAILED},
+    TaskStatus.FAILED: {TaskStatus.PROCESSING},
+    TaskStatus.COMPLETED: set(),
+}
+
+
+class InvalidTransition(ValueError):
+    """不允许的任务状态变化"""
+
+
+def transition(db: Session,
+               task_id: str,
+               from_status: Union[TaskStatus, Iterable[TaskStatus]],
+               to_status: TaskStatus,
+               values: Optional[Dict[Any, Any]] = None,
+               commit: bool = True) -> bool:
+    """
+    比较并交换任务状态：只有任务当前处于 from_status 时才改为 to_status
+
+    状态的检查和修改在同一条带条件的 UPDATE 中完成，并检查影响的行数。
+    两个请求同时开始同一个任务时只有一个成功，另一个得到 False，不会启动两次检测。
+    所有状态变化都应通过此函数进行，不要读取状态后再单独写入。
+
+    Args:
+        db: 数据库会话
+        task_id: 任务ID
+        from_status: 期望的当前状态，可以是多个
+        to_status: 新状态
+        values: 同时更新的其他列
+        commit: 是否立即提交
+
+    Returns:
+        bool: 状态是否已修改；为 False 时任务不存在或当前状态不是 from_status
+    """
+    sources = (from_status,) if isinstance(from_status, TaskStatus) else tuple(from_status)
+    for source in sources:
+        if to_status not in ALLOWED_TRANSITIONS[source]:
+            raise InvalidTransition(f"任务状态不能从 {source.value} 变为 {to_status.value}")
+
+    update = {DetectionTask.status: to_status.value}
+    if values:
+        update.update(values)
+    updated = db.query(DetectionTask).filter(
+        DetectionTask.id == task_id,
+        DetectionTask.status.in_([source.value for source in sources])
+    ).update(update, synchronize_session=False)
+    if commit:
+        db.commit()
+    return updated == 1
+
+
+def current_status(db: Session, task_id: str) -> Optional[TaskStatus]:
+    """从数据库读取任务当前的状态，任务不存在时返回 None"""
+    status = db.query(DetectionTask.status).filter(DetectionTask.id == task_id).scalar()
+    return TaskStatus(status) if status is not None else None
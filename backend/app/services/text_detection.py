@@ -0,0 +1,80 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from .ai_detection_service import detect_ai_content_comprehensive
+from .llm_budget import TaskBudget
+from .singleflight import content_key
+
+# 文本检测接口接受的最大字符数，更长的文本应上传文件检测
+TEXT_DETECTION_MAX_CHARS = int(os.getenv("TEXT_DETECTION_MAX_CHARS", "5000"))
+# 文本检测结果缓存的条数，0 表示不缓存
+TEXT_RESULT_CACHE_SIZE = int(os.getenv("TEXT_RESULT_CACHE_SIZE", "256"))
+
+
+class TextResultCache:
+    """按文本内容缓存检测结果，容量满时淘汰最久未使用的结果"""
+
+    def __init__(self, capacity: int = TEXT_RESULT_CACHE_SIZE):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            result = self._items.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key: str, result: Dict[str, Any]):
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._items[key] = result
+            self._items.move_to_end(key)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"size": len(self._items), "capacity": self.capacity, "hits": self.hits, "misses": self.misses}
+
+
+text_result_cache = TextResultCache()
+
+
+async def detect_text(text: str, skip_llm: bool = False) -> Tuple[Dict[str, Any], bool]:
+    """
+    在当前事件循环中直接检测一段文本，不写文件、不创建任务
+
+    本地模型计算在流水线的共享线程池中执行，LLM调用为异步调用，不阻塞接口所在的事件循环。
+
+    Args:
+        text: 待检测文本，长度由调用方限制
+        skip_llm: 是否跳过LLM分析，只使用本地指标
+
+    Returns:
+        (Dict, bool): 检测结果，以及结果是否来自缓存
+    """
+    key = content_key("skip_llm" if skip_llm else "llm", text)
+    cached = text_result_cache.get(key)
+    if cached is not None:
+        return dict(cached), True
+
+    # 短文本不抽样、不分阶段，一次返回完整结果
+    result = await detect_ai_content_comprehensive(
+        text,
+        budget=TaskBudget.from_env(),
+        sampling=False,
+        skip_llm=skip_llm
+    )
+    # LLM不可用或检测出错时的结果不缓存，服务恢复后重新检测
+    if result.get("segment_count") and not result.get("degraded"):
+        text_result_cache.put(key, result)
+    return dict(result), False
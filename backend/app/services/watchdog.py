@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+from sqlalchemy import func, or_
+from ..utils.database import SessionLocal
+from ..schemas.database_models import DetectionJob, DetectionTask
+from ..schemas.models import JobLane, JobStatus, TaskStatus
+from .job_queue import job_queue, ACTIVE_JOB_STATUSES
+
+# 看门狗检查的间隔（秒），0 表示不启动看门狗
+TASK_WATCHDOG_INTERVAL_SECONDS = float(os.getenv("TASK_WATCHDOG_INTERVAL_SECONDS", "30"))
+# 执行中的任务进度超过该时间没有变化时视为停滞（秒）
+TASK_STALL_SECONDS = float(os.getenv("TASK_STALL_SECONDS", "600"))
+# 处理中但没有作业的任务，超过该时间仍没有作业时重新添加作业（秒），避免与正在添加作业的接口竞争
+TASK_ORPHAN_GRACE_SECONDS = float(os.getenv("TASK_ORPHAN_GRACE_SECONDS", "60"))
+
+# 回收原因
+REASON_STALLED = "stalled"      # 进度长时间没有变化
+REASON_OVERDUE = "overdue"      # 超过按文档大小计算的截止时间
+REASON_ORPHANED = "orphaned"    # 任务处于处理中但没有排队或执行中的作业
+
+
+class TaskWatchdog:
+    """
+    定期检查卡住的检测任务
+
+    - 执行中的作业进度停滞或超过截止时间：还有执行次数时放回队列从断点恢复，否则任务置为失败
+    - 处理中的任务没有作业（添加作业前进程退出、作业已结束但任务状态未更新等）：重新添加恢复作业
+
+    工作进程退出导致的租约到期由作业队列在领取时处理。所有回收操作都是带条件的更新，
+    多个进程同时运行看门狗时同一个作业只会被回收一次。
+    """
+
+    def __init__(self,
+                 interval_seconds: float = TASK_WATCHDOG_INTERVAL_SECONDS,
+                 stall_seconds: float = TASK_STALL_SECONDS,
+                 orphan_grace_seconds: float = TASK_ORPHAN_GRACE_SECONDS):
+        self.interval_seconds = interval_seconds
+        self.stall_seconds = stall_seconds
+        self.orphan_grace_seconds = orphan_grace_seconds
+        self.sweeps = 0
+        self.last_sweep_at: Optional[float] = None
+        self.counters: Dict[str, int] = {}
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _count(self, action: str, reason: str):
+        key = f"{action}_{reason}"
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def sweep(self) -> Dict[str, int]:
+        """
+        检查一次
+
+        Returns:
+            Dict: 本次回收的任务数，键为 "动作_原因"，例如 requeued_stalled、failed_overdue
+        """
+        now = datetime.now()
+        reaped: Dict[str, int] = {}
+        db = SessionLocal()
+        try:
+            stuck = db.query(DetectionJob, DetectionTask).join(
+                DetectionTask, DetectionTask.id == DetectionJob.task_id
+            ).filter(
+                DetectionJob.status == JobStatus.RUNNING.value,
+                DetectionJob.lease_expires_at >= now,
+                or_(
+                    DetectionTask.heartbeat_at < now - timedelta(seconds=self.stall_seconds),
+                    DetectionTask.deadline_at < now
+                )
+            ).all()
+            for job, task in stuck:
+                reason = REASON_OVERDUE if task.deadline_at is not None and task.deadline_at < now else REASON_STALLED
+                action = job_queue.reap(db, job, reason)
+                if action is None:
+                    continue
+                print(f"看门狗回收任务 {task.id}（{reason}），作业{'已放回队列' if action == 'requeued' else '已失败'}")
+                key = f"{action}_{reason}"
+                reaped[key] = reaped.get(key, 0) + 1
+                self._count(action, reason)
+
+            has_active_job = db.query(DetectionJob.id).filter(
+                DetectionJob.task_id == DetectionTask.id,
+                DetectionJob.status.in_(ACTIVE_JOB_STATUSES)
+            ).exists()
+            orphaned = db.query(DetectionTask).filter(
+                DetectionTask.status == TaskStatus.PROCESSING.value,
+                ~has_active_job,
+                func.coalesce(DetectionTask.heartbeat_at, DetectionTask.updated_at)
+                < now - timedelta(seconds=self.orphan_grace_seconds)
+            ).all()
+            for task in orphaned:
+                job_queue.enqueue(db, task, JobLane.RESCORE, resume=True)
+                print(f"看门狗为没有作业的任务 {task.id} 重新添加恢复作业")
+                key = f"requeued_{REASON_ORPHANED}"
+                reaped[key] = reaped.get(key, 0) + 1
+                self._count("requeued", REASON_ORPHANED)
+        finally:
+            db.close()
+
+        with self._lock:
+            self.sweeps += 1
+            self.last_sweep_at = time.time()
+        return reaped
+
+    def _run(self):
+        while not self._stopping.wait(self.interval_seconds):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"看门狗检查任务时出错: {str(e)}")
+
+    def start(self):
+        """在后台线程中定期检查"""
+        if self.interval_seconds <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="task-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "interval_seconds": self.interval_seconds,
+                "stall_seconds": self.stall_seconds,
+                "sweeps": self.sweeps,
+                "last_sweep_seconds_ago": round(time.time() - self.last_sweep_at, 1) if self.last_sweep_at else None,
+                "reaped": dict(self.counters),
+                "reaped_total": sum(self.counters.values()),
+            }
+
+
+task_watchdog = TaskWatchdog()
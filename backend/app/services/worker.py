@@ -0,0 +1,192 @@
+import os
+import time
+import signal
+import socket
+import threading
+import multiprocessing
+from typing import List, Optional
+from ..utils.database import SessionLocal
+from ..utils.migrations import run_migrations
+from ..schemas.database_models import DetectionTask
+from ..schemas.models import TaskStatus
+from .job_queue import job_queue, ClaimedJob
+from .batch import batch_registry
+from .cancellation import cancellation_registry
+from .progress import progress_registry
+from .worker_stats import WORKER_STATS_SECONDS, process_stats, save_worker_stats, delete_worker_stats
+
+# 工作进程数，run.py 启动API时一并启动；也可单独运行 python worker.py -n N
+JOB_WORKER_PROCESSES = int(os.getenv("JOB_WORKER_PROCESSES", "1"))
+# 没有可执行的作业时轮询队列的间隔，以及执行作业时心跳续约的间隔（秒）
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "10"))
+# 进度有变化时保存进度的最短间隔（秒），片段的判断结论提前到达后进度接口尽快可见
+JOB_PROGRESS_SECONDS = float(os.getenv("JOB_PROGRESS_SECONDS", "1"))
+
+
+class DetectionWorker:
+    """
+    检测工作进程：从作业队列领取作业并逐个执行
+
+    执行期间由心跳线程定期续约并保存进度；续约失败（作业已被其他工作进程接管）
+    或任务已被取消时停止检测。出错的作业按退避时间重新排队，次数用完后任务置为失败。
+    """
+
+    def __init__(self, worker_id: str):
+        self.worker_id = worker_id
+        self._stopping = threading.Event()
+        self._current: Optional[ClaimedJob] = None
+
+    def stop(self):
+        """不再领取新作业，正在执行的作业停止后放回队列"""
+        self._stopping.set()
+        job = self._current
+        if job is not None:
+            cancellation_registry.cancel(job.task_id, "工作进程正在退出")
+
+    def run_forever(self):
+        print(f"检测工作进程 {self.worker_id} 已启动")
+        stats = threading.Thread(target=self._stats_loop, name="worker-stats", daemon=True)
+        stats.start()
+        while not self._stopping.is_set():
+            db = SessionLocal()
+            try:
+                job = job_queue.claim(db, self.worker_id)
+            except Exception as e:
+                print(f"领取检测作业时出错: {str(e)}")
+                job = None
+            finally:
+                db.close()
+
+            if job is None:
+                self._stopping.wait(JOB_POLL_SECONDS)
+                continue
+            self.run_job(job)
+        stats.join()
+        print(f"检测工作进程 {self.worker_id} 已退出")
+
+    def _stats_loop(self):
+        """定期保存本进程的LLM和本地模型统计，供管理接口读取；退出时删除"""
+        while True:
+            stopping = self._stopping.wait(WORKER_STATS_SECONDS)
+            db = SessionLocal()
+            try:
+                if stopping:
+                    delete_worker_stats(db, self.worker_id)
+                    return
+                save_worker_stats(db, self.worker_id, process_stats())
+            except Exception as e:
+                print(f"保存工作进程统计时出错: {str(e)}")
+                if stopping:
+                    return
+            finally:
+                db.close()
+
+    def run_job(self, job: ClaimedJob):
+        # 检测流程在路由模块中定义，延迟导入以免加载模型拖慢进程启动
+        from ..routers.detect import perform_detection_wrapper
+
+        print(f"工作进程 {self.worker_id} 开始执行任务 {job.task_id}（{job.lane}通道，"
+              f"第 {job.attempts} 次，排队 {job.wait_seconds:.1f} 秒）")
+        self._current = job
+        # 每次执行重新记录进度，重试时不沿用上次执行的计数
+        progress_registry.start(job.task_id)
+        stopped = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat_loop, args=(job, stopped), name=f"heartbeat-{job.id[:8]}", daemon=True
+        )
+        heartbeat.start()
+        error = None
+        try:
+            if job.batch_id:
+                # 同批次任务共享片段结果和LLM预算，两者保存在数据库中，由执行该批次的各工作进程共用
+                batch = batch_registry.get_or_create(job.batch_id)
+                batch.run(perform_detection_wrapper, job.task_id, job.filename, job.resume, batch, job.can_retry)
+            else:
+                perform_detection_wrapper(job.task_id, job.filename, job.resume, None, job.can_retry)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        finally:
+            stopped.set()
+            heartbeat.join()
+            self._current = None
+
+        progress = progress_registry.get(job.task_id)
+        snapshot = progress.snapshot() if progress is not None else None
+        db = SessionLocal()
+        try:
+            if self._stopping.is_set() and error is None and not self._task_finished(db, job):
+                job_queue.requeue(db, job, self.worker_id)
+                print(f"工作进程退出，任务 {job.task_id} 已放回队列")
+            elif error is None:
+                job_queue.finish(db, job.id, self.worker_id, snapshot)
+            elif job.can_retry:
+                job_queue.retry(db, job, self.worker_id, error)
+                print(f"任务 {job.task_id} 执行出错，稍后重试: {error}")
+            else:
+                job_queue.fail(db, job.id, self.worker_id, error)
+        except Exception as e:
+            # 租约到期后作业会被重新领取
+            print(f"更新检测作业 {job.id} 时出错: {str(e)}")
+        finally:
+            db.close()
+
+    @staticmethod
+    def _task_finished(db, job: ClaimedJob) -> bool:
+        status = db.query(DetectionTask.status).filter(DetectionTask.id == job.task_id).scalar()
+        return status != TaskStatus.PROCESSING.value
+
+    def _heartbeat_loop(self, job: ClaimedJob, stopped: threading.Event):
+        last_version = None
+        last_beat = time.monotonic()
+        # 进度有变化时按较短的间隔保存（同时续约），没有变化时按心跳间隔续约
+        while not stopped.wait(min(JOB_PROGRESS_SECONDS, JOB_HEARTBEAT_SECONDS)):
+            progress = progress_registry.get(job.task_id)
+            snapshot = progress.snapshot() if progress is not None else None
+            version = snapshot["version"] if snapshot is not None else None
+            if version == last_version and time.monotonic() - last_beat < JOB_HEARTBEAT_SECONDS:
+                continue
+            last_beat = time.monotonic()
+            db = SessionLocal()
+            try:
+                alive = job_queue.heartbeat(
+                    db, job.id, self.worker_id, snapshot, advanced=version != last_version
+                )
+                last_version = version
+            except Exception as e:
+                # 数据库暂时不可用时下次再续约，租约到期前仍属于本进程
+                print(f"检测作业 {job.id} 心跳出错: {str(e)}")
+                continue
+            finally:
+                db.close()
+            if not alive:
+                cancellation_registry.cancel(job.task_id, "任务已取消或已由其他工作进程接管")
+                return
+
+
+def run_worker_process(index: int = 0):
+    """工作进程入口"""
+    run_migrations()
+    worker = DetectionWorker(f"{socket.gethostname()}-{os.getpid()}-{index}")
+
+    def _handle_signal(signum, frame):
+        worker.stop()
+
+    signal.signal(signal.SIGTERM, _handle_signal)
+    signal.signal(signal.SIGINT, _handle_signal)
+    worker.run_forever()
+
+
+def start_worker_processes(count: int = JOB_WORKER_PROCESSES) -> List[multiprocessing.Process]:
+    """
+    启动 count 个工作进程
+
+    使用 spawn 方式创建进程，每个进程独立加载模型，不继承父进程中的线程和数据库连接
+    """
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    for index in range(count):
+        process = context.Process(target=run_worker_process, args=(index,), name=f"detection-worker-{index}")
+        process.start()
+        processes.append(process)
+    return processes
@@ -0,0 +1,90 @@
+import os
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from sqlalchemy.orm import Session
+from ..schemas.database_models import WorkerStats
+from .llm_client import llm_client
+
+# 工作进程保存运行统计的间隔（秒），以及快照中保留的最近LLM调用记录数
+WORKER_STATS_SECONDS = float(os.getenv("WORKER_STATS_SECONDS", "15"))
+WORKER_STATS_JOURNAL_ENTRIES = int(os.getenv("WORKER_STATS_JOURNAL_ENTRIES", "200"))
+# 超过此时间（秒）没有更新的快照视为工作进程已异常退出，管理接口不再返回
+WORKER_STATS_STALE_SECONDS = float(os.getenv("WORKER_STATS_STALE_SECONDS", "120"))
+
+
+def process_stats(journal_entries: int = WORKER_STATS_JOURNAL_ENTRIES) -> Dict[str, Any]:
+    """
+    当前进程的LLM客户端、调用日志和本地模型计算的运行统计
+
+    Args:
+        journal_entries: 返回的最近调用记录数
+    """
+    # 本地模型模块加载较慢，只在需要时导入
+    from .ai_detection_service import get_coalescing_stats
+
+    return {
+        "pid": os.getpid(),
+        "llm": llm_client.get_stats(),
+        "local_models": get_coalescing_stats(),
+        "journal": {
+            "summary": llm_client.journal.summary(),
+            "latency_ms": llm_client.journal.latency_percentiles(),
+            "entries": llm_client.journal.entries(limit=journal_entries),
+        },
+    }
+
+
+def save_worker_stats(db: Session, worker_id: str, stats: Dict[str, Any]):
+    """保存工作进程的统计快照"""
+    now = datetime.now()
+    data = json.dumps(stats, ensure_ascii=False, default=str)
+    updated = db.query(WorkerStats).filter(WorkerStats.worker_id == worker_id).update(
+        {WorkerStats.stats: data, WorkerStats.updated_at: now}, synchronize_session=False
+    )
+    if not updated:
+        db.add(WorkerStats(worker_id=worker_id, stats=data, started_at=now, updated_at=now))
+    db.commit()
+
+
+def delete_worker_stats(db: Session, worker_id: str):
+    """工作进程正常退出时删除它的快照"""
+    db.query(WorkerStats).filter(WorkerStats.worker_id == worker_id).delete(synchronize_session=False)
+    db.commit()
+
+
+def load_worker_stats(db: Session) -> Dict[str, Dict[str, Any]]:
+    """
+    仍在运行的工作进程最近一次保存的统计快照
+
+    Returns:
+        dict: 工作进程ID到快照的映射，快照中附带保存时间 updated_at
+    """
+    since = datetime.now() - timedelta(seconds=WORKER_STATS_STALE_SECONDS)
+    workers = {}
+    for row in db.query(WorkerStats).filter(WorkerStats.updated_at >= since).order_by(WorkerStats.worker_id).all():
+        try:
+            stats = json.loads(row.stats) if row.stats else {}
+        except ValueError:
+            continue
+        stats["updated_at"] = row.updated_at.isoformat()
+        workers[row.worker_id] = stats
+    return workers
+
+
+def merged_journal_entries(local: List[Dict[str, Any]],
+                           workers: Dict[str, Dict[str, Any]],
+                           limit: Optional[int] = None,
+                           task_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    合并API进程和各工作进程的最近LLM调用记录，新记录在前
+
+    每条记录附带 process 字段：api 或工作进程ID
+    """
+    entries = [dict(entry, process="api") for entry in local]
+    for worker_id, stats in workers.items():
+        entries.extend(dict(entry, process=worker_id) for entry in stats.get("journal", {}).get("entries", []))
+    if task_id is not None:
+        entries = [entry for entry in entries if entry.get("task_id") == task_id]
+    entries.sort(key=lambda entry: entry.get("timestamp") or 0, reverse=True)
+    return entries[:limit] if limit is not None else entries
@@ -0,0 +1,38 @@
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+import os
+from .database import DATABASE_URL, configure_sqlite_engine
+
+# 异步驱动：SQLite使用aiosqlite，查询在驱动的后台线程中执行，不阻塞事件循环
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+# 异步连接池大小；SQLite在WAL模式下多个连接可以同时读取
+ASYNC_DB_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "10"))
+
+
+def _async_url(url: str) -> str:
+    """把同步的数据库URL换成对应的异步驱动"""
+    scheme, separator, rest = url.partition("://")
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}{separator}{rest}"
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+
+# aiosqlite 对数据库文件默认每次请求新建连接，这里改用连接池复用连接和连接时设置的 pragmas；
+# 内存数据库每个连接是独立的数据库，保留驱动默认的单连接
+_pool_args = {}
+if ":memory:" not in ASYNC_DATABASE_URL and "mode=memory" not in ASYNC_DATABASE_URL:
+    _pool_args = {"poolclass": AsyncAdaptedQueuePool, "pool_size": ASYNC_DB_POOL_SIZE, "max_overflow": ASYNC_DB_POOL_SIZE}
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_pool_args)
+configure_sqlite_engine(async_engine.sync_engine)
+# 提交后不使对象过期，异步会话中访问过期属性需要再次查询
+AsyncSessionLocal = sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+# 异步数据库依赖，用于请求处理中只读或简单写入的接口
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
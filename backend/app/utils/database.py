@@ -1,14 +1,43 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from typing import Dict
 import os
 
 # 在生产环境中，应该使用环境变量配置数据库URL
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
 
+# SQLite连接参数：WAL模式下查询进度和结果的读请求不会被写入片段结果的事务阻塞；
+# synchronous=NORMAL 在WAL模式下只在检查点时同步磁盘，断电最多丢失最近的事务而不会损坏数据库；
+# 数据库被锁定时等待 busy_timeout 毫秒再报错；mmap_size 为内存映射读取的字节数，0 表示不使用
+SQLITE_PRAGMAS: Dict[str, str] = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"),
+    "mmap_size": os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)),
+}
+
+
+def configure_sqlite_engine(engine, pragmas: Dict[str, str] = SQLITE_PRAGMAS):
+    """为SQLite引擎的每个新连接设置 pragmas，其他数据库不做处理"""
+    if engine.url.get_backend_name() != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                if value:
+                    cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
 engine = create_engine(
     DATABASE_URL, connect_args={"check_same_thread": False}
 )
+configure_sqlite_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -19,4 +48,4 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
\ No newline at end of file
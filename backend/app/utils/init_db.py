@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
-from ..utils.database import Base, engine, SessionLocal
+from ..utils.database import SessionLocal
+from ..utils.migrations import run_migrations
 from ..schemas.database_models import User, DetectionTask, ParagraphResult
 from ..services.auth import get_password_hash
 
@@ -7,8 +8,8 @@ def init_db():
     """
     Initialize database
     """
-    # Create tables
-    Base.metadata.create_all(bind=engine)
+    # Create tables and apply pending schema migrations
+    run_migrations()
     
     # Create admin user
     db = SessionLocal()
@@ -0,0 +1,166 @@
+from datetime import datetime
+from typing import Callable, Iterable, List, Set, Tuple
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+from .database import Base, engine as default_engine
+
+
+def _columns(connection: Connection, table: str) -> Set[str]:
+    inspector = inspect(connection)
+    if not inspector.has_table(table):
+        return set()
+    return {column["name"] for column in inspector.get_columns(table)}
+
+
+def _add_columns(connection: Connection, table: str, columns: Iterable[Tuple[str, str]]):
+    """为已有的表添加缺少的列"""
+    existing = _columns(connection, table)
+    for name, column_type in columns:
+        if name not in existing:
+            print(f"添加列: {table}.{name} ({column_type})")
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}"))
+
+
+def _baseline(connection: Connection):
+    """早期版本的数据库缺少的列、索引和需要补全的值（原 scripts/add_missing_columns.py）"""
+    _add_columns(connection, "detection_tasks", (
+        ("overall_perplexity", "FLOAT"),
+        ("overall_burstiness", "FLOAT"),
+        ("overall_syntax_analysis", "TEXT"),
+        ("overall_coherence_analysis", "TEXT"),
+        ("overall_style_analysis", "TEXT"),
+        ("detection_phase", "TEXT"),
+        ("batch_id", "TEXT"),
+        ("heartbeat_at", "DATETIME"),
+        ("deadline_at", "DATETIME"),
+    ))
+    _add_columns(connection, "paragraph_results", (("segment_index", "INTEGER"),))
+    _add_columns(connection, "detection_jobs", (
+        ("owner_id", "TEXT"),
+        ("lane", "TEXT"),
+        ("queued_at", "DATETIME"),
+        ("claimed_at", "DATETIME"),
+        ("wait_seconds", "FLOAT"),
+    ))
+
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_detection_tasks_batch_id ON detection_tasks (batch_id)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_paragraph_results_segment_index ON paragraph_results (segment_index)"))
+
+    # 作业队列按通道和用户选择作业，补全新增列的值
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_detection_jobs_owner_id ON detection_jobs (owner_id)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_detection_jobs_lane ON detection_jobs (lane)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_detection_jobs_claimed_at ON detection_jobs (claimed_at)"))
+    connection.execute(text("UPDATE detection_jobs SET lane = 'interactive' WHERE lane IS NULL"))
+    connection.execute(text("UPDATE detection_jobs SET queued_at = COALESCE(available_at, created_at) WHERE queued_at IS NULL"))
+    connection.execute(text(
+        "UPDATE detection_jobs SET owner_id = "
+        "(SELECT owner_id FROM detection_tasks WHERE detection_tasks.id = detection_jobs.task_id) "
+        "WHERE owner_id IS NULL"
+    ))
+    # 每个任务最多一个排队或执行中的作业；先取消重复开始产生的多余作业，保留最早添加的一个
+    connection.execute(text(
+        "UPDATE detection_jobs SET status = 'cancelled' "
+        "WHERE status IN ('queued', 'running') AND rowid NOT IN "
+        "(SELECT MIN(rowid) FROM detection_jobs WHERE status IN ('queued', 'running') GROUP BY task_id)"
+    ))
+    connection.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_detection_jobs_active_task ON detection_jobs (task_id) "
+        "WHERE status IN ('queued', 'running')"
+    ))
+
+
+def _hot_query_indexes(connection: Connection):
+    """状态轮询、报告和任务列表按任务、用户和状态查询，历史数据增多后避免全表扫描"""
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_paragraph_results_task_id_segment_index "
+        "ON paragraph_results (task_id, segment_index)"
+    ))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_detection_tasks_owner_id ON detection_tasks (owner_id)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_detection_tasks_status ON detection_tasks (status)"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_detection_tasks_batch_id_created_at ON detection_tasks (batch_id, created_at)"
+    ))
+    # 让查询规划器使用新索引的统计信息
+    connection.execute(text("ANALYZE"))
+
+
+def _batch_llm_usage(connection: Connection):
+    """批次共享的LLM预算改为保存在批次表中，多个工作进程执行同一批次时共用"""
+    _add_columns(connection, "detection_batches", (
+        ("llm_calls", "INTEGER DEFAULT 0"),
+        ("llm_rejected_calls", "INTEGER DEFAULT 0"),
+        ("llm_prompt_tokens", "INTEGER DEFAULT 0"),
+        ("llm_completion_tokens", "INTEGER DEFAULT 0"),
+        ("llm_estimated_calls", "INTEGER DEFAULT 0"),
+        ("llm_started_at", "DATETIME"),
+    ))
+
+
+def _task_list_index(connection: Connection):
+    """任务列表按创建时间排序，只有 owner_id 索引时需要临时B树排序"""
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_detection_tasks_owner_id_created_at ON detection_tasks (owner_id, created_at)"
+    ))
+    connection.execute(text("ANALYZE"))
+
+
+# 按版本顺序排列的迁移，只能在末尾追加。每个迁移都应可重复执行（IF NOT EXISTS、先检查列是否存在），
+# 多个进程同时启动时可能都会执行同一个迁移。
+# 新增的列和索引同时在 database_models.py 中声明，新建的数据库由 create_all 直接创建
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "补全早期版本缺少的列和索引", _baseline),
+    (2, "为片段结果、任务所属用户、任务状态和批次任务列表添加索引", _hot_query_indexes),
+    (3, "批次表记录共享LLM预算的用量", _batch_llm_usage),
+    (4, "为用户任务列表添加按创建时间排序的索引", _task_list_index),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def _ensure_version_table(bind: Engine):
+    with bind.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version INTEGER PRIMARY KEY, description TEXT, applied_at DATETIME)"
+        ))
+
+
+def current_version(bind: Engine = default_engine) -> int:
+    """数据库当前的结构版本，没有执行过迁移时为0"""
+    _ensure_version_table(bind)
+    with bind.connect() as connection:
+        return connection.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+
+def run_migrations(bind: Engine = default_engine) -> int:
+    """
+    创建缺少的表，并依次执行数据库尚未执行的迁移
+
+    每个迁移执行成功后写入它的版本，中途失败时下次启动从失败的迁移继续
+
+    Returns:
+        int: 迁移后的结构版本
+    """
+    # 导入全部模型，create_all 才能创建所有表
+    from ..schemas import database_models  # noqa: F401
+
+    Base.metadata.create_all(bind=bind)
+    version = current_version(bind)
+    for target, description, migrate in MIGRATIONS:
+        if target <= version:
+            continue
+        try:
+            with bind.begin() as connection:
+                migrate(connection)
+                connection.execute(
+                    text("INSERT INTO schema_version (version, description, applied_at) VALUES (:version, :description, :applied_at)"),
+                    {"version": target, "description": description, "applied_at": datetime.now()}
+                )
+        except IntegrityError:
+            # 其他进程已执行了此迁移
+            pass
+        else:
+            print(f"数据库已迁移到版本 {target}: {description}")
+        version = target
+    return version
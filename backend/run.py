@@ -1,10 +1,20 @@
 # -*- coding: utf-8 -*-
 import uvicorn
 from app.utils.init_db import init_db
+from app.services.worker import start_worker_processes, JOB_WORKER_PROCESSES
 
 if __name__ == "__main__":
     # Initialize database
     init_db()
     
+    # Start detection workers; the API process only enqueues jobs
+    workers = start_worker_processes(JOB_WORKER_PROCESSES)
+    
     # Start application
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
+    try:
+        uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+状态轮询接口的并发性能测试
+
+在临时SQLite数据库中准备一个处理中的任务（已有部分片段结果和工作进程保存的进度），模拟多个前端同时轮询
+GET /api/detect/{task_id} 或 GET /api/detect/{task_id}/progress（--endpoint progress），
+同时有一个线程像 ResultWriter 一样持续写入片段结果。比较：
+
+    - 同步会话：在 async 接口中直接使用 SessionLocal 查询（改动前的方式），查询期间事件循环被阻塞
+    - 异步会话：接口实际使用的 AsyncSession（aiosqlite），查询期间事件循环可以处理其他请求
+
+输出每次轮询的延迟分布，以及事件循环的调度延迟（一个每5毫秒唤醒一次的协程实际晚了多久），
+后者反映同一进程中其他请求（包括SSE推送）受到的影响。
+
+用法：
+
+    python scripts/benchmark_polling.py --pollers 20 --polls 50 --segments 300
+    python scripts/benchmark_polling.py --endpoint progress
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+
+# 在导入应用模块前指定临时数据库，同步和异步引擎都使用它
+_directory = tempfile.mkdtemp(prefix="polling-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_directory, 'polling.db')}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.database import SessionLocal, engine
+from app.utils.async_database import AsyncSessionLocal, async_engine
+from app.utils.migrations import run_migrations
+from app.schemas.database_models import DetectionTask, User
+from app.schemas.models import TaskStatus
+from app.services.result_writer import insert_paragraph_results
+from app.services.job_queue import job_queue
+from app.routers.detect import get_detection_status, get_detection_progress, _load_paragraph_details
+
+TASK_ID = "polling-task"
+# 后台写入的是另一个任务的片段结果，两种方式轮询读取的数据量相同
+WRITER_TASK_ID = "polling-writer-task"
+USER_ID = "polling-user"
+
+
+def make_rows(task_id: str, start: int, count: int):
+    return [
+        {
+            "task_id": task_id,
+            "segment_index": index,
+            "paragraph": f"第{index}段测试文本。" * 20,
+            "ai_generated": index % 2 == 0,
+            "reason": "性能测试生成的判断原因",
+            "perplexity": 30.0 + index % 50,
+            "ai_likelihood": "中",
+        }
+        for index in range(start, start + count)
+    ]
+
+
+def prepare(segments: int) -> User:
+    run_migrations(engine)
+    db = SessionLocal()
+    try:
+        user = User(id=USER_ID, email="polling@example.com", username="polling")
+        db.add(user)
+        for task_id in (TASK_ID, WRITER_TASK_ID):
+            db.add(DetectionTask(id=task_id, filename="polling.txt", file_size=0,
+                                 status=TaskStatus.PROCESSING.value, owner_id=USER_ID))
+        insert_paragraph_results(db, make_rows(TASK_ID, 0, segments))
+        db.flush()
+        # 工作进程心跳时保存的进度，进度接口读取它
+        job = job_queue.enqueue(db, db.query(DetectionTask).filter(DetectionTask.id == TASK_ID).one())
+        job.progress_data = json.dumps({
+            "task_id": TASK_ID, "phase": "analyzing", "segments_total": segments * 2,
+            "segments_total_final": True, "segments_done": segments, "version": 1,
+        })
+        db.commit()
+        db.refresh(user)
+        db.expunge(user)
+        return user
+    finally:
+        db.close()
+
+
+def writer_loop(stop: threading.Event, batch: int, interval: float):
+    """模拟另一个检测任务按批写入片段结果"""
+    index = 0
+    while not stop.is_set():
+        db = SessionLocal()
+        try:
+            insert_paragraph_results(db, make_rows(WRITER_TASK_ID, index, batch))
+            db.commit()
+        finally:
+            db.close()
+        index += batch
+        stop.wait(interval)
+
+
+async def poll_sync(user: User):
+    """改动前的方式：在协程中直接执行同步查询"""
+    db = SessionLocal()
+    try:
+        task = db.query(DetectionTask).filter(
+            DetectionTask.id == TASK_ID,
+            DetectionTask.owner_id == user.id
+        ).first()
+        job_queue.progress(db, task.id)
+        return _load_paragraph_details(db, task.id)
+    finally:
+        db.close()
+
+
+async def poll_async(user: User):
+    async with AsyncSessionLocal() as db:
+        return await get_detection_status(TASK_ID, db=db, current_user=user)
+
+
+async def poll_progress_sync(user: User):
+    """改动前的进度接口：在协程中直接执行同步查询"""
+    db = SessionLocal()
+    try:
+        task = db.query(DetectionTask).filter(
+            DetectionTask.id == TASK_ID,
+            DetectionTask.owner_id == user.id
+        ).first()
+        return job_queue.progress(db, task.id)
+    finally:
+        db.close()
+
+
+async def poll_progress_async(user: User):
+    async with AsyncSessionLocal() as db:
+        return await get_detection_progress(TASK_ID, db=db, current_user=user)
+
+
+MODES = {
+    "status": (poll_sync, poll_async),
+    "progress": (poll_progress_sync, poll_progress_async),
+}
+
+
+async def lag_probe(stop: asyncio.Event, samples: list, interval: float = 0.005):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+
+def percentile(samples, percent):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100.0 * (len(ordered) - 1))))] if ordered else 0.0
+
+
+async def run_mode(poll, user: User, args) -> dict:
+    latencies = []
+    lags = []
+    stop_probe = asyncio.Event()
+    probe = asyncio.ensure_future(lag_probe(stop_probe, lags))
+
+    async def poller():
+        # 延迟从请求应当开始的时间算起，包括等待事件循环空闲的时间
+        due = time.perf_counter()
+        for _ in range(args.polls):
+            await poll(user)
+            latencies.append(time.perf_counter() - due)
+            due = time.perf_counter() + args.interval
+            await asyncio.sleep(args.interval)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(poller() for _ in range(args.pollers)))
+    elapsed = time.perf_counter() - started
+    stop_probe.set()
+    await probe
+    return {
+        "polls_per_second": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "max": max(latencies) if latencies else 0.0,
+        "lag_p95": percentile(lags, 95),
+        "lag_max": max(lags) if lags else 0.0,
+    }
+
+
+async def main_async(args) -> int:
+    user = prepare(args.segments)
+    stop = threading.Event()
+    writer = threading.Thread(
+        target=writer_loop, args=(stop, args.write_batch, args.write_interval), daemon=True
+    )
+    writer.start()
+    try:
+        print(f"接口: {args.endpoint}，{args.pollers} 个并发轮询，每个 {args.polls} 次，任务已有 {args.segments} 个片段结果，"
+              f"后台每 {args.write_interval} 秒写入 {args.write_batch} 个片段")
+        print(f"{'方式':<10}{'轮询/秒':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'max(ms)':>10}"
+              f"{'循环延迟p95(ms)':>18}{'循环延迟max(ms)':>18}")
+        sync_poll, async_poll = MODES[args.endpoint]
+        for name, poll in (("同步会话", sync_poll), ("异步会话", async_poll)):
+            result = await run_mode(poll, user, args)
+            print(f"{name:<10}{result['polls_per_second']:>10.1f}{result['p50'] * 1000:>10.1f}"
+                  f"{result['p95'] * 1000:>10.1f}{result['max'] * 1000:>10.1f}"
+                  f"{result['lag_p95'] * 1000:>18.1f}{result['lag_max'] * 1000:>18.1f}")
+    finally:
+        stop.set()
+        writer.join()
+        await async_engine.dispose()
+        engine.dispose()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="状态轮询接口的并发性能测试")
+    parser.add_argument("--endpoint", choices=sorted(MODES), default="status", help="轮询的接口：状态或进度")
+    parser.add_argument("--pollers", type=int, default=20, help="并发轮询的客户端数")
+    parser.add_argument("--polls", type=int, default=50, help="每个客户端的轮询次数")
+    parser.add_argument("--interval", type=float, default=0.0, help="每个客户端两次轮询之间的间隔（秒）")
+    parser.add_argument("--segments", type=int, default=300, help="任务已有的片段结果数")
+    parser.add_argument("--write-batch", type=int, default=20, help="后台每次写入的片段数")
+    parser.add_argument("--write-interval", type=float, default=0.2, help="后台写入的间隔（秒）")
+    args = parser.parse_args()
+    return asyncio.get_event_loop().run_until_complete(main_async(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
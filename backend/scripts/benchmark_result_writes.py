@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+片段结果写入的性能测试
+
+在临时SQLite数据库中模拟一个检测任务按批写入片段结果，同时有多个线程像前端轮询一样
+查询已完成的片段，比较不同写入方式和数据库设置下的写入吞吐量和读请求数：
+
+    - 写入方式：逐个创建ORM对象（add_all）或Core批量插入（insert executemany）
+    - 数据库设置：默认的回滚日志模式，或 app/utils/database.py 中的 SQLITE_PRAGMAS（WAL等）
+
+用法：
+
+    python scripts/benchmark_result_writes.py --rows 5000 --batch 20 --readers 4
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from app.utils.database import Base, SQLITE_PRAGMAS, configure_sqlite_engine
+from app.schemas.database_models import DetectionTask, ParagraphResult
+from app.services.result_writer import insert_paragraph_results
+
+# 不设置 pragmas 时SQLite的默认行为
+DEFAULT_PRAGMAS = {"journal_mode": "DELETE", "synchronous": "FULL"}
+TASK_ID = "benchmark-task"
+
+
+def make_rows(start: int, count: int):
+    return [
+        {
+            "task_id": TASK_ID,
+            "segment_index": index,
+            "paragraph": f"第{index}段测试文本。" * 20,
+            "ai_generated": index % 2 == 0,
+            "reason": "性能测试生成的判断原因",
+            "perplexity": 30.0 + index % 50,
+            "ai_likelihood": "中",
+            "metrics_data": None,
+        }
+        for index in range(start, start + count)
+    ]
+
+
+def write_batch(Session, rows, bulk: bool):
+    """与 ResultWriter 相同：先删除同序号的旧结果，再写入整批"""
+    db = Session()
+    try:
+        db.query(ParagraphResult).filter(
+            ParagraphResult.task_id == TASK_ID,
+            ParagraphResult.segment_index.in_([row["segment_index"] for row in rows])
+        ).delete(synchronize_session=False)
+        if bulk:
+            insert_paragraph_results(db, rows)
+        else:
+            db.add_all([ParagraphResult(**row) for row in rows])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def reader_loop(Session, stop: threading.Event, stats: dict, lock: threading.Lock):
+    """模拟轮询：查询已完成的片段数和最新的一页结果"""
+    queries = errors = 0
+    while not stop.is_set():
+        db = Session()
+        try:
+            db.query(func.count(ParagraphResult.id)).filter(ParagraphResult.task_id == TASK_ID).scalar()
+            db.query(ParagraphResult).filter(
+                ParagraphResult.task_id == TASK_ID
+            ).order_by(ParagraphResult.segment_index.desc()).limit(50).all()
+            queries += 1
+        except OperationalError:
+            errors += 1
+        finally:
+            db.close()
+    with lock:
+        stats["reads"] += queries
+        stats["read_errors"] += errors
+
+
+def run_scenario(name: str, pragmas: dict, bulk: bool, args) -> dict:
+    directory = tempfile.mkdtemp(prefix="result-writes-")
+    engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}", connect_args={"check_same_thread": False})
+    configure_sqlite_engine(engine, pragmas)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = Session()
+    db.add(DetectionTask(id=TASK_ID, filename="benchmark.txt", file_size=0, status="processing"))
+    db.commit()
+    db.close()
+
+    stats = {"reads": 0, "read_errors": 0}
+    lock = threading.Lock()
+    stop = threading.Event()
+    readers = [
+        threading.Thread(target=reader_loop, args=(Session, stop, stats, lock), daemon=True)
+        for _ in range(args.readers)
+    ]
+    for reader in readers:
+        reader.start()
+
+    write_errors = 0
+    started = time.perf_counter()
+    for start in range(0, args.rows, args.batch):
+        rows = make_rows(start, min(args.batch, args.rows - start))
+        try:
+            write_batch(Session, rows, bulk)
+        except OperationalError:
+            write_errors += 1
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    for reader in readers:
+        reader.join()
+    engine.dispose()
+    return {
+        "name": name,
+        "seconds": elapsed,
+        "rows_per_second": args.rows / elapsed if elapsed > 0 else 0.0,
+        "reads_per_second": stats["reads"] / elapsed if elapsed > 0 else 0.0,
+        "read_errors": stats["read_errors"],
+        "write_errors": write_errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="片段结果写入的性能测试")
+    parser.add_argument("--rows", type=int, default=5000, help="写入的片段数")
+    parser.add_argument("--batch", type=int, default=20, help="每个事务写入的片段数，与 RESULT_BATCH_SIZE 一致")
+    parser.add_argument("--readers", type=int, default=4, help="并发轮询的线程数")
+    args = parser.parse_args()
+
+    scenarios = [
+        ("默认日志 + ORM逐行", DEFAULT_PRAGMAS, False),
+        ("默认日志 + Core批量", DEFAULT_PRAGMAS, True),
+        ("WAL + ORM逐行", SQLITE_PRAGMAS, False),
+        ("WAL + Core批量", SQLITE_PRAGMAS, True),
+    ]
+    print(f"写入 {args.rows} 个片段，每批 {args.batch} 个，{args.readers} 个并发读线程")
+    print(f"{'场景':<16}{'耗时(秒)':>10}{'写入(行/秒)':>14}{'读取(次/秒)':>14}{'读失败':>8}{'写失败':>8}")
+    for name, pragmas, bulk in scenarios:
+        result = run_scenario(name, pragmas, bulk, args)
+        print(f"{result['name']:<16}{result['seconds']:>10.2f}{result['rows_per_second']:>14.0f}"
+              f"{result['reads_per_second']:>14.0f}{result['read_errors']:>8}{result['write_errors']:>8}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
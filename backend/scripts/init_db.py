@@ -5,16 +5,15 @@ import os
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.utils.database import engine, Base
-from app.schemas.database_models import User, DetectionTask, ParagraphResult
+from app.utils.migrations import run_migrations
 
 def init_db():
     """初始化数据库，创建所有表"""
     print("开始初始化数据库...")
     
-    # 创建所有表
-    Base.metadata.create_all(bind=engine)
-    print("数据库表创建完成")
+    # 创建所有表并执行尚未执行的迁移
+    version = run_migrations()
+    print(f"数据库表创建完成，结构版本 {version}")
 
 if __name__ == "__main__":
     init_db() 
\ No newline at end of file
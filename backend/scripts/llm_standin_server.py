@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+本地LLM替身服务，实现兼容OpenAI的 /chat/completions 接口
+
+用于在不访问真实服务的情况下测试多端点路由、故障转移、对冲和熔断。
+可以启动多个实例模拟不同延迟和错误率的端点，例如：
+
+    python scripts/llm_standin_server.py --port 9001 --latency 0.2
+    python scripts/llm_standin_server.py --port 9002 --latency 1.5 --error-rate 0.3
+
+    LLM_ENDPOINTS='[{"name":"fast","model":"standin","base_url":"http://127.0.0.1:9001/v1"},
+                    {"name":"slow","model":"standin","base_url":"http://127.0.0.1:9002/v1"}]'
+"""
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def build_verdict(user_message: str) -> dict:
+    """根据文本内容生成一个确定性的判断结果"""
+    is_ai = sum(ord(char) for char in user_message) % 2 == 0
+    return {
+        "is_ai_generated": is_ai,
+        "confidence": 70 + len(user_message) % 30,
+        "reason": "替身服务返回的模拟判断：" + ("句式工整、用词平滑，符合AI生成特征" if is_ai else "表达存在个人化的跳跃和停顿，更像人类写作"),
+    }
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    latency = 0.2
+    jitter = 0.0
+    error_rate = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+        if random.random() < self.error_rate:
+            self._send_json(503, {"error": {"message": "stand-in failure", "type": "server_error"}})
+            return
+
+        user_message = next((m.get("content", "") for m in request.get("messages", []) if m.get("role") == "user"), "")
+        content = json.dumps(build_verdict(user_message), ensure_ascii=False)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = request.get("model", "standin")
+        usage = {"prompt_tokens": len(user_message), "completion_tokens": len(content), "total_tokens": len(user_message) + len(content)}
+
+        if request.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            try:
+                for start in range(0, len(content), 8):
+                    chunk = {
+                        "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [{"index": 0, "delta": {"role": "assistant", "content": content[start:start + 8]}, "finish_reason": None}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    time.sleep(0.01)
+                final = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage,
+                }
+                self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+            except (BrokenPipeError, ConnectionResetError):
+                # 客户端拿到判断结论后提前关闭连接
+                pass
+            return
+
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地LLM替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency", type=float, default=0.2, help="平均响应延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟随机抖动范围（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回503错误的概率")
+    args = parser.parse_args()
+
+    StandinHandler.latency = args.latency
+    StandinHandler.jitter = args.jitter
+    StandinHandler.error_rate = args.error_rate
+
+    server = ThreadingHTTPServer((args.host, args.port), StandinHandler)
+    print(f"LLM替身服务已启动: http://{args.host}:{args.port}/v1/chat/completions "
+          f"(latency={args.latency}s, error_rate={args.error_rate})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
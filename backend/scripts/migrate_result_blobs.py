@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+把已完成任务逐行存储的片段结果合并为压缩块（task_result_blobs 表）
+
+新完成的任务在 RESULT_STORAGE=blob 时自动合并，此脚本用于迁移此前完成的任务。
+每个任务在单独的事务中合并并删除原有的行，可以在服务运行时执行，中断后重新执行即可继续。
+
+用法：
+
+    python scripts/migrate_result_blobs.py              # 合并全部已完成的任务
+    python scripts/migrate_result_blobs.py --dry-run    # 只统计，不修改数据库
+    python scripts/migrate_result_blobs.py --vacuum     # 合并后回收数据库文件空间
+    python scripts/migrate_result_blobs.py --restore    # 把压缩块还原为逐行存储（回退）
+"""
+import os
+import sys
+import argparse
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from app.utils.database import engine, SessionLocal
+from app.utils.migrations import run_migrations
+from app.schemas.database_models import DetectionTask, ParagraphResult, TaskResultBlob
+from app.schemas.models import TaskStatus
+from app.services.result_store import compact_rows, encode_results, load_result_blob, delete_result_blob
+from app.services.result_writer import insert_paragraph_results
+
+
+def migrate(dry_run: bool = False) -> int:
+    db = SessionLocal()
+    try:
+        task_ids = [task_id for (task_id,) in db.query(DetectionTask.id).filter(
+            DetectionTask.status == TaskStatus.COMPLETED.value,
+            db.query(ParagraphResult.id).filter(ParagraphResult.task_id == DetectionTask.id).exists()
+        ).all()]
+        print(f"需要合并的已完成任务: {len(task_ids)} 个")
+
+        migrated = rows_total = raw_total = compressed_total = 0
+        for task_id in task_ids:
+            if dry_run:
+                rows = db.query(ParagraphResult).filter(
+                    ParagraphResult.task_id == task_id
+                ).order_by(ParagraphResult.segment_index).all()
+                data, raw_size = encode_results(rows)
+                segment_count = len(rows)
+            else:
+                blob = compact_rows(db, task_id)
+                db.commit()
+                if blob is None:
+                    continue
+                data, raw_size, segment_count = blob.data, blob.raw_size, blob.segment_count
+            migrated += 1
+            rows_total += segment_count
+            raw_total += raw_size
+            compressed_total += len(data)
+
+        action = "可合并" if dry_run else "已合并"
+        print(f"{action} {migrated} 个任务，共 {rows_total} 个片段结果")
+        if raw_total:
+            print(f"压缩块共 {compressed_total} 字节（压缩前 {raw_total} 字节，压缩率 {compressed_total / raw_total:.1%}）")
+        return migrated
+    finally:
+        db.close()
+
+
+def restore() -> int:
+    """把压缩块还原为逐行存储"""
+    db = SessionLocal()
+    try:
+        task_ids = [task_id for (task_id,) in db.query(TaskResultBlob.task_id).all()]
+        for task_id in task_ids:
+            blob = load_result_blob(db, task_id)
+            insert_paragraph_results(db, [
+                {
+                    "task_id": task_id,
+                    "segment_index": paragraph.segment_index,
+                    "paragraph": paragraph.paragraph,
+                    "ai_generated": paragraph.ai_generated,
+                    "reason": paragraph.reason,
+                    "perplexity": paragraph.perplexity,
+                    "confidence": paragraph.confidence,
+                    "ai_likelihood": paragraph.ai_likelihood,
+                    "metrics_data": paragraph.metrics_data,
+                }
+                for paragraph in blob.paragraphs
+            ])
+            delete_result_blob(db, task_id)
+            db.commit()
+        print(f"已还原 {len(task_ids)} 个任务的逐行存储")
+        return len(task_ids)
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把已完成任务的片段结果合并为压缩块")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不修改数据库")
+    parser.add_argument("--vacuum", action="store_true", help="完成后执行VACUUM回收数据库文件空间")
+    parser.add_argument("--restore", action="store_true", help="把压缩块还原为逐行存储")
+    args = parser.parse_args()
+
+    # 创建 task_result_blobs 表
+    run_migrations()
+    if args.restore:
+        restore()
+    else:
+        migrate(dry_run=args.dry_run)
+
+    if args.vacuum and not args.dry_run:
+        with engine.connect() as connection:
+            connection.execute(text("VACUUM"))
+        print("已回收数据库文件空间")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
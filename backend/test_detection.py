@@ -1,6 +1,6 @@
 import asyncio
 import sys
-from app.services.ai_detection_service import detect_ai_content
+from app.services.ai_detection_service import detect_ai_content_comprehensive
 
 async def test_detection():
     """测试AI内容检测功能"""
@@ -13,7 +13,8 @@ async def test_detection():
     """
     
     try:
-        ai_percentage, paragraph_analyses = await detect_ai_content(test_text)
+        result = await detect_ai_content_comprehensive(test_text)
+        ai_percentage, paragraph_analyses = result["ai_percentage"], result["detailed_analysis"]
         
         print(f"\n检测结果: AI内容比例 {ai_percentage:.2f}%\n")
         
@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+import pytest
+
+# 测试直接导入 app 包，与 scripts/ 中的脚本一样把 backend 目录加入路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 导入应用模块前指定临时数据库，避免测试写入开发数据库
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='tests-'), 'app.db')}"
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.utils.migrations import run_migrations
+from app.schemas.database_models import DetectionTask, User
+from app.schemas.models import TaskStatus
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    run_migrations(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session_factory(engine):
+    return sessionmaker(bind=engine)
+
+
+@pytest.fixture
+def db(session_factory):
+    session = session_factory()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def make_task(db):
+    """创建属于指定用户的检测任务"""
+    def _make_task(task_id: str, owner_id: str = "user", status: TaskStatus = TaskStatus.UPLOADED, **values):
+        if db.query(User).filter(User.id == owner_id).first() is None:
+            db.add(User(id=owner_id, email=f"{owner_id}@example.com", username=owner_id))
+        task = DetectionTask(id=task_id, filename=f"{task_id}.txt", file_size=0,
+                             status=status.value, owner_id=owner_id, **values)
+        db.add(task)
+        db.commit()
+        return task
+
+    return _make_task
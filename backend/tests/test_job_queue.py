@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+from app.schemas.database_models import DetectionJob
+from app.schemas.models import JobStatus, TaskStatus
+from app.services.job_queue import job_queue
+from app.services.task_state import current_status
+
+
+def _start(db, make_task, task_id, owner_id="user"):
+    task = make_task(task_id, owner_id=owner_id, status=TaskStatus.PROCESSING)
+    return job_queue.enqueue(db, task)
+
+
+def _expire_lease(db, job_id):
+    db.query(DetectionJob).filter(DetectionJob.id == job_id).update(
+        {DetectionJob.lease_expires_at: datetime.now() - timedelta(seconds=1)}, synchronize_session=False
+    )
+    db.commit()
+
+
+def test_enqueue_returns_existing_active_job(db, make_task):
+    job = _start(db, make_task, "task")
+    assert job_queue.enqueue(db, job.task).id == job.id
+    assert db.query(DetectionJob).count() == 1
+
+
+def test_claim_takes_lease(session_factory, db, make_task):
+    job = _start(db, make_task, "task")
+    claimed = job_queue.claim(db, "worker-a")
+    assert claimed is not None and claimed.id == job.id
+    assert claimed.attempts == 1 and not claimed.resume
+
+    other = session_factory()
+    try:
+        # 租约有效期内其他工作进程领取不到
+        assert job_queue.claim(other, "worker-b") is None
+    finally:
+        other.close()
+    db.refresh(job)
+    assert job.status == JobStatus.RUNNING.value
+    assert job.lease_owner == "worker-a"
+    assert job.lease_expires_at > datetime.now()
+
+
+def test_expired_lease_is_taken_over(db, make_task):
+    job = _start(db, make_task, "task")
+    job_queue.claim(db, "worker-a")
+    _expire_lease(db, job.id)
+
+    claimed = job_queue.claim(db, "worker-b")
+    assert claimed is not None and claimed.id == job.id
+    # 接管的作业已有部分结果，从断点恢复
+    assert claimed.attempts == 2 and claimed.resume
+    # 原工作进程续约失败，停止检测
+    assert not job_queue.heartbeat(db, job.id, "worker-a")
+    assert job_queue.heartbeat(db, job.id, "worker-b")
+
+
+def test_heartbeat_stops_cancelled_task(db, make_task):
+    job = _start(db, make_task, "task")
+    job_queue.claim(db, "worker-a")
+    db.query(type(job.task)).filter_by(id="task").update({"status": TaskStatus.FAILED.value})
+    db.commit()
+    assert not job_queue.heartbeat(db, job.id, "worker-a")
+
+
+def test_reap_requeues_while_attempts_remain(db, make_task):
+    job = _start(db, make_task, "task")
+    job_queue.claim(db, "worker-a")
+    db.refresh(job)
+
+    assert job_queue.reap(db, job, "停滞") == "requeued"
+    db.refresh(job)
+    assert job.status == JobStatus.QUEUED.value
+    assert job.lease_owner is None and job.resume
+    assert job.last_error == "停滞"
+    # 被回收的工作进程不能再续约或结束作业
+    assert not job_queue.heartbeat(db, job.id, "worker-a")
+    assert not job_queue.finish(db, job.id, "worker-a")
+
+
+def test_reap_fails_task_when_attempts_exhausted(db, make_task):
+    job = _start(db, make_task, "task")
+    db.query(DetectionJob).filter(DetectionJob.id == job.id).update({DetectionJob.max_attempts: 1})
+    db.commit()
+    job_queue.claim(db, "worker-a")
+    db.refresh(job)
+
+    assert job_queue.reap(db, job, "超时") == "failed"
+    db.refresh(job)
+    assert job.status == JobStatus.FAILED.value
+    assert current_status(db, "task") == TaskStatus.FAILED
+    # 作业状态已变化，再次回收不生效
+    assert job_queue.reap(db, job, "超时") is None
+
+
+def test_claim_alternates_between_owners(db, make_task):
+    """一个用户先提交了多个作业时，其他用户之后提交的作业不必等它们全部执行完"""
+    for index in range(3):
+        _start(db, make_task, f"heavy-{index}", owner_id="heavy")
+    _start(db, make_task, "light-0", owner_id="light")
+
+    first = job_queue.claim(db, "worker-a")
+    second = job_queue.claim(db, "worker-b")
+    assert first.owner_id == "heavy"
+    assert second.owner_id == "light"
@@ -0,0 +1,101 @@
+import time
+import asyncio
+import threading
+from types import SimpleNamespace
+import pytest
+from app.services.llm_client import llm_client
+from app.services.cancellation import CancellationToken, DetectionCancelled, current_cancel_token
+from app.services.progress import TaskProgress
+
+RESPONSE = '{"is_ai_generated": true, "confidence": 90, "reason": "句式过于工整"}'
+
+
+class StreamingEndpoint:
+    """
+    逐字符返回固定响应的端点，started 在第一次调用开始后置位
+
+    指定 hold_at 时输出到该位置后暂停，held 置位，直到 release 置位后继续输出
+    """
+
+    name = "fake"
+
+    def __init__(self, chunk_delay: float = 0.01, hold_at: int = None):
+        self.chunk_delay = chunk_delay
+        self.hold_at = hold_at
+        self.calls = 0
+        self.started = threading.Event()
+        self.held = threading.Event()
+        self.release = threading.Event()
+
+    def create(self, messages, **kwargs):
+        self.calls += 1
+        self.started.set()
+        return self._chunks()
+
+    def _chunks(self):
+        for position, char in enumerate(RESPONSE):
+            if position == self.hold_at:
+                self.held.set()
+                self.release.wait(timeout=5)
+            time.sleep(self.chunk_delay)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=char))], usage=None)
+
+    def mark_failed(self, latency):
+        pass
+
+
+@pytest.fixture
+def endpoint(monkeypatch):
+    endpoint = StreamingEndpoint()
+    monkeypatch.setattr(llm_client.pool, "choose", lambda exclude=None: endpoint)
+    return endpoint
+
+
+def test_leader_cancellation_does_not_cancel_other_tasks(endpoint):
+    """合并到同一次调用的两个任务中只有一个被取消时，另一个任务自行重新调用并得到结果"""
+    leader_token = CancellationToken("leader")
+    waiter_token = CancellationToken("waiter")
+
+    async def analyze(token):
+        current_cancel_token.set(token)
+        return await llm_client.analyze_text("相同的模板文本", stream=True)
+
+    async def main():
+        leader = asyncio.ensure_future(analyze(leader_token))
+        while not endpoint.started.is_set():
+            await asyncio.sleep(0.005)
+        waiter = asyncio.ensure_future(analyze(waiter_token))
+        await asyncio.sleep(0.05)
+        leader_token.cancel("测试取消")
+        with pytest.raises(DetectionCancelled):
+            await leader
+        return await waiter
+
+    is_ai, reason = asyncio.run(main())
+    assert is_ai is True
+    assert reason == "句式过于工整"
+    assert not waiter_token.is_cancelled
+    assert endpoint.calls == 2
+
+
+def test_verdict_reaches_progress_before_reason(monkeypatch):
+    """判断结论到达后，原因还没有输出完时任务进度中已经可以读取到"""
+    endpoint = StreamingEndpoint(chunk_delay=0, hold_at=RESPONSE.index("句"))
+    monkeypatch.setattr(llm_client.pool, "choose", lambda exclude=None: endpoint)
+    progress = TaskProgress("task")
+
+    async def main():
+        analysis = asyncio.ensure_future(llm_client.analyze_text(
+            "另一段待分析的文本", stream=True, on_verdict=lambda verdict: progress.segment_verdict(3, verdict)
+        ))
+        while not endpoint.held.is_set() or progress.verdicts == 0:
+            assert not analysis.done()
+            await asyncio.sleep(0.005)
+        snapshot = progress.snapshot()
+        endpoint.release.set()
+        return snapshot, await analysis
+
+    snapshot, (is_ai, reason) = asyncio.run(asyncio.wait_for(main(), timeout=5))
+    assert snapshot["verdicts_ready"] == 1 and snapshot["verdicts_ai"] == 1
+    assert snapshot["recent_verdicts"] == [{"index": 3, "is_ai_generated": True, "confidence": 90.0}]
+    assert is_ai is True and reason == "句式过于工整"
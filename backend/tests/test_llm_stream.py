@@ -0,0 +1,47 @@
+from app.services.llm_stream import StreamingVerdictParser, estimate_tokens
+
+
+def test_verdict_is_available_before_reason():
+    parser = StreamingVerdictParser()
+    assert not parser.feed('{"is_ai_generated": true, ')
+    assert not parser.has_verdict
+    # 置信度的数字要等到分隔符出现才算完整
+    assert not parser.feed('"confidence": 8')
+    assert parser.confidence is None
+    assert parser.feed('5, "rea')
+    assert parser.verdict() == {"is_ai_generated": True, "confidence": 85.0}
+    assert parser.reason == ""
+    # 判断结论只在第一次可用时报告
+    assert not parser.feed('son": "句式过于工整"}')
+    assert parser.done
+    assert parser.result() == {"is_ai_generated": True, "confidence": 85, "reason": "句式过于工整"}
+
+
+def test_reason_escapes_across_chunks():
+    parser = StreamingVerdictParser()
+    for chunk in ['{"is_ai_generated": false, "confidence": 30, "reason": "第一行\\', 'n引用\\"原文\\"', '"}']:
+        parser.feed(chunk)
+    assert parser.reason_complete
+    assert parser.reason == '第一行\n引用"原文"'
+    assert parser.reason_tokens == estimate_tokens(parser.reason)
+
+
+def test_reason_is_truncated_at_token_limit():
+    parser = StreamingVerdictParser(reason_max_tokens=5)
+    parser.feed('{"is_ai_generated": true, "confidence": 90, "reason": "')
+    for char in "这段文字的用词和句式都非常像模型生成的内容":
+        parser.feed(char)
+    assert parser.reason_truncated and parser.done
+    assert parser.reason == "这段文字的"
+    result = parser.result()
+    assert result["reason"] == "这段文字的…"
+    assert result["is_ai_generated"] is True and result["confidence"] == 90.0
+
+
+def test_reason_tokens_match_estimate_for_mixed_text():
+    parser = StreamingVerdictParser()
+    text = "使用了 GPT 风格的 transition words，例如 moreover。"
+    parser.feed('{"is_ai_generated": true, "confidence": 70, "reason": "')
+    for char in text:
+        parser.feed(char)
+    assert parser.reason_tokens == estimate_tokens(text)
@@ -0,0 +1,60 @@
+import pytest
+from app.schemas.database_models import BatchSegmentResult, DetectionJob, DetectionTask, ParagraphResult, TaskResultBlob
+from app.schemas.models import TaskStatus
+from app.services.job_queue import ACTIVE_JOB_STATUSES
+
+# 状态轮询、报告、任务列表、作业队列等高频查询，与接口和后台服务中的查询保持一致。
+# 修改这些查询时同步修改这里，涉及的表必须通过索引（或主键）查找，排序不能使用临时B树
+HOT_QUERIES = [
+    ("状态轮询：按ID和所属用户查询任务",
+     lambda db: db.query(DetectionTask).filter(DetectionTask.id == "task", DetectionTask.owner_id == "user")),
+    ("状态轮询和报告：按序号读取片段结果",
+     lambda db: db.query(ParagraphResult).filter(ParagraphResult.task_id == "task").order_by(ParagraphResult.segment_index)),
+    ("状态轮询和报告：读取结果压缩块",
+     lambda db: db.query(TaskResultBlob).filter(TaskResultBlob.task_id == "task")),
+    ("任务列表：按创建时间列出用户的任务",
+     lambda db: db.query(
+         DetectionTask.id,
+         DetectionTask.filename,
+         DetectionTask.status,
+         DetectionTask.ai_generated_percentage,
+         DetectionTask.created_at,
+         DetectionTask.updated_at
+     ).filter(DetectionTask.owner_id == "user").order_by(DetectionTask.created_at)),
+    ("服务启动和看门狗：查询处理中的任务",
+     lambda db: db.query(DetectionTask).filter(DetectionTask.status == TaskStatus.PROCESSING.value)),
+    ("批量检测：查询批次中的任务",
+     lambda db: db.query(DetectionTask).filter(DetectionTask.batch_id == "batch").order_by(DetectionTask.created_at)),
+    ("批量检测：读取批次中相同片段的结果",
+     lambda db: db.query(BatchSegmentResult.result).filter(
+         BatchSegmentResult.batch_id == "batch",
+         BatchSegmentResult.segment_key == "key"
+     )),
+    ("SSE和批次状态：查询任务作业的进度",
+     lambda db: db.query(DetectionJob.progress_data).filter(
+         DetectionJob.task_id == "task",
+         DetectionJob.status.in_(ACTIVE_JOB_STATUSES)
+     )),
+]
+
+
+def _query_plan(db, query):
+    sql = str(query.statement.compile(dialect=db.bind.dialect, compile_kwargs={"literal_binds": True}))
+    return [row[-1] for row in db.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").fetchall()]
+
+
+def _problems_in(plan):
+    """执行计划中的全表扫描和临时排序"""
+    problems = []
+    for detail in plan:
+        if detail.startswith("SCAN ") and " USING " not in detail:
+            problems.append(f"全表扫描: {detail}")
+        if "USE TEMP B-TREE" in detail:
+            problems.append(f"临时排序: {detail}")
+    return problems
+
+
+@pytest.mark.parametrize("build", [build for _, build in HOT_QUERIES], ids=[name for name, _ in HOT_QUERIES])
+def test_hot_query_uses_index(db, build):
+    plan = _query_plan(db, build(db))
+    assert not _problems_in(plan), "\n".join(plan)
@@ -0,0 +1,78 @@
+import random
+import pytest
+
+from app.services.sampling import SequentialSampler, STOP_EXHAUSTED, STOP_PRECISION
+
+
+def _sampler(**kwargs):
+    options = dict(target_half_width=10.0, confidence=0.95, min_samples=5, max_samples=0,
+                   min_segments=10, position_strata=4, perplexity_strata=2)
+    options.update(kwargs)
+    return SequentialSampler(**options)
+
+
+def _run(sampler, labels):
+    while True:
+        index = sampler.draw()
+        if index is None:
+            return
+        sampler.record(index, labels[index])
+
+
+def test_full_observation_is_exact():
+    labels = {index: index % 4 == 0 for index in range(40)}
+    sampler = _sampler(target_half_width=0.0)
+    sampler.stratify({index: float(index % 7) for index in labels}, seed=1)
+    _run(sampler, labels)
+
+    ai_percentage, half_width = sampler.estimate()
+    assert sampler.stop_reason == STOP_EXHAUSTED
+    assert sampler.observed == 40
+    assert ai_percentage == pytest.approx(25.0)
+    assert half_width == 0.0
+
+
+def test_stops_on_precision_and_covers_true_value():
+    rng = random.Random(7)
+    labels = {index: rng.random() < 0.3 for index in range(2000)}
+    truth = sum(labels.values()) / len(labels) * 100
+    sampler = _sampler(target_half_width=8.0)
+    sampler.stratify({index: rng.uniform(10, 60) for index in labels}, seed="doc")
+    _run(sampler, labels)
+
+    ai_percentage, half_width = sampler.estimate()
+    assert sampler.stop_reason == STOP_PRECISION
+    assert half_width <= 8.0
+    assert sampler.observed < len(labels)
+    assert abs(ai_percentage - truth) <= half_width
+    assert len(sampler.unsampled()) == len(labels) - sampler.drawn
+
+
+def test_same_seed_draws_same_segments():
+    perplexities = {index: float(index % 11) for index in range(300)}
+    draws = []
+    for _ in range(2):
+        sampler = _sampler()
+        sampler.stratify(perplexities, seed="doc")
+        draws.append([sampler.draw() for _ in range(20)])
+    assert draws[0] == draws[1]
+
+
+def test_small_document_is_analyzed_exhaustively():
+    labels = {index: False for index in range(6)}
+    sampler = _sampler(min_samples=1, target_half_width=50.0)
+    sampler.stratify({index: 1.0 for index in labels}, seed=0)
+    assert sampler.exhaustive
+    _run(sampler, labels)
+    # 片段数少于 min_segments 时即使精度已满足也不提前停止
+    assert sampler.stop_reason == STOP_EXHAUSTED
+    assert sampler.observed == 6
+
+
+def test_failed_analysis_is_not_counted():
+    sampler = _sampler()
+    sampler.stratify({index: 1.0 for index in range(20)}, seed=0)
+    index = sampler.draw()
+    sampler.record(index, None)
+    assert sampler.drawn == 1 and sampler.observed == 0
+    assert sampler.estimate() == (0.0, 100.0)
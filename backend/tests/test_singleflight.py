@@ -0,0 +1,79 @@
+import asyncio
+import pytest
+from app.services.singleflight import SingleFlight
+
+
+def test_waiter_timeout_does_not_cancel_shared_call():
+    """一个等待者超时后，执行者和其他等待者仍然得到结果"""
+    flight = SingleFlight("test")
+    release = asyncio.Event()
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await release.wait()
+        return "result"
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do_async("key", slow))
+        await asyncio.sleep(0)
+        impatient = asyncio.ensure_future(asyncio.wait_for(flight.do_async("key", slow), timeout=0.01))
+        patient = asyncio.ensure_future(flight.do_async("key", slow))
+        with pytest.raises(asyncio.TimeoutError):
+            await impatient
+        release.set()
+        return await leader, await patient
+
+    assert asyncio.run(main()) == ("result", "result")
+    assert len(calls) == 1
+    assert flight.snapshot()["shared"] == 2
+    assert flight.snapshot()["in_flight"] == 0
+
+
+def test_cancelled_waiter_does_not_cancel_shared_call():
+    """等待者所在的任务被取消，只取消它自己，其他等待者仍然得到结果"""
+    flight = SingleFlight("test")
+    release = asyncio.Event()
+
+    async def slow():
+        await release.wait()
+        return "result"
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do_async("key", slow))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.do_async("key", slow))
+        other = asyncio.ensure_future(flight.do_async("key", slow))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        release.set()
+        return await leader, await other
+
+    assert asyncio.run(main()) == ("result", "result")
+    assert flight.snapshot()["in_flight"] == 0
+
+
+def test_waiter_reexecutes_when_leader_is_cancelled():
+    """执行者被取消时，等待者自行重新执行，而不是跟着收到 CancelledError"""
+    flight = SingleFlight("test")
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do_async("key", work))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.do_async("key", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter
+
+    assert asyncio.run(main()) == 2
+    assert len(calls) == 2
@@ -0,0 +1,48 @@
+import pytest
+from app.schemas.models import TaskStatus
+from app.services.task_state import InvalidTransition, current_status, transition
+
+
+def test_transition_changes_status(db, make_task):
+    make_task("task")
+    assert transition(db, "task", TaskStatus.UPLOADED, TaskStatus.PROCESSING)
+    assert current_status(db, "task") == TaskStatus.PROCESSING
+
+
+def test_transition_loses_race(session_factory, make_task):
+    """两个请求都读到上传状态后同时开始任务，只有先提交的一方成功"""
+    make_task("task")
+    first, second = session_factory(), session_factory()
+    try:
+        assert current_status(first, "task") == TaskStatus.UPLOADED
+        assert current_status(second, "task") == TaskStatus.UPLOADED
+        assert transition(first, "task", TaskStatus.UPLOADED, TaskStatus.PROCESSING)
+        assert not transition(second, "task", TaskStatus.UPLOADED, TaskStatus.PROCESSING)
+        assert current_status(second, "task") == TaskStatus.PROCESSING
+    finally:
+        first.close()
+        second.close()
+
+
+def test_transition_accepts_several_sources(db, make_task):
+    make_task("task", status=TaskStatus.FAILED)
+    assert transition(db, "task", (TaskStatus.PROCESSING, TaskStatus.FAILED), TaskStatus.PROCESSING)
+    assert current_status(db, "task") == TaskStatus.PROCESSING
+
+
+def test_cancel_does_not_overwrite_completed_task(db, make_task):
+    make_task("task", status=TaskStatus.COMPLETED)
+    assert not transition(db, "task", TaskStatus.PROCESSING, TaskStatus.FAILED)
+    assert current_status(db, "task") == TaskStatus.COMPLETED
+
+
+def test_transition_of_missing_task(db):
+    assert not transition(db, "missing", TaskStatus.UPLOADED, TaskStatus.PROCESSING)
+    assert current_status(db, "missing") is None
+
+
+def test_invalid_transition_raises(db, make_task):
+    make_task("task", status=TaskStatus.COMPLETED)
+    with pytest.raises(InvalidTransition):
+        transition(db, "task", TaskStatus.COMPLETED, TaskStatus.PROCESSING)
+    assert current_status(db, "task") == TaskStatus.COMPLETED
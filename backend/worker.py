@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+import argparse
+from app.utils.init_db import init_db
+from app.services.worker import start_worker_processes, JOB_WORKER_PROCESSES
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run detection worker processes")
+    parser.add_argument("-n", "--processes", type=int, default=JOB_WORKER_PROCESSES,
+                        help="number of worker processes")
+    args = parser.parse_args()
+    
+    # Initialize database
+    init_db()
+    
+    # Workers stop taking new jobs on SIGTERM/SIGINT and requeue the job they are running
+    workers = start_worker_processes(max(1, args.processes))
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.join()